@@ -0,0 +1,226 @@
+import os
+import json
+import math
+import hashlib
+import numpy as np
+from config import INDEX_INFO_FILE
+
+# Index types selectable with setup_retriever.py --index-type
+INDEX_TYPES = ["flat", "sqfp16", "sq8", "ivf", "ivfpq", "hnsw"]
+
+# Index types whose vectors can be removed in place during incremental updates
+REMOVABLE_INDEX_TYPES = {"flat", "sqfp16", "sq8", "ivf", "ivfpq"}
+
+# Bits per PQ code. Each sub-quantizer runs k-means with 2**PQ_BITS centroids
+# over the training points, and FAISS needs about 39 points per centroid
+PQ_BITS = 8
+PQ_MIN_TRAIN = 39 * 2**PQ_BITS
+
+
+def default_nlist(count):
+    """Pick an IVF list count of about 4*sqrt(n), keeping >= 39 points per list."""
+    return max(1, min(int(4 * math.sqrt(count)), count // 39))
+
+
+def pq_subquantizers(dim, pq_m):
+    """Return the largest sub-quantizer count <= pq_m that divides dim."""
+    for m in range(min(pq_m, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def index_factory_spec(
+    index_type, dim, count, nlist=None, pq_m=16, hnsw_m=32, train_count=None
+):
+    """
+    Build the faiss.index_factory description for an index type.
+
+    Every type accepts add_with_ids, so chunk ids stay stable whichever index
+    is chosen. IVF types store ids natively; flat and HNSW are wrapped in an
+    IDMap. `train_count` is the number of training points, by default all
+    `count` vectors. With fewer than PQ_MIN_TRAIN of them ivfpq falls back
+    to ivf: shorter codes train on fewer points but lose more recall than
+    under-trained 8-bit ones, and a corpus that small fits in memory
+    uncompressed anyway.
+    """
+    nlist = nlist or default_nlist(count)
+    train_count = count if train_count is None else train_count
+    if index_type == "flat":
+        return "IDMap,Flat"
+    if index_type == "sqfp16":
+        return "IDMap,SQfp16"  # Exact search over half-precision vectors
+    if index_type == "sq8":
+        return "IDMap,SQ8"  # One byte per dimension, ranges trained per dimension
+    if index_type == "ivf":
+        return f"IVF{nlist},Flat"
+    if index_type == "ivfpq":
+        if train_count < PQ_MIN_TRAIN:
+            print(
+                f"[WARNING] {train_count} training points are too few for ivfpq "
+                f"(need {PQ_MIN_TRAIN}); building an ivf index instead"
+            )
+            return f"IVF{nlist},Flat"
+        return f"IVF{nlist},PQ{pq_subquantizers(dim, pq_m)}x{PQ_BITS}"
+    if index_type == "hnsw":
+        return f"IDMap,HNSW{hnsw_m}"
+    raise ValueError(f"Unknown index type {index_type!r}. Choose from {INDEX_TYPES}.")
+
+
+def training_sample(embeddings, sample_size, seed=0):
+    """Pick a reproducible random sample of rows for training."""
+    if len(embeddings) <= sample_size:
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+    rows = np.sort(
+        np.random.default_rng(seed).choice(len(embeddings), sample_size, replace=False)
+    )
+    return np.ascontiguousarray(embeddings[rows], dtype=np.float32)
+
+
+def build_index(index_type, embeddings, sample_size, nlist=None, pq_m=16, hnsw_m=32):
+    """Create an empty index for the embeddings, trained on a sample if needed."""
+    import faiss
+
+    count, dim = embeddings.shape
+    spec = index_factory_spec(
+        index_type, dim, count, nlist, pq_m, hnsw_m, min(count, sample_size)
+    )
+    index = faiss.index_factory(dim, spec)
+    if not index.is_trained:
+        index.train(training_sample(embeddings, sample_size))
+    return index, spec
+
+
+def read_index(path, mmap=False):
+    """
+    Read a saved index, optionally memory-mapped and read-only.
+
+    A memory-mapped index is paged in from the file on demand instead of
+    being copied onto the heap, so processes serving the same index share
+    one copy in the OS page cache. It cannot be modified.
+    """
+    import faiss
+
+    if not mmap:
+        return faiss.read_index(path)
+    # Older faiss versions only map the inverted lists of IVF indexes
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    return faiss.read_index(path, flags | faiss.IO_FLAG_READ_ONLY)
+
+
+def write_index(index, path):
+    """
+    Save an index atomically.
+
+    The new file replaces the old one instead of overwriting it, so
+    processes that have the old index memory-mapped keep a valid mapping.
+    """
+    import faiss
+
+    tmp_path = path + ".tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def vector_bytes(index):
+    """
+    Return the bytes an index spends on the vectors themselves.
+
+    That is the vector count times the size of one stored code, excluding
+    ids, IVF centroids and HNSW links. Returns None for index types whose
+    code size is unknown.
+    """
+    import faiss
+
+    inner = faiss.downcast_index(index)
+    if isinstance(inner, faiss.IndexIDMap):
+        inner = faiss.downcast_index(inner.index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    code_size = getattr(inner, "code_size", None)
+    return int(index.ntotal) * int(code_size) if code_size else None
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Apply query-time parameters that the index type understands."""
+    import faiss
+
+    params = faiss.ParameterSpace()
+    for name, value in (("nprobe", nprobe), ("efSearch", ef_search)):
+        if value is None:
+            continue
+        try:
+            params.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass  # Parameter does not apply to this index type
+
+
+def cosine_baseline(embeddings, sample_size, seed=0):
+    """
+    Mean cosine similarity between distinct chunks in a sample of the corpus.
+
+    Embedding models rarely spread vectors evenly, so unrelated chunks can
+    still score a high raw cosine. This is the level that calibrated scores
+    treat as "unrelated".
+    """
+    sample = training_sample(embeddings, sample_size, seed)
+    if len(sample) < 2:
+        return 0.0
+    norms = np.linalg.norm(sample, axis=1, keepdims=True)
+    sample = sample / np.where(norms > 0, norms, 1.0)
+    similarity = sample @ sample.T
+    count = len(sample)
+    return float((similarity.sum() - np.trace(similarity)) / (count * (count - 1)))
+
+
+def cosine_from_l2(distances, query_norm, norms):
+    """Recover cosine similarity from the squared L2 distances FAISS returns."""
+    scale = 2.0 * query_norm * norms
+    cosine = (query_norm**2 + norms**2 - distances) / np.where(scale > 0, scale, 1.0)
+    return np.clip(cosine, -1.0, 1.0)
+
+
+def calibrate_similarity(cosine, baseline):
+    """Map cosine similarity onto 0 (as similar as unrelated chunks) to 1 (identical)."""
+    return np.clip((cosine - baseline) / max(1.0 - baseline, 1e-6), 0.0, 1.0)
+
+
+def check_dimension(index, embeddings):
+    """Raise a clear error if query embeddings do not fit the index."""
+    if embeddings.shape[-1] != index.d:
+        raise ValueError(
+            f"Query embeddings have {embeddings.shape[-1]} dimensions but the index "
+            f"has {index.d}. Re-run create_embeddings.py and setup_retriever.py "
+            "after changing EMBEDDING_MODEL or EMBEDDING_BACKEND."
+        )
+
+
+def index_version(ids, index_type, embedder=None):
+    """
+    Fingerprint an index by its type, embedder and the chunk ids it holds.
+
+    Chunk ids change whenever chunk content changes, so anything cached
+    against one version of the index is stale once the version differs.
+    They do not change with the embedder, so its model, backend and
+    dimension are part of the fingerprint too.
+    """
+    digest = hashlib.blake2b(index_type.encode("utf-8"), digest_size=8)
+    embedder = {key: (embedder or {}).get(key) for key in ("model", "backend", "dim")}
+    digest.update(json.dumps(embedder, sort_keys=True).encode("utf-8"))
+    digest.update(np.sort(np.asarray(ids, dtype=np.int64)).tobytes())
+    return digest.hexdigest()
+
+
+def load_index_info(path=INDEX_INFO_FILE):
+    """Read the description of the saved index, or None if there is none."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_index_info(info, path=INDEX_INFO_FILE):
+    """Write the description of the saved index."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
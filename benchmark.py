@@ -0,0 +1,859 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import threading
+import contextlib
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+from config import BASE_DIR, EMBEDDING_SCRIPT, EMBEDDING_MODEL, STUB_MODEL
+
+SAMPLE_QUERIES = [
+    "How do I install Ollama on Linux?",
+    "What environment variables configure the server?",
+    "How can I import a GGUF model?",
+    "Which GPUs are supported?",
+    "How do I create a model from a Modelfile?",
+    "What does the /api/generate endpoint return?",
+    "How do I change where models are stored?",
+    "Can Ollama run behind a proxy?",
+]
+
+# Entry points whose cold start is checked by the startup benchmark, and the
+# heavy packages none of them may import until they are actually needed
+STARTUP_MODULES = [
+    "config",
+    "query_model",
+    "query_server",
+    "fetch_docs",
+    "normalize_docs",
+    "chunk_docs",
+    "create_embeddings",
+    "setup_retriever",
+]
+HEAVY_MODULES = {"torch", "transformers", "faiss", "nltk", "bs4"}
+
+# Stages of the end-to-end pipeline benchmark, in the order they run
+PIPELINE_STAGES = ["normalize", "chunk", "embed", "index", "query"]
+
+
+def latency_summary(samples):
+    """Summarise a list of latencies in seconds as milliseconds."""
+    ms = np.array(samples) * 1000.0
+    return {
+        "runs": len(samples),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+    }
+
+
+def bench_subprocess_embedding(queries):
+    """Time the old path: one create_embeddings.py process per query."""
+    samples = []
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "query_embedding.npy")
+        for query in queries:
+            start = time.perf_counter()
+            subprocess.run(
+                [
+                    sys.executable,
+                    EMBEDDING_SCRIPT,
+                    "--query",
+                    query,
+                    "--output",
+                    output,
+                ],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            np.load(output)
+            samples.append(time.perf_counter() - start)
+    return latency_summary(samples)
+
+
+def bench_resident_embedding(queries):
+    """Time the resident embedder, excluding the one-off model load."""
+    from embedder import get_embedder
+
+    start = time.perf_counter()
+    embedder = get_embedder()
+    load_seconds = time.perf_counter() - start
+
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        embedder.embed_query(query)
+        samples.append(time.perf_counter() - start)
+    summary = latency_summary(samples)
+    summary["model_load_ms"] = round(load_seconds * 1000.0, 3)
+    return summary
+
+
+def run_embed(args):
+    """Compare query-embedding latency before and after the resident embedder."""
+    queries = [SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)] for i in range(args.runs)]
+    results = {"benchmark": "query_embedding"}
+    if not args.skip_subprocess:
+        print(
+            f"Timing {args.subprocess_runs} subprocess embeddings...", file=sys.stderr
+        )
+        results["subprocess"] = bench_subprocess_embedding(
+            queries[: args.subprocess_runs]
+        )
+    print(f"Timing {args.runs} resident embeddings...", file=sys.stderr)
+    results["resident"] = bench_resident_embedding(queries)
+    return results
+
+
+def backend_corpus(num_chunks, num_queries, seed=0):
+    """
+    Chunk texts and queries for comparing embedding backends.
+
+    Uses the chunked documentation if there is any, otherwise synthetic
+    paragraphs. Queries are the opening words of randomly picked chunks.
+    """
+    from config import CHUNKED_DOCS_PATH
+
+    rng = np.random.default_rng(seed)
+    names = []
+    if os.path.isdir(CHUNKED_DOCS_PATH):
+        names = sorted(f for f in os.listdir(CHUNKED_DOCS_PATH) if f.endswith(".txt"))
+    if names:
+        picked = sorted(rng.choice(len(names), min(num_chunks, len(names)), False))
+        texts = []
+        for i in picked:
+            with open(os.path.join(CHUNKED_DOCS_PATH, names[i]), encoding="utf-8") as f:
+                texts.append(f.read())
+    else:
+        vocab = synthetic_vocabulary(seed=seed)
+        texts = [" ".join(zipf_words(rng, vocab, 120)) for _ in range(num_chunks)]
+    rows = rng.choice(len(texts), min(num_queries, len(texts)), replace=False)
+    queries = [" ".join(texts[i].split()[:16]) for i in rows]
+    return texts, queries
+
+
+def run_backends(args):
+    """
+    Compare embedding backends on throughput and retrieval quality.
+
+    Every backend embeds the same chunks and queries. Quality is recall@k of
+    exact search over its own vectors against the top-k of the reference
+    backend, plus the mean cosine between its chunk vectors and the
+    reference's. The recommendation is the fastest backend whose recall stays
+    within --tolerance of the reference.
+    """
+    import faiss
+    from embedder import create_embedder
+
+    texts, queries = backend_corpus(args.chunks, args.queries)
+    results = {
+        "benchmark": "backends",
+        "model": args.model,
+        "chunks": len(texts),
+        "queries": len(queries),
+        "k": args.k,
+        "reference": args.reference,
+        "backends": {},
+    }
+    backends = [args.reference] + [b for b in args.backends if b != args.reference]
+    vectors = {}
+    for backend in backends:
+        print(f"Benchmarking the {backend} backend...", file=sys.stderr)
+        start = time.perf_counter()
+        try:
+            embedder = create_embedder(args.model, backend, args.threads)
+        except ImportError as e:
+            results["backends"][backend] = {"skipped": str(e)}
+            continue
+        load_seconds = time.perf_counter() - start
+
+        embedder.embed_batch(texts[: args.batch_size])  # Warm up
+        start = time.perf_counter()
+        chunk_vectors = embedder.embed_batch(texts, batch_size=args.batch_size)
+        embed_seconds = time.perf_counter() - start
+        samples = []
+        for query in queries:
+            start = time.perf_counter()
+            embedder.embed_query(query)
+            samples.append(time.perf_counter() - start)
+        vectors[backend] = chunk_vectors, embedder.embed_batch(queries)
+        results["backends"][backend] = {
+            "dim": int(embedder.dim),
+            "load_ms": round(load_seconds * 1000.0, 3),
+            "chunks_per_sec": round(len(texts) / embed_seconds, 1),
+            "query": latency_summary(samples),
+        }
+        del embedder
+
+    if args.reference not in vectors:
+        raise SystemExit(f"The reference backend {args.reference} could not run")
+    k = min(args.k, len(texts))
+
+    def top_k(chunk_vectors, query_vectors):
+        index = faiss.IndexFlatL2(chunk_vectors.shape[1])
+        index.add(np.ascontiguousarray(chunk_vectors, dtype=np.float32))
+        return index.search(np.ascontiguousarray(query_vectors, dtype=np.float32), k)[1]
+
+    def unit(matrix):
+        return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+    reference_chunks, reference_queries = vectors[args.reference]
+    truth = top_k(reference_chunks, reference_queries)
+    eligible = []
+    for backend, (chunk_vectors, query_vectors) in vectors.items():
+        found = top_k(chunk_vectors, query_vectors)
+        hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+        recall = hits / float(truth.size)
+        entry = results["backends"][backend]
+        entry["recall_at_k"] = round(recall, 4)
+        if chunk_vectors.shape == reference_chunks.shape:
+            cosine = (unit(chunk_vectors) * unit(reference_chunks)).sum(axis=1)
+            entry["mean_cosine_to_reference"] = round(float(cosine.mean()), 5)
+        if recall >= 1.0 - args.tolerance:
+            eligible.append((entry["chunks_per_sec"], backend))
+    results["recommended"] = max(eligible)[1]
+    return results
+
+
+def run_server(args):
+    """
+    Measure retrieval throughput and latency of a running query server.
+
+    Every request sends a different query, so the server's query cache never
+    answers and retrieval itself is measured. With `--cached`, the sample
+    queries repeat and the cached path is measured instead.
+    """
+    import requests
+    from concurrent.futures import ThreadPoolExecutor
+
+    sessions = {}
+
+    def one_request(i):
+        # One keep-alive session per client thread
+        session = sessions.setdefault(threading.get_ident(), requests.Session())
+        query = SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)]
+        if not args.cached:
+            query = f"{query} (request {i})"
+        start = time.perf_counter()
+        response = session.post(f"{args.url}/retrieve", json={"query": query})
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        samples = list(pool.map(one_request, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    summary = latency_summary(samples)
+    summary["benchmark"] = "server_retrieve"
+    summary["concurrency"] = args.concurrency
+    summary["cached"] = args.cached
+    summary["requests_per_sec"] = round(args.requests / elapsed, 2)
+    return summary
+
+
+def import_profile(module):
+    """
+    Import a module in a fresh interpreter with `python -X importtime`.
+
+    Returns the module's cumulative import time and the heavy packages that
+    were pulled in while importing it.
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=BASE_DIR,
+    )
+    wall_seconds = time.perf_counter() - start
+
+    import_us = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        # Lines look like "import time:  self [us] | cumulative | package"
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].strip()
+        imported.add(name.split(".")[0])
+        if name == module:
+            import_us = int(fields[1])
+    return {
+        "import_ms": round(import_us / 1000.0, 3) if import_us else None,
+        "wall_ms": round(wall_seconds * 1000.0, 3),
+        "heavy_imports": sorted(imported & HEAVY_MODULES),
+    }
+
+
+def run_startup(args):
+    """Check that entry points import quickly and without heavy packages."""
+    results = {"benchmark": "startup", "modules": {}}
+    failures = []
+    for module in args.modules:
+        profile = import_profile(module)
+        results["modules"][module] = profile
+        if profile["heavy_imports"]:
+            failures.append(f"{module} imports {', '.join(profile['heavy_imports'])}")
+        if args.max_import_ms and (profile["import_ms"] or 0) > args.max_import_ms:
+            failures.append(
+                f"{module} takes {profile['import_ms']}ms to import "
+                f"(budget {args.max_import_ms}ms)"
+            )
+    for failure in failures:
+        print(f"[FAIL] {failure}", file=sys.stderr)
+    results["passed"] = not failures
+    return results
+
+
+def run_fetch(args):
+    """Time a cold and an incremental docs sync against a local stub site."""
+    from fetch_docs import fetch_docs
+    from stub_docs import make_pages, start_stub_server
+
+    pages = make_pages(args.pages, args.page_size)
+    server, url = start_stub_server(pages)
+    results = {"benchmark": "fetch", "pages": args.pages, "workers": args.workers}
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_dir = os.path.join(tmp, "Raw")
+        manifest_path = os.path.join(tmp, "fetch_manifest.json")
+        for name in ("cold", "incremental"):
+            if name == "incremental":
+                for page in sorted(pages)[: args.changed]:
+                    pages[page] += b"\nUpdated.\n"
+            bytes_before = server.stats["bytes"]
+            start = time.perf_counter()
+            stats = fetch_docs(url, args.workers, raw_dir, manifest_path)
+            stats["seconds"] = round(time.perf_counter() - start, 3)
+            stats["bytes_sent"] = server.stats["bytes"] - bytes_before
+            results[name] = stats
+    server.shutdown()
+    return results
+
+
+def synthetic_vocabulary(size=20000, seed=0):
+    """Pseudo-words of 3-10 letters, in a fixed order for a given seed."""
+    rng = np.random.default_rng(seed)
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    lengths = rng.integers(3, 11, size=size)
+    return np.array(["".join(rng.choice(letters, n)) for n in lengths])
+
+
+def zipf_words(rng, vocab, shape):
+    """Sample words with a Zipf-like frequency distribution, like real text."""
+    ranks = np.minimum(rng.zipf(1.3, size=shape) - 1, len(vocab) - 1)
+    return vocab[ranks]
+
+
+def generate_corpus(raw_dir, num_chunks, sections_per_doc=50, seed=0):
+    """
+    Write synthetic markdown documents that chunk into about num_chunks chunks.
+
+    Each document has a title and `sections_per_doc` sections of ten short
+    sentences, sized so that one section fits in one chunk with the stub
+    tokenizer. Returns (documents, bytes written).
+    """
+    os.makedirs(raw_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    vocab = synthetic_vocabulary(seed=seed)
+    num_docs = -(-num_chunks // sections_per_doc)
+    written = 0
+    for doc in range(num_docs):
+        sections = min(sections_per_doc, num_chunks - doc * sections_per_doc)
+        words = zipf_words(rng, vocab, (sections, 10, 14))
+        parts = [f"# Document {doc}\n"]
+        for section in range(sections):
+            sentences = ". ".join(" ".join(sentence) for sentence in words[section])
+            parts.append(f"## Section {section}\n\n{sentences.capitalize()}.\n")
+        text = "\n".join(parts)
+        with open(os.path.join(raw_dir, f"doc_{doc:06d}.md"), "w") as f:
+            f.write(text)
+        written += len(text)
+    return num_docs, written
+
+
+def synthetic_queries(count, seed=1):
+    """Short queries drawn from the same vocabulary as the corpus."""
+    rng = np.random.default_rng(seed)
+    vocab = synthetic_vocabulary(seed=0)
+    return [" ".join(zipf_words(rng, vocab, rng.integers(3, 8))) for _ in range(count)]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and its finished children."""
+    peak_kb = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return round(peak_kb / 1024.0, 1)
+
+
+@contextlib.contextmanager
+def stdout_to_stderr():
+    """Send this process's and its children's stdout to stderr."""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    os.dup2(2, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+def bench_query_stage(args):
+    """Time index loading, query embedding, retrieval and stub generation."""
+    import ollama_client
+    from stub_ollama import start_stub_server
+    from embedder import get_embedder
+    from query_model import load_faiss_index, retrieve_chunk, generate_answer
+
+    start = time.perf_counter()
+    index, chunk_map = load_faiss_index()
+    results = {"load_index_ms": round((time.perf_counter() - start) * 1000.0, 3)}
+
+    queries = synthetic_queries(args.queries)
+    embedder = get_embedder()
+    embed_samples, retrieve_samples, contexts = [], [], []
+    for query in queries:
+        start = time.perf_counter()
+        query_embedding = embedder.embed_query(query)
+        embedded = time.perf_counter()
+        contexts.append(retrieve_chunk(index, chunk_map, query_embedding, query))
+        embed_samples.append(embedded - start)
+        retrieve_samples.append(time.perf_counter() - embedded)
+    results["embed_query"] = latency_summary(embed_samples)
+    results["retrieve"] = latency_summary(retrieve_samples)
+    results["queries_per_sec"] = round(
+        len(queries) / (sum(embed_samples) + sum(retrieve_samples)), 2
+    )
+
+    # Generation goes through the real client against the stub Ollama server
+    server, url = start_stub_server()
+    ollama_client._client = ollama_client.OllamaClient(url)
+    first_token, prompt_tokens = [], []
+    for query, context in list(zip(queries, contexts))[: args.generations]:
+        _, metrics = generate_answer("stub", context, query)
+        if metrics.get("time_to_first_token_s") is not None:
+            first_token.append(metrics["time_to_first_token_s"])
+        if metrics.get("prompt_eval_count") is not None:
+            prompt_tokens.append(metrics["prompt_eval_count"])
+    server.shutdown()
+    if first_token:
+        results["time_to_first_token"] = latency_summary(first_token)
+    if prompt_tokens:
+        # Prompt words evaluated per answer after the cached system prompt
+        results["prompt_eval_words_mean"] = round(float(np.mean(prompt_tokens)), 1)
+    return results
+
+
+def run_pipeline_stage(args):
+    """Run one pipeline stage in this process and report its cost."""
+    from config import CHUNKED_DOCS_PATH, ensure_directories
+
+    ensure_directories()
+    start = time.perf_counter()
+    # Pipeline progress goes to stderr; stdout carries only the results
+    with stdout_to_stderr():
+        if args.stage == "normalize":
+            from normalize_docs import normalize_docs
+
+            stats = normalize_docs(workers=args.workers)
+            results = {
+                "documents": stats["normalized"],
+                "bytes_in": stats["bytes_in"],
+                "bytes_out": stats["bytes_out"],
+            }
+        elif args.stage == "chunk":
+            from chunk_docs import process_files
+
+            process_files(workers=args.workers)
+            count = sum(1 for f in os.listdir(CHUNKED_DOCS_PATH) if f.endswith(".txt"))
+            results = {"chunks": count}
+        elif args.stage == "embed":
+            from create_embeddings import process_files, list_chunks
+
+            process_files()
+            results = {"chunks": len(list_chunks())}
+        elif args.stage == "index":
+            from setup_retriever import setup_faiss_index
+
+            index, _ = setup_faiss_index(rebuild=True, index_type=args.index_type)
+            results = {"vectors": int(index.ntotal)}
+        else:
+            results = bench_query_stage(args)
+    seconds = time.perf_counter() - start
+
+    results["seconds"] = round(seconds, 3)
+    count = results.get("documents", results.get("chunks", results.get("vectors")))
+    if count is not None:
+        results["per_sec"] = round(count / seconds, 1) if seconds > 0 else None
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def run_pipeline(args):
+    """
+    Benchmark every pipeline stage on a synthetic corpus.
+
+    Each stage runs in its own process against a scratch RAG_DIR, so its peak
+    RSS is measured on its own. With the default stub model, embeddings come
+    from the hashing embedder and answers from the stub Ollama server, so the
+    benchmark runs offline on CPU.
+    """
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag-bench-")
+    env = dict(os.environ, RAG_DIR=workdir, EMBEDDING_MODEL=args.model)
+    results = {
+        "benchmark": "pipeline",
+        "chunks_requested": args.chunks,
+        "model": args.model,
+        "index_type": args.index_type,
+    }
+
+    start = time.perf_counter()
+    docs, written = generate_corpus(
+        os.path.join(workdir, "Docs", "Raw"), args.chunks, seed=args.seed
+    )
+    results["corpus"] = {
+        "documents": docs,
+        "bytes": written,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    results["stages"] = {}
+
+    try:
+        for stage in args.stages:
+            print(f"Running stage {stage}...", file=sys.stderr)
+            completed = subprocess.run(
+                [
+                    sys.executable,
+                    os.path.abspath(__file__),
+                    "pipeline-stage",
+                    stage,
+                    "--workers",
+                    str(args.workers),
+                    "--index-type",
+                    args.index_type,
+                    "--queries",
+                    str(args.queries),
+                    "--generations",
+                    str(args.generations),
+                ],
+                env=env,
+                cwd=BASE_DIR,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=None if args.verbose else subprocess.DEVNULL,
+                text=True,
+            )
+            results["stages"][stage] = json.loads(completed.stdout)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def memory_usage_mb():
+    """
+    Current memory of this process from /proc: resident (RSS), proportional
+    (PSS, shared pages divided between the processes mapping them) and unique
+    (USS, pages no other process maps). Linux only; None elsewhere.
+    """
+    fields = {"Rss": 0, "Pss": 0, "Private_Clean": 0, "Private_Dirty": 0}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                name, value = line.split()[:2]
+                if name.rstrip(":") in fields:
+                    fields[name.rstrip(":")] = int(value)
+    except OSError:
+        return None
+    return {
+        "rss_mb": round(fields["Rss"] / 1024.0, 1),
+        "pss_mb": round(fields["Pss"] / 1024.0, 1),
+        "uss_mb": round(
+            (fields["Private_Clean"] + fields["Private_Dirty"]) / 1024.0, 1
+        ),
+    }
+
+
+def evict_from_page_cache(directory):
+    """Ask the OS to drop a directory's files from the page cache."""
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            continue
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def run_load_worker(args):
+    """
+    Load the index like a serving process, run queries, then wait.
+
+    Reports the load time once it is ready and its memory when told to, so
+    the parent measures every worker while all of them are alive.
+    """
+    from embedder import get_embedder
+    from query_model import load_faiss_index, retrieve_chunk
+
+    with stdout_to_stderr():
+        start = time.perf_counter()
+        index, chunk_map = load_faiss_index(mmap=args.mmap)
+        load_ms = (time.perf_counter() - start) * 1000.0
+        embedder = get_embedder()
+        start = time.perf_counter()
+        for query in synthetic_queries(args.queries):
+            retrieve_chunk(index, chunk_map, embedder.embed_query(query), query)
+        query_ms = (time.perf_counter() - start) * 1000.0
+
+    print(json.dumps({"load_ms": round(load_ms, 3)}), flush=True)
+    sys.stdin.readline()  # Wait until every worker is ready
+    results = {
+        "load_ms": round(load_ms, 3),
+        "first_queries_ms": round(query_ms, 3),
+        "memory": memory_usage_mb(),
+    }
+    return results
+
+
+def run_load(args):
+    """
+    Compare heap and memory-mapped index loading across worker processes.
+
+    For each mode, `--workers` processes load the same index and run a few
+    queries at the same time, first with the index files evicted from the
+    page cache (cold) and then again with them cached (warm). Reports each
+    worker's load time and RSS / PSS / USS; the PSS total is what the workers
+    really cost together. Each worker searches on one thread, as it would
+    when several share a machine.
+    """
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag-bench-")
+    env = dict(os.environ, RAG_DIR=workdir, EMBEDDING_MODEL=args.model)
+    results = {"benchmark": "load", "workers": args.workers, "model": args.model}
+    try:
+        indexes_path = os.path.join(workdir, "Docs", "Embeddings", "Indexes")
+        if not os.path.exists(os.path.join(indexes_path, "retriever.index")):
+            print(f"Building a {args.chunks}-chunk index...", file=sys.stderr)
+            run_pipeline(
+                argparse.Namespace(
+                    workdir=workdir,
+                    chunks=args.chunks,
+                    model=args.model,
+                    index_type=args.index_type,
+                    workers=os.cpu_count() or 1,
+                    queries=0,
+                    generations=0,
+                    stages=["normalize", "chunk", "embed", "index"],
+                    seed=0,
+                    output=None,
+                    verbose=False,
+                )
+            )
+        results["index_mb"] = round(
+            sum(
+                os.path.getsize(os.path.join(indexes_path, name))
+                for name in os.listdir(indexes_path)
+            )
+            / 2**20,
+            1,
+        )
+
+        for mode in ("heap", "mmap"):
+            results[mode] = {}
+            for temperature in ("cold", "warm"):
+                if temperature == "cold":
+                    evict_from_page_cache(indexes_path)
+                command = [
+                    sys.executable,
+                    os.path.abspath(__file__),
+                    "load-worker",
+                    "--queries",
+                    str(args.queries),
+                ] + (["--mmap"] if mode == "mmap" else [])
+                workers = [
+                    subprocess.Popen(
+                        command,
+                        env=dict(env, OMP_NUM_THREADS="1"),
+                        cwd=BASE_DIR,
+                        stdin=subprocess.PIPE,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.DEVNULL,
+                        text=True,
+                    )
+                    for _ in range(args.workers)
+                ]
+                for worker in workers:
+                    worker.stdout.readline()  # Loaded and queried
+                reports = [
+                    json.loads(worker.communicate("measure\n")[0]) for worker in workers
+                ]
+
+                load_ms = [report["load_ms"] for report in reports]
+                summary = {
+                    "load_ms_mean": round(float(np.mean(load_ms)), 3),
+                    "load_ms_max": round(float(np.max(load_ms)), 3),
+                    "first_queries_ms_mean": round(
+                        float(np.mean([r["first_queries_ms"] for r in reports])), 3
+                    ),
+                }
+                if all(report["memory"] for report in reports):
+                    for field in ("rss_mb", "pss_mb", "uss_mb"):
+                        values = [report["memory"][field] for report in reports]
+                        summary[f"{field}_per_worker"] = round(
+                            float(np.mean(values)), 1
+                        )
+                    summary["pss_mb_total"] = round(
+                        sum(report["memory"]["pss_mb"] for report in reports), 1
+                    )
+                results[mode][temperature] = summary
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the RAG pipeline")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    embed_parser = subparsers.add_parser(
+        "embed", help="Query-embedding latency, subprocess vs. resident model"
+    )
+    embed_parser.add_argument("--runs", type=int, default=200)
+    embed_parser.add_argument("--subprocess-runs", type=int, default=10)
+    embed_parser.add_argument("--skip-subprocess", action="store_true")
+    embed_parser.set_defaults(func=run_embed)
+
+    backends_parser = subparsers.add_parser(
+        "backends", help="Embedding backends: throughput vs. retrieval recall"
+    )
+    backends_parser.add_argument("--model", default=EMBEDDING_MODEL)
+    backends_parser.add_argument(
+        "--backends", nargs="+", default=["torch", "int8", "onnx", "onnx-int8"]
+    )
+    backends_parser.add_argument("--reference", default="torch")
+    backends_parser.add_argument("--chunks", type=int, default=1000)
+    backends_parser.add_argument("--queries", type=int, default=100)
+    backends_parser.add_argument("--k", type=int, default=10)
+    backends_parser.add_argument("--batch-size", type=int, default=32)
+    backends_parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    backends_parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.05,
+        help="Largest acceptable drop in recall@k against the reference",
+    )
+    backends_parser.set_defaults(func=run_backends)
+
+    server_parser = subparsers.add_parser(
+        "server", help="Retrieval requests/sec against a running query_server.py"
+    )
+    server_parser.add_argument("--url", default="http://127.0.0.1:8000")
+    server_parser.add_argument("--requests", type=int, default=2000)
+    server_parser.add_argument("--concurrency", type=int, default=32)
+    server_parser.add_argument(
+        "--cached",
+        action="store_true",
+        help="Repeat the sample queries, measuring query cache hits",
+    )
+    server_parser.set_defaults(func=run_server)
+
+    fetch_parser = subparsers.add_parser(
+        "fetch", help="Cold vs. incremental docs sync against a local stub site"
+    )
+    fetch_parser.add_argument("--pages", type=int, default=2000)
+    fetch_parser.add_argument("--page-size", type=int, default=4096)
+    fetch_parser.add_argument("--changed", type=int, default=20)
+    fetch_parser.add_argument("--workers", type=int, default=8)
+    fetch_parser.set_defaults(func=run_fetch)
+
+    pipeline_parser = subparsers.add_parser(
+        "pipeline", help="Time every pipeline stage on a synthetic corpus"
+    )
+    pipeline_parser.add_argument(
+        "--chunks", type=int, default=10000, help="Approximate corpus size in chunks"
+    )
+    pipeline_parser.add_argument(
+        "--model",
+        default=STUB_MODEL,
+        help="Embedding model; the default stub runs offline",
+    )
+    pipeline_parser.add_argument("--index-type", default="flat")
+    pipeline_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    pipeline_parser.add_argument("--queries", type=int, default=200)
+    pipeline_parser.add_argument("--generations", type=int, default=20)
+    pipeline_parser.add_argument(
+        "--stages", nargs="+", choices=PIPELINE_STAGES, default=PIPELINE_STAGES
+    )
+    pipeline_parser.add_argument("--seed", type=int, default=0)
+    pipeline_parser.add_argument(
+        "--workdir", help="Keep the corpus and index here instead of a temp dir"
+    )
+    pipeline_parser.add_argument("--output", help="Also write the results here")
+    pipeline_parser.add_argument(
+        "--verbose", action="store_true", help="Show pipeline output"
+    )
+    pipeline_parser.set_defaults(func=run_pipeline)
+
+    stage_parser = subparsers.add_parser(
+        "pipeline-stage", help="Run one stage of 'pipeline' (used internally)"
+    )
+    stage_parser.add_argument("stage", choices=PIPELINE_STAGES)
+    stage_parser.add_argument("--workers", type=int, default=1)
+    stage_parser.add_argument("--index-type", default="flat")
+    stage_parser.add_argument("--queries", type=int, default=200)
+    stage_parser.add_argument("--generations", type=int, default=20)
+    stage_parser.set_defaults(func=run_pipeline_stage)
+
+    load_parser = subparsers.add_parser(
+        "load", help="Per-worker memory and load time, heap vs. memory-mapped index"
+    )
+    load_parser.add_argument("--workers", type=int, default=4)
+    load_parser.add_argument(
+        "--chunks", type=int, default=50000, help="Size of the synthetic index"
+    )
+    load_parser.add_argument("--model", default=STUB_MODEL)
+    load_parser.add_argument("--index-type", default="flat")
+    load_parser.add_argument("--queries", type=int, default=20)
+    load_parser.add_argument("--workdir", help="Reuse or keep the synthetic index here")
+    load_parser.set_defaults(func=run_load)
+
+    load_worker_parser = subparsers.add_parser(
+        "load-worker", help="One worker of 'load' (used internally)"
+    )
+    load_worker_parser.add_argument("--mmap", action="store_true")
+    load_worker_parser.add_argument("--queries", type=int, default=20)
+    load_worker_parser.set_defaults(func=run_load_worker)
+
+    startup_parser = subparsers.add_parser(
+        "startup", help="Import time of each entry point, guarding cold start"
+    )
+    startup_parser.add_argument("--modules", nargs="+", default=STARTUP_MODULES)
+    startup_parser.add_argument(
+        "--max-import-ms",
+        type=float,
+        default=None,
+        help="Fail if any module takes longer than this to import",
+    )
+    startup_parser.set_defaults(func=run_startup)
+
+    args = parser.parse_args()
+    results = args.func(args)
+    print(json.dumps(results, indent=2))
+    if not results.get("passed", True):
+        sys.exit(1)
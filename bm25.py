@@ -0,0 +1,127 @@
+import os
+import re
+import json
+import math
+import numpy as np
+from array import array
+from collections import Counter
+from config import (
+    BM25_TERMS_FILE,
+    BM25_TERM_TEXT_FILE,
+    BM25_STATS_FILE,
+    BM25_POSTINGS_FILE,
+    BM25_IMPACTS_FILE,
+    BM25_K1,
+    BM25_B,
+    BM25_MAX_DF_RATIO,
+    INDEXES_PATH,
+    relocate,
+)
+from manifest import save_array
+from term_table import save_term_table, TermTable
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Lowercase word tokens used for both indexing and querying."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def build_bm25(texts, k1=BM25_K1, b=BM25_B):
+    """
+    Build the on-disk BM25 inverted index over chunk texts.
+
+    `texts` yields chunk text in catalogue row order. Postings are stored as
+    two flat arrays grouped by term: the chunk row and its precomputed BM25
+    impact (the tf and length-normalisation part of the score). A term table
+    (see term_table.py) records where each term's postings start and how
+    many there are, so a query only touches the postings of its own terms
+    and multiplies by idf.
+    """
+    vocab = {}
+    term_ids = array("i")
+    rows = array("i")
+    tfs = array("i")
+    doc_lengths = array("i")
+    for row, text in enumerate(texts):
+        counts = Counter(tokenize(text))
+        doc_lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            term_ids.append(vocab.setdefault(term, len(vocab)))
+            rows.append(row)
+            tfs.append(tf)
+
+    term_ids = np.array(term_ids, dtype=np.int32)
+    order = np.argsort(term_ids, kind="stable")  # Rows stay ascending per term
+    df = np.bincount(term_ids, minlength=len(vocab))
+    starts = np.concatenate([[0], np.cumsum(df)[:-1]]).astype(np.int64)
+
+    rows = np.array(rows, dtype=np.int32)[order]
+    tfs = np.array(tfs, dtype=np.float32)[order]
+    doc_lengths = np.array(doc_lengths, dtype=np.float32)
+    avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 1.0
+    norm = k1 * (1.0 - b + b * doc_lengths[rows] / avg_length)
+    impacts = (tfs * (k1 + 1.0) / (tfs + norm)).astype(np.float32)
+
+    save_array(BM25_POSTINGS_FILE, rows)
+    save_array(BM25_IMPACTS_FILE, impacts)
+    # Terms are numbered in order of first appearance, as dicts keep them
+    save_term_table(BM25_TERMS_FILE, BM25_TERM_TEXT_FILE, list(vocab), starts, df)
+    with open(BM25_STATS_FILE, "w", encoding="utf-8") as f:
+        json.dump({"num_docs": len(doc_lengths), "k1": k1, "b": b}, f)
+    print(f"Built BM25 index with {len(vocab)} terms over {len(doc_lengths)} chunks")
+
+
+class BM25Index:
+    """Query-time view of the BM25 index with memory-mapped terms and postings."""
+
+    def __init__(self, ids, max_df_ratio=BM25_MAX_DF_RATIO, path=INDEXES_PATH):
+        self.terms = TermTable(
+            relocate(BM25_TERMS_FILE, path), relocate(BM25_TERM_TEXT_FILE, path)
+        )
+        with open(relocate(BM25_STATS_FILE, path), encoding="utf-8") as f:
+            self.num_docs = json.load(f)["num_docs"]
+        self.postings = np.load(relocate(BM25_POSTINGS_FILE, path), mmap_mode="r")
+        self.impacts = np.load(relocate(BM25_IMPACTS_FILE, path), mmap_mode="r")
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.max_df = max(1, int(max_df_ratio * self.num_docs))
+
+    @staticmethod
+    def exists(path=INDEXES_PATH):
+        """Check whether the BM25 index files have been built in `path`."""
+        return all(
+            os.path.exists(relocate(file_path, path))
+            for file_path in (
+                BM25_TERMS_FILE,
+                BM25_TERM_TEXT_FILE,
+                BM25_STATS_FILE,
+                BM25_POSTINGS_FILE,
+                BM25_IMPACTS_FILE,
+            )
+        )
+
+    def search(self, query, k):
+        """Return (chunk ids, scores) of the top-k chunks, best first."""
+        found = self.terms.lookup(set(tokenize(query)))
+        entries = list(zip(self.terms.starts[found], self.terms.counts[found]))
+        # Terms in most chunks add little but cost the most; skip them if we can
+        selective = [entry for entry in entries if entry[1] <= self.max_df]
+        entries = selective or entries
+        if not entries:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        # Rows are unique within a term's postings, so scores can be summed
+        # into a dense accumulator without sorting or deduplicating
+        totals = np.zeros(self.num_docs, dtype=np.float32)
+        for start, df in entries:
+            idf = math.log(1.0 + (self.num_docs - df + 0.5) / (df + 0.5))
+            rows = self.postings[start : start + df]
+            totals[rows] += idf * self.impacts[start : start + df]
+
+        candidates = np.flatnonzero(totals)
+        scores = totals[candidates]
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return self.ids[candidates[top]], scores[top]
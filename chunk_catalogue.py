@@ -0,0 +1,252 @@
+import os
+import mmap
+import numpy as np
+from collections import defaultdict
+from bm25 import BM25Index
+from config import (
+    CHUNKED_DOCS_PATH,
+    CHUNK_MANIFEST,
+    CATALOGUE_TEXT_FILE,
+    CATALOGUE_ROWS_FILE,
+    CATALOGUE_LOOKUP_FILE,
+    CATALOGUE_NAMES_FILE,
+    CATALOGUE_KEYWORDS_FILE,
+    CATALOGUE_KEYWORD_TEXT_FILE,
+    CATALOGUE_KEYWORD_ROWS_FILE,
+    INDEX_MMAP,
+    INDEX_INFO_FILE,
+    INDEXES_PATH,
+    relocate,
+)
+from ann_index import load_index_info
+from manifest import save_array, load_manifest
+from term_table import pack_strings, unpack_string, save_term_table, TermTable
+
+
+def filename_tokens(file_name):
+    """Split a chunk filename into the lowercase words used for keyword matching."""
+    file_base = os.path.splitext(file_name)[0]
+    return set(
+        word.lower() for word in file_base.split("_") if word.lower() not in ["chunk"]
+    )
+
+
+def chunk_token_counts():
+    """Return the token count chunk_docs.py recorded for each chunk filename."""
+    counts = {}
+    for doc in load_manifest(CHUNK_MANIFEST).get("docs", {}).values():
+        for name, meta in doc.get("metadata", {}).items():
+            if "tokens" in meta:
+                counts[name] = meta["tokens"]
+    return counts
+
+
+# Layout of one catalogue row
+ROW_DTYPE = np.dtype(
+    [
+        ("id", np.int64),
+        ("start", np.int64),  # Byte range of the chunk text in the text blob
+        ("end", np.int64),
+        ("name_start", np.int64),  # Byte range of the filename in the names blob
+        ("name_end", np.int64),
+        ("norm", np.float32),  # Length of the chunk's embedding
+        ("keywords", np.int32),  # Number of filename words
+        ("tokens", np.int32),  # Length of the chunk text in model tokens
+    ]
+)
+
+
+def build_catalogue(ids, names, norms):
+    """
+    Write the chunk catalogue next to the index.
+
+    The catalogue is a set of flat binary files in the same row order as
+    chunk_map.txt (`ids` and `names`): every chunk's text in one blob and
+    every filename in another, a table with each chunk's id, offsets into
+    both blobs, token count (for packing context into a token budget) and
+    embedding length (`norms`, used to turn FAISS distances into cosine
+    similarity), the ids in sorted order for lookups, and a term table
+    (see term_table.py) with postings from filename words to rows. Queries
+    read text and keyword matches from it instead of scanning
+    CHUNKED_DOCS_PATH, and every file can be memory-mapped.
+    """
+    rows = np.zeros(len(names), dtype=ROW_DTYPE)
+    rows["id"] = ids
+    rows["norm"] = norms
+    name_blob, name_offsets = pack_strings(names)
+    rows["name_start"] = name_offsets[:-1]
+    rows["name_end"] = name_offsets[1:]
+
+    offsets = [0]
+    keywords = defaultdict(list)
+    token_counts = chunk_token_counts()
+    tmp_text = CATALOGUE_TEXT_FILE + ".tmp"
+    with open(tmp_text, "wb") as blob:
+        for row, name in enumerate(names):
+            with open(os.path.join(CHUNKED_DOCS_PATH, name), "rb") as f:
+                data = f.read()
+            blob.write(data)
+            offsets.append(offsets[-1] + len(data))
+            # About four bytes per token for chunks the manifest does not cover
+            rows["tokens"][row] = token_counts.get(name, max(1, len(data) // 4))
+            tokens = filename_tokens(name)
+            rows["keywords"][row] = len(tokens)
+            for token in tokens:
+                keywords[token].append(row)
+    rows["start"] = offsets[:-1]
+    rows["end"] = offsets[1:]
+
+    # Keyword postings grouped by word, as in the BM25 index
+    postings, starts, counts = [], [], []
+    for word_rows in keywords.values():
+        starts.append(len(postings))
+        counts.append(len(word_rows))
+        postings.extend(word_rows)
+
+    order = np.argsort(rows["id"], kind="stable")
+    save_array(CATALOGUE_LOOKUP_FILE, np.stack([rows["id"][order], order]))
+    save_array(CATALOGUE_KEYWORD_ROWS_FILE, np.array(postings, dtype=np.int64))
+    save_term_table(
+        CATALOGUE_KEYWORDS_FILE,
+        CATALOGUE_KEYWORD_TEXT_FILE,
+        list(keywords),
+        starts,
+        counts,
+    )
+    save_array(CATALOGUE_NAMES_FILE, name_blob)
+    save_array(CATALOGUE_ROWS_FILE, rows)
+    os.replace(tmp_text, CATALOGUE_TEXT_FILE)
+
+
+class ChunkCatalogue:
+    """
+    Read-only view of the chunk catalogue, loaded once alongside the index.
+
+    It behaves like the old id -> filename dict (`idx in catalogue`,
+    `catalogue[idx]`) and adds chunk text, filename keyword lookups and the
+    BM25 index, so per-query work depends on the number of hits rather than
+    the size of the corpus. Per-chunk data is held in arrays indexed by
+    catalogue row, for ranking candidates with NumPy. With `mmap_files` the
+    arrays are memory-mapped rather than read, so processes serving the same
+    index share them through the page cache. `path` is the index directory,
+    for reading another collection's catalogue.
+    """
+
+    def __init__(self, load_bm25=True, mmap_files=INDEX_MMAP, path=INDEXES_PATH):
+        text_file = relocate(CATALOGUE_TEXT_FILE, path)
+        rows_file = relocate(CATALOGUE_ROWS_FILE, path)
+        lookup_file = relocate(CATALOGUE_LOOKUP_FILE, path)
+        names_file = relocate(CATALOGUE_NAMES_FILE, path)
+        keywords_file = relocate(CATALOGUE_KEYWORDS_FILE, path)
+        keyword_text_file = relocate(CATALOGUE_KEYWORD_TEXT_FILE, path)
+        keyword_rows_file = relocate(CATALOGUE_KEYWORD_ROWS_FILE, path)
+        for file_path in (
+            text_file,
+            rows_file,
+            lookup_file,
+            names_file,
+            keywords_file,
+            keyword_text_file,
+            keyword_rows_file,
+        ):
+            if not os.path.exists(file_path):
+                raise FileNotFoundError(
+                    f"Chunk catalogue file not found at {file_path}. Please run setup_retriever.py first."
+                )
+
+        mmap_mode = "r" if mmap_files else None
+        self.table = np.load(rows_file, mmap_mode=mmap_mode)
+        self.ids = self.table["id"]
+        self.norms = self.table["norm"]
+        self.keyword_sizes = self.table["keywords"]
+        self.token_counts = self.table["tokens"]
+        self._sorted_ids, self._id_order = np.load(lookup_file, mmap_mode=mmap_mode)
+        self._names = np.load(names_file, mmap_mode=mmap_mode)
+        self._keyword_rows = np.load(keyword_rows_file, mmap_mode=mmap_mode)
+        self.keywords = TermTable(keywords_file, keyword_text_file, mmap_files)
+
+        self._file = open(text_file, "rb")
+        # mmap cannot map an empty file
+        self._text = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if os.path.getsize(text_file)
+            else b""
+        )
+
+        # Typical cosine similarity of unrelated chunks, for calibrated scores
+        info = load_index_info(relocate(INDEX_INFO_FILE, path)) or {}
+        self.similarity_baseline = info.get("cosine_baseline", 0.0)
+
+        # Lexical search over chunk text, if it has been built
+        self.bm25 = (
+            BM25Index(self.ids, path=path)
+            if load_bm25 and BM25Index.exists(path)
+            else None
+        )
+
+    def _row(self, idx):
+        row = int(self.rows_of([idx])[0])
+        if row < 0:
+            raise KeyError(idx)
+        return row
+
+    def __contains__(self, idx):
+        return self.rows_of([idx])[0] >= 0
+
+    def __getitem__(self, idx):
+        return self.name(self._row(idx))
+
+    def __len__(self):
+        return len(self.table)
+
+    def name(self, row):
+        """Return the filename of the chunk in a catalogue row."""
+        entry = self.table[row]
+        return unpack_string(self._names, entry["name_start"], entry["name_end"])
+
+    def items(self):
+        for row in range(len(self.table)):
+            yield int(self.ids[row]), self.name(row)
+
+    def texts(self):
+        """Yield chunk texts in row order."""
+        for row in range(len(self.table)):
+            yield self.row_text(row)
+
+    def text(self, idx):
+        """Return the text of a chunk."""
+        return self.row_text(self._row(idx))
+
+    def row_text(self, row):
+        """Return the text of the chunk in a catalogue row."""
+        entry = self.table[row]
+        return self._text[entry["start"] : entry["end"]].decode("utf-8")
+
+    def rows_of(self, ids):
+        """Return the catalogue rows of an array of chunk ids, -1 where unknown."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self._sorted_ids):
+            return np.full(len(ids), -1, dtype=np.int64)
+        pos = np.minimum(
+            np.searchsorted(self._sorted_ids, ids), len(self._sorted_ids) - 1
+        )
+        found = self._sorted_ids[pos] == ids
+        return np.where(found, self._id_order[pos], -1)
+
+    def keyword_matches(self, words):
+        """
+        Find chunks whose filename contains any of `words`.
+
+        Returns (rows, counts): the matching catalogue rows and how many of
+        the words each one's filename contains.
+        """
+        found = self.keywords.lookup(words)
+        hits = [
+            self._keyword_rows[start : start + count]
+            for start, count in zip(
+                self.keywords.starts[found], self.keywords.counts[found]
+            )
+        ]
+        if not hits:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(hits), return_counts=True)
@@ -1,8 +1,25 @@
 import os
-import nltk
-from nltk.tokenize import sent_tokenize
-from config import RAW_DOCS_PATH, CHUNKED_DOCS_PATH
-from nltk.data import find
+import re
+import argparse
+import multiprocessing
+from config import (
+    NORMALIZED_DOCS_PATH,
+    NORMALIZE_MANIFEST,
+    CHUNKED_DOCS_PATH,
+    CHUNK_MANIFEST,
+    EMBEDDING_MODEL,
+    CHUNK_MAX_TOKENS,
+    CHUNK_OVERLAP_TOKENS,
+    CHUNK_WORKERS,
+    ensure_directories,
+)
+from manifest import file_hash, load_manifest, save_manifest
+
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+
+# Tokenizer of the embedding model, loaded once per worker by _init_worker()
+_tokenizer = None
 
 
 # Download necessary NLTK resources
@@ -49,6 +66,9 @@ def ensure_punkt():
     integrated seamlessly into any NLTK-based application.
 
     """
+    import nltk
+    from nltk.data import find
+
     try:
         # Check if 'punkt' tokenizer is already available
         find("tokenizers/punkt")
@@ -60,47 +80,346 @@ def ensure_punkt():
         print("[INFO] 'punkt' tokenizer successfully downloaded.")
 
 
-# Ensure the necessary NLTK resource is available
-ensure_punkt()
+def _init_worker(model_name=EMBEDDING_MODEL):
+    """Load the tokenizer once per worker process."""
+    from embedder import load_tokenizer
+
+    global _tokenizer
+    _tokenizer = load_tokenizer(model_name)
+    _tokenizer.model_max_length = 1 << 30  # Only counting; long texts are expected
+
+
+def count_tokens(texts):
+    """Return the number of model tokens in each text."""
+    encoded = _tokenizer(list(texts), add_special_tokens=False)["input_ids"]
+    return [len(ids) for ids in encoded]
+
+
+def iter_blocks(lines):
+    """
+    Split markdown into headings, fenced code blocks and paragraphs.
+
+    Reads `lines` lazily, so a file object can be passed without loading the
+    whole document. Yields (kind, text, start, heading_path) where `start` is
+    the character offset of `text` in the document and `heading_path` lists
+    the enclosing headings, outermost first.
+    """
+    headings = []  # (level, title) of the enclosing headings
+    block = []
+    block_start = offset = 0
+    fence = None
+
+    def flush(kind):
+        text = "".join(block)
+        stripped = text.strip()
+        start = block_start + len(text) - len(text.lstrip())
+        return kind, stripped, start, tuple(title for _, title in headings)
+
+    for line in lines:
+        line_start, offset = offset, offset + len(line)
+        if fence is not None:
+            block.append(line)
+            if line.strip().startswith(fence):
+                yield flush("code")
+                block, fence = [], None
+            continue
 
+        fence_match = FENCE_PATTERN.match(line)
+        heading_match = HEADING_PATTERN.match(line)
+        if block and (fence_match or heading_match or not line.strip()):
+            yield flush("text")
+            block = []
 
-def chunk_document(text, chunk_size=200):
+        if fence_match:
+            fence, block, block_start = fence_match.group(1), [line], line_start
+        elif heading_match:
+            level = len(heading_match.group(1))
+            while headings and headings[-1][0] >= level:
+                headings.pop()
+            headings.append((level, heading_match.group(2)))
+            block, block_start = [line], line_start
+            yield flush("heading")
+            block = []
+        elif line.strip():
+            if not block:
+                block_start = line_start
+            block.append(line)
+
+    if block:
+        yield flush("code" if fence is not None else "text")
+
+
+def token_windows(text, start, max_tokens):
+    """Cut text that is too long on its own into windows of max_tokens."""
+    encoded = _tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+    spans = encoded["offset_mapping"]
+    windows = []
+    for i in range(0, len(spans), max_tokens):
+        window = spans[i : i + max_tokens]
+        begin, end = window[0][0], window[-1][1]
+        windows.append((text[begin:end], start + begin, len(window)))
+    return windows
+
+
+def locate_pieces(text, pieces, start):
+    """
+    Find the sentences or lines a block was split into, in order.
+
+    Returns (piece, offset) tuples, with the piece as it appears in `text`.
+    A piece that is not in the text verbatim, such as a sentence whose
+    whitespace the splitter normalised, is matched ignoring whitespace. If
+    that fails too, it is placed after the previous piece and a warning is
+    printed, since its offsets are then only approximate.
     """
-    Split document into chunks while preserving sentence boundaries.
+    located = []
+    position = 0
+    missing = 0
+    for piece in pieces:
+        found = text.find(piece, position)
+        end = found + len(piece)
+        if found < 0 and piece.split():
+            pattern = r"\s+".join(re.escape(word) for word in piece.split())
+            match = re.compile(pattern).search(text, position)
+            if match:
+                found, end = match.span()
+                piece = match.group()
+        if found < 0:
+            missing += 1
+            found, end = position, min(position + len(piece), len(text))
+        located.append((piece, start + found))
+        position = max(position, end)
+    if missing:
+        print(
+            f"[WARNING] {missing} of {len(pieces)} pieces of the block at offset "
+            f"{start} were not found in its text; their offsets are approximate"
+        )
+    return located
 
-    Args:
-        text: The document text to chunk
-        chunk_size: Target number of sentences per chunk
 
-    Returns:
-        List of text chunks
+def split_block(kind, text, start, max_tokens):
     """
-    sentences = sent_tokenize(text)
-    chunks = [
-        " ".join(sentences[i : i + chunk_size])
-        for i in range(0, len(sentences), chunk_size)
-    ]
-    return chunks
+    Split a block into units of at most max_tokens.
 
+    Returns (text, start, tokens) tuples. Prose is split at sentence
+    boundaries and code at line boundaries; only a single sentence or line
+    that is still too long is cut at token boundaries.
+    """
+    tokens = count_tokens([text])[0]
+    if tokens <= max_tokens:
+        return [(text, start, tokens)]
 
-def process_files():
-    """Process all markdown files in the raw docs directory into chunks."""
-    for filename in os.listdir(RAW_DOCS_PATH):
-        if filename.endswith(".md"):
+    if kind == "code":
+        pieces = text.splitlines(keepends=True)
+    else:
+        from nltk.tokenize import sent_tokenize
+
+        pieces = sent_tokenize(text)
+    located = locate_pieces(text, pieces, start)
+
+    units = []
+    counts = count_tokens(piece for piece, _ in located)
+    for (piece, piece_start), count in zip(located, counts):
+        if count <= max_tokens:
+            units.append((piece, piece_start, count))
+        else:
+            units.extend(token_windows(piece, piece_start, max_tokens))
+    return units
+
+
+def build_chunks(
+    blocks, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS
+):
+    """
+    Pack blocks into chunks of at most max_tokens.
+
+    A chunk never spans a heading, so every chunk belongs to one section.
+    When a section is split, the next chunk repeats up to overlap_tokens of
+    whole sentences (or lines) from the end of the previous one. Yields
+    (text, start, end, tokens, heading_path).
+    """
+    current = []  # (separator, text, start, tokens)
+    has_body = False
+    heading_path = ()
+
+    def emit():
+        text = current[0][1] + "".join(sep + part for sep, part, _, _ in current[1:])
+        last = current[-1]
+        return (
+            text,
+            current[0][2],
+            last[2] + len(last[1]),
+            sum(unit[3] for unit in current),
+            list(heading_path),
+        )
+
+    for kind, text, start, path in blocks:
+        if kind == "heading" and has_body:
+            yield emit()
+            current, has_body = [], False
+        heading_path = path
+
+        for i, (part, part_start, tokens) in enumerate(
+            split_block(kind, text, start, max_tokens)
+        ):
+            separator = "\n\n" if i == 0 else ("" if kind == "code" else " ")
+            if current and sum(unit[3] for unit in current) + tokens > max_tokens:
+                yield emit()
+                # Carry whole units from the end of the chunk as overlap
+                overlap = []
+                carried = 0
+                for unit in reversed(current):
+                    if carried + unit[3] > min(overlap_tokens, max_tokens - tokens):
+                        break
+                    overlap.insert(0, unit)
+                    carried += unit[3]
+                current = overlap
+            current.append((separator, part, part_start, tokens))
+            has_body = has_body or kind != "heading"
+
+    if current:
+        yield emit()
+
+
+def chunk_file(task):
+    """
+    Chunk one normalized document, streaming it from disk, and write its chunk files.
+
+    Returns (filename, chunk names, chunk metadata keyed by chunk name).
+    """
+    filename, max_tokens, overlap_tokens = task
+    base = os.path.splitext(filename)[0]
+    names = []
+    metadata = {}
+    with open(os.path.join(NORMALIZED_DOCS_PATH, filename), "r", encoding="utf-8") as f:
+        chunks = build_chunks(iter_blocks(f), max_tokens, overlap_tokens)
+        for i, (text, start, end, tokens, heading_path) in enumerate(chunks):
+            chunk_filename = f"{base}_chunk_{i}.txt"
             with open(
-                os.path.join(RAW_DOCS_PATH, filename), "r", encoding="utf-8"
-            ) as f:
-                document = f.read()
+                os.path.join(CHUNKED_DOCS_PATH, chunk_filename), "w", encoding="utf-8"
+            ) as chunk_file:
+                chunk_file.write(text)
+            names.append(chunk_filename)
+            metadata[chunk_filename] = {
+                "source": filename,
+                "heading_path": heading_path,
+                "start": start,
+                "end": end,
+                "tokens": tokens,
+            }
+    return filename, names, metadata
+
 
-            chunks = chunk_document(document)
-            for i, chunk in enumerate(chunks):
-                chunk_filename = f"{filename.replace('.md', '')}_chunk_{i}.txt"
-                chunk_path = os.path.join(CHUNKED_DOCS_PATH, chunk_filename)
-                os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
-                with open(chunk_path, "w", encoding="utf-8") as chunk_file:
-                    chunk_file.write(chunk)
-                print(f"Saved chunk {i} for {filename}")
+def remove_chunks(chunk_names):
+    """Delete chunk files written for a previous version of a document."""
+    for chunk_name in chunk_names:
+        chunk_path = os.path.join(CHUNKED_DOCS_PATH, chunk_name)
+        if os.path.exists(chunk_path):
+            os.remove(chunk_path)
+
+
+def process_files(
+    rebuild=False,
+    workers=CHUNK_WORKERS,
+    max_tokens=CHUNK_MAX_TOKENS,
+    overlap_tokens=CHUNK_OVERLAP_TOKENS,
+):
+    """
+    Process the normalized markdown files (see normalize_docs.py) into chunks.
+
+    A manifest of content hashes per document is kept next to the chunks.
+    Documents whose hash is unchanged are skipped, changed documents have
+    their old chunks replaced, and chunks of deleted documents are removed.
+    Changed documents are chunked in parallel across worker processes, and
+    each chunk's source, heading path, character offsets and token count are
+    recorded in the manifest. Changing the chunker settings re-chunks
+    everything.
+    """
+    ensure_punkt()
+    os.makedirs(CHUNKED_DOCS_PATH, exist_ok=True)
+    if not os.path.exists(NORMALIZE_MANIFEST):
+        # Trees fetched before the normalization stage existed
+        from normalize_docs import normalize_docs
+
+        print("[INFO] Raw documents have not been normalized yet. Normalizing...")
+        normalize_docs(workers=workers)
+
+    manifest = load_manifest(CHUNK_MANIFEST)
+    docs = manifest.get("docs", {})
+    settings = {
+        "tokenizer": EMBEDDING_MODEL,
+        "max_tokens": max_tokens,
+        "overlap_tokens": overlap_tokens,
+    }
+    if rebuild or manifest.get("chunker") != settings:
+        for entry in docs.values():
+            remove_chunks(entry["chunks"])
+        docs = {}
+    seen = set()
+    tasks = []
+    hashes = {}
+
+    for filename in sorted(os.listdir(NORMALIZED_DOCS_PATH)):
+        if filename.endswith(".md"):
+            seen.add(filename)
+            digest = file_hash(os.path.join(NORMALIZED_DOCS_PATH, filename))
+            entry = docs.get(filename)
+            if (
+                entry
+                and entry["hash"] == digest
+                and all(
+                    os.path.exists(os.path.join(CHUNKED_DOCS_PATH, name))
+                    for name in entry["chunks"]
+                )
+            ):
+                print(f"Unchanged: {filename}")
+                continue
+            if entry:
+                remove_chunks(entry["chunks"])
+            hashes[filename] = digest
+            tasks.append((filename, max_tokens, overlap_tokens))
+
+    if tasks:
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(
+            min(workers, len(tasks)),
+            initializer=_init_worker,
+            initargs=(EMBEDDING_MODEL,),
+        ) as pool:
+            for filename, names, metadata in pool.imap_unordered(chunk_file, tasks):
+                docs[filename] = {
+                    "hash": hashes[filename],
+                    "chunks": names,
+                    "metadata": metadata,
+                }
+                print(f"Saved {len(names)} chunks for {filename}")
+
+    for filename in sorted(set(docs) - seen):
+        remove_chunks(docs.pop(filename)["chunks"])
+        print(f"Removed chunks for deleted document {filename}")
+
+    manifest["chunker"] = settings
+    manifest["docs"] = docs
+    save_manifest(CHUNK_MANIFEST, manifest)
 
 
 if __name__ == "__main__":
-    process_files()
+    parser = argparse.ArgumentParser(
+        description="Split normalized documents into chunks"
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Re-chunk every document instead of only changed ones",
+    )
+    parser.add_argument("--workers", type=int, default=CHUNK_WORKERS)
+    parser.add_argument("--max-tokens", type=int, default=CHUNK_MAX_TOKENS)
+    parser.add_argument("--overlap-tokens", type=int, default=CHUNK_OVERLAP_TOKENS)
+    args = parser.parse_args()
+    ensure_directories()
+
+    process_files(
+        rebuild=args.rebuild,
+        workers=args.workers,
+        max_tokens=args.max_tokens,
+        overlap_tokens=args.overlap_tokens,
+    )
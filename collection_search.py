@@ -0,0 +1,197 @@
+import os
+import hashlib
+import contextvars
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    COLLECTIONS_DIR,
+    INDEX_FILE,
+    INDEX_INFO_FILE,
+    INDEX_MMAP,
+    DEFAULT_TOP_K,
+    DEFAULT_RELEVANCE_THRESHOLD,
+    DEFAULT_MAX_CONTEXT_TOKENS,
+    RERANK_CANDIDATES,
+    COLLECTION_SEARCH_THREADS,
+    relocate,
+)
+from ann_index import load_index_info
+from context_packer import pack_context, CHUNK_SEPARATOR
+from query_model import (
+    load_faiss_index,
+    score_candidates,
+    fuse_ranks,
+    candidate_relevance,
+    select_relevant,
+    rerank_chunks,
+)
+from reranker import get_reranker
+import metrics
+
+# Query cache shared by searches over collections
+COLLECTIONS_CACHE_FILE = os.path.join(COLLECTIONS_DIR, "query_cache.pkl")
+
+
+def collection_indexes_path(name):
+    """Return the index directory of a named collection."""
+    return os.path.join(COLLECTIONS_DIR, name, "Docs", "Embeddings", "Indexes")
+
+
+def list_collections():
+    """Return the names of the collections that have an index, sorted."""
+    if not os.path.isdir(COLLECTIONS_DIR):
+        return []
+    return sorted(
+        name
+        for name in os.listdir(COLLECTIONS_DIR)
+        if os.path.exists(relocate(INDEX_FILE, collection_indexes_path(name)))
+    )
+
+
+class CollectionSearcher:
+    """
+    Search several named collections as one corpus.
+
+    Each collection has its own index shard and chunk catalogue, built with
+    RAG_COLLECTION=<name>, and they are all loaded once. Every shard must
+    have been embedded with the same model, so their vectors are
+    comparable. A query fans out to the selected shards in a thread pool,
+    each shard collects its candidates with score_candidates, and the
+    combined candidate lists are ranked with one reciprocal rank fusion, as
+    rank_chunks does for a single index. Search time then follows the
+    slowest shard rather than the number of collections.
+    """
+
+    def __init__(self, names=None, mmap=INDEX_MMAP, threads=COLLECTION_SEARCH_THREADS):
+        names = list(names or list_collections())
+        if not names:
+            raise FileNotFoundError(
+                f"No collections found in {COLLECTIONS_DIR}. Build one by running "
+                "the pipeline with RAG_COLLECTION=<name> set."
+            )
+        self.shards = {}
+        infos = {}
+        for name in names:
+            print(f"Loading collection '{name}'...")
+            path = collection_indexes_path(name)
+            self.shards[name] = load_faiss_index(mmap, path)
+            infos[name] = load_index_info(relocate(INDEX_INFO_FILE, path)) or {}
+
+        # Scores are only comparable between shards built the same way
+        built_with = {
+            name: (
+                (infos[name].get("embedder") or {}).get("model"),
+                self.shards[name][0].d,
+            )
+            for name in names
+        }
+        if len(set(built_with.values())) > 1:
+            details = ", ".join(
+                f"{name} ({model}, {dim} dimensions)"
+                for name, (model, dim) in built_with.items()
+            )
+            raise ValueError(
+                f"Collections were embedded with different models: {details}. "
+                "Re-embed them with the same EMBEDDING_MODEL to search them together."
+            )
+        self.pool = ThreadPoolExecutor(max_workers=max(1, min(threads, len(names))))
+
+        # Identifies this set of shard versions, for the query cache
+        digest = hashlib.blake2b(digest_size=8)
+        for name in names:
+            digest.update(f"{name}:{infos[name].get('version')};".encode("utf-8"))
+        self.version = digest.hexdigest()
+
+    def __len__(self):
+        return sum(len(chunk_map) for _, chunk_map in self.shards.values())
+
+    def search(
+        self,
+        query_embedding,
+        query,
+        k=DEFAULT_TOP_K,
+        relevance_threshold=DEFAULT_RELEVANCE_THRESHOLD,
+        collections=None,
+    ):
+        """
+        Return the top k chunks across the selected collections, best first.
+
+        `collections` picks a subset of the loaded ones (all by default).
+        Returns a list of (collection, chunk id, relevance) tuples.
+        """
+        names = list(collections or self.shards)
+        unknown = [name for name in names if name not in self.shards]
+        if unknown:
+            raise ValueError(f"Unknown collections: {', '.join(unknown)}")
+
+        def search_shard(name):
+            index, chunk_map = self.shards[name]
+            return score_candidates(index, chunk_map, query_embedding, query, k)
+
+        # Each shard searches with a copy of the caller's context, so its
+        # spans land in the caller's trace
+        with metrics.span("fan_out"):
+            futures = [
+                self.pool.submit(contextvars.copy_context().run, search_shard, name)
+                for name in names
+            ]
+            results = [future.result() for future in futures]
+
+        # Fuse the candidate lists of all shards as one: vector scores are
+        # calibrated cosines and BM25 scores are raw, so both rank across
+        # shards
+        with metrics.span("fuse"):
+            shard = np.concatenate(
+                [np.full(len(rows), i) for i, (rows, _, _, _) in enumerate(results)]
+            )
+            rows, vector, keyword, bm25 = (
+                np.concatenate(column) for column in zip(*results)
+            )
+            fused = fuse_ranks(vector, keyword, bm25)
+            relevance = candidate_relevance(vector, bm25)
+            best = select_relevant(fused, relevance, relevance_threshold)[:k]
+        return [
+            (
+                names[shard[i]],
+                int(self.shards[names[shard[i]]][1].ids[rows[i]]),
+                float(relevance[i]),
+            )
+            for i in best.tolist()
+        ]
+
+    def retrieve(
+        self,
+        query_embedding,
+        query,
+        k=DEFAULT_TOP_K,
+        relevance_threshold=DEFAULT_RELEVANCE_THRESHOLD,
+        max_context_tokens=DEFAULT_MAX_CONTEXT_TOKENS,
+        collections=None,
+    ):
+        """Like query_model.retrieve_chunk, over the selected collections."""
+        reranker = get_reranker()
+        hits = self.search(
+            query_embedding,
+            query,
+            max(k, RERANK_CANDIDATES) if reranker else k,
+            relevance_threshold,
+            collections,
+        )
+        texts = []
+        tokens = np.zeros(len(hits), dtype=np.int64)
+        for i, (name, idx, _) in enumerate(hits):
+            chunk_map = self.shards[name][1]
+            row = int(chunk_map.rows_of([idx])[0])
+            texts.append(chunk_map.row_text(row))
+            tokens[i] = chunk_map.token_counts[row]
+        relevance = np.array([score for _, _, score in hits])
+        if reranker:
+            keep, relevance = rerank_chunks(
+                reranker, query, texts[:RERANK_CANDIDATES], relevance, k
+            )
+            texts = [texts[i] for i in keep]
+            tokens = tokens[keep]
+
+        with metrics.span("assemble_context"):
+            chosen = pack_context(texts, tokens, relevance, max_context_tokens)
+        return CHUNK_SEPARATOR.join(text for _, text, _ in chosen)
@@ -2,37 +2,173 @@
 
 # Base paths - users can override these as needed
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-RAG_DIR = os.path.join(os.path.expanduser("~"), "RAG")
+RAG_DIR = os.environ.get("RAG_DIR", os.path.join(os.path.expanduser("~"), "RAG"))
+
+# Named collections: with RAG_COLLECTION set, every path below lives under
+# RAG_DIR/Collections/<name>, so each collection's docs, embeddings and index
+# shard are fetched, built and rebuilt on their own
+RAG_COLLECTION = os.environ.get("RAG_COLLECTION", "")
+COLLECTIONS_DIR = os.path.join(RAG_DIR, "Collections")
 
 # Derived paths for data storage
-DOCS_DIR = os.path.join(RAG_DIR, "Docs")
+if RAG_COLLECTION:
+    DOCS_DIR = os.path.join(COLLECTIONS_DIR, RAG_COLLECTION, "Docs")
+else:
+    DOCS_DIR = os.path.join(RAG_DIR, "Docs")
 RAW_DOCS_PATH = os.path.join(DOCS_DIR, "Raw")
+NORMALIZED_DOCS_PATH = os.path.join(DOCS_DIR, "Normalized")
 CHUNKED_DOCS_PATH = os.path.join(DOCS_DIR, "Chunked")
 EMBEDDINGS_PATH = os.path.join(DOCS_DIR, "Embeddings")
 INDEXES_PATH = os.path.join(EMBEDDINGS_PATH, "Indexes")
 
 # File paths
 INDEX_FILE = os.path.join(INDEXES_PATH, "retriever.index")
+EMBEDDING_STORE_FILE = os.path.join(EMBEDDINGS_PATH, "embeddings.npy")
+EMBEDDING_STORE_META = os.path.join(EMBEDDINGS_PATH, "embeddings_meta.tsv")
+EMBEDDING_STORE_INFO = os.path.join(EMBEDDINGS_PATH, "embeddings_info.json")
+ONNX_MODELS_PATH = os.path.join(EMBEDDINGS_PATH, "Models")  # Exported ONNX models
+NORMALIZE_MANIFEST = os.path.join(NORMALIZED_DOCS_PATH, "manifest.json")
+CHUNK_MANIFEST = os.path.join(CHUNKED_DOCS_PATH, "manifest.json")
+CHUNK_MAP_FILE = os.path.join(INDEXES_PATH, "chunk_map.txt")
+INDEX_INFO_FILE = os.path.join(INDEXES_PATH, "index_info.json")
+QUERY_CACHE_FILE = os.path.join(INDEXES_PATH, "query_cache.pkl")
+CATALOGUE_TEXT_FILE = os.path.join(INDEXES_PATH, "catalogue_text.bin")
+CATALOGUE_ROWS_FILE = os.path.join(INDEXES_PATH, "catalogue_rows.npy")
+CATALOGUE_LOOKUP_FILE = os.path.join(INDEXES_PATH, "catalogue_lookup.npy")
+CATALOGUE_NAMES_FILE = os.path.join(INDEXES_PATH, "catalogue_names.npy")
+CATALOGUE_KEYWORDS_FILE = os.path.join(INDEXES_PATH, "catalogue_keywords.npy")
+CATALOGUE_KEYWORD_TEXT_FILE = os.path.join(INDEXES_PATH, "catalogue_keyword_text.npy")
+CATALOGUE_KEYWORD_ROWS_FILE = os.path.join(INDEXES_PATH, "catalogue_keyword_rows.npy")
+BM25_TERMS_FILE = os.path.join(INDEXES_PATH, "bm25_terms.npy")
+BM25_TERM_TEXT_FILE = os.path.join(INDEXES_PATH, "bm25_term_text.npy")
+BM25_STATS_FILE = os.path.join(INDEXES_PATH, "bm25_stats.json")
+BM25_POSTINGS_FILE = os.path.join(INDEXES_PATH, "bm25_postings.npy")
+BM25_IMPACTS_FILE = os.path.join(INDEXES_PATH, "bm25_impacts.npy")
 EMBEDDING_SCRIPT = os.path.join(BASE_DIR, "create_embeddings.py")
 
 # Default documentation source
 DEFAULT_DOCS_URL = "https://github.com/ollama/ollama/tree/main/docs"
+FETCH_MANIFEST = os.path.join(DOCS_DIR, "fetch_manifest.json")
+FETCH_WORKERS = 8
+FETCH_RETRIES = 3
+FETCH_BACKOFF = 0.5  # Seconds; doubles with each retry
+FETCH_TIMEOUT = 30
+
 
+def relocate(path, directory):
+    """Return the path a file in INDEXES_PATH has in another index directory."""
+    return os.path.join(directory, os.path.basename(path))
 
-# Create required directories
+
+# Create required directories; the pipeline scripts call this on startup
 def ensure_directories():
     """Create all required directories if they don't exist."""
-    directories = [RAW_DOCS_PATH, CHUNKED_DOCS_PATH, EMBEDDINGS_PATH, INDEXES_PATH]
+    directories = [
+        RAW_DOCS_PATH,
+        NORMALIZED_DOCS_PATH,
+        CHUNKED_DOCS_PATH,
+        EMBEDDINGS_PATH,
+        INDEXES_PATH,
+    ]
     for directory in directories:
         os.makedirs(directory, exist_ok=True)
 
 
 # Model settings
 DEFAULT_MODEL = "llama2:latest"
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_TIMEOUT = 300  # Seconds to wait for the server between streamed tokens
+OLLAMA_POOL_SIZE = 8
+# Every answer asks for the same context window and keeps the model loaded, so
+# Ollama reuses the evaluated system prompt instead of reloading the model
+OLLAMA_NUM_CTX = 4096
+OLLAMA_KEEP_ALIVE = "30m"
+# "stub" selects a hashing embedder and word tokenizer that need no model
+# download, for benchmarks and offline runs
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "bert-base-uncased")
+STUB_MODEL = "stub"
+STUB_EMBEDDING_DIM = 384
+# How the embedding model runs: "torch" (fp32), "int8" (torch with dynamically
+# quantized linear layers), "onnx" or "onnx-int8" (ONNX Runtime, needs
+# `pip install onnx onnxruntime`). Compare them with `benchmark.py backends`.
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
+EMBEDDING_MAX_TOKENS = 512
+EMBEDDING_BATCH_SIZE = 32
+EMBEDDING_THREADS = os.cpu_count() or 1
+EMBEDDING_WORKERS = 1
+EMBEDDING_SHARD_SIZE = 1024
+# Precision of the on-disk embedding store: "float32", or "float16" for half
+# the size. For a smaller index use setup_retriever.py --index-type sq8/sqfp16
+EMBEDDING_STORE_DTYPE = "float32"
+# Normalization settings
+NORMALIZE_WORKERS = os.cpu_count() or 1
+# Chunking settings, in tokens of the embedding model's tokenizer
+CHUNK_MAX_TOKENS = 256  # Must fit within EMBEDDING_MAX_TOKENS
+CHUNK_OVERLAP_TOKENS = 32
+CHUNK_WORKERS = os.cpu_count() or 1
+# Index settings
+DEFAULT_INDEX_TYPE = "flat"  # flat, ivf, ivfpq or hnsw
+INDEX_TRAIN_SAMPLE = 100000
+IVF_NLIST = None  # None picks about 4*sqrt(number of chunks)
+PQ_M = 16
+HNSW_M = 32
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+# Memory-map the index and catalogue read-only instead of copying them onto
+# the heap, so worker processes share one copy through the OS page cache
+INDEX_MMAP = True
 # Query settings
 DEFAULT_TOP_K = 8
-DEFAULT_RELEVANCE_THRESHOLD = 0.15  # Lower threshold to match typical similarity scores
-DEFAULT_MAX_CONTEXT_CHARS = 20000
-
-# Initialize directories when config is imported
-ensure_directories()
+# Relevance is a calibrated cosine score: 0 is the typical similarity of two
+# unrelated chunks in the corpus and 1 an identical chunk
+DEFAULT_RELEVANCE_THRESHOLD = 0.15
+# Context is packed by tokens (counted with the embedding model's tokenizer, a
+# close estimate of the LLM's); keep it below OLLAMA_NUM_CTX with room for
+# the instructions, question and answer
+DEFAULT_MAX_CONTEXT_TOKENS = 3000
+CONTEXT_SHINGLE_WORDS = 5  # Word sequences compared to find duplicate chunks
+CONTEXT_DUPLICATE_THRESHOLD = 0.8  # Share of shared sequences that makes a duplicate
+CONTEXT_MIN_TRIM_TOKENS = 64  # Smallest leftover budget worth a trimmed chunk
+# Cross-encoder reranking of the fused candidates, off unless RERANK_MODEL is
+# set, e.g. to cross-encoder/ms-marco-MiniLM-L-6-v2 ("stub" for a word-overlap
+# stand-in that needs no model)
+RERANK_MODEL = os.environ.get("RERANK_MODEL", "")
+RERANK_CANDIDATES = 24  # Top fused candidates scored by the cross-encoder
+RERANK_KEEP = 4  # Best reranked chunks passed on to the context
+RERANK_BUDGET_MS = 250  # Past this, keep the fused order instead
+RERANK_BATCH_SIZE = 8  # Pairs per forward pass; the budget is checked between
+RERANK_MAX_TOKENS = 512
+BM25_K1 = 1.2
+BM25_B = 0.75
+BM25_MAX_DF_RATIO = 0.25  # Skip terms found in over a quarter of the chunks
+RRF_K = 60  # Reciprocal rank fusion constant
+# BM25 score that counts as relevance 0.5 (see query_model.candidate_relevance);
+# one occurrence of a term found in a quarter of the chunks scores about 1.4
+BM25_RELEVANCE_HALF = 10.0
+COSINE_BASELINE_SAMPLE = 1000  # Chunks sampled to calibrate relevance scores
+# Batch query settings (query_model.py --batch)
+BATCH_QUERY_SIZE = 64  # Queries embedded and searched together
+BATCH_SEARCH_THREADS = os.cpu_count() or 1  # Contexts assembled at once
+BATCH_LLM_CONCURRENCY = 2  # Answers generated at once
+# Query cache settings
+QUERY_CACHE_ENABLED = True
+QUERY_CACHE_MAX_ENTRIES = 1000  # Per cache layer
+QUERY_CACHE_TTL_SECONDS = 7 * 24 * 3600
+# How often query_server.py writes new cache entries to disk, so a crash loses
+# at most this many seconds of them
+QUERY_CACHE_SAVE_SECONDS = 60
+# Reuse a cached answer for a different query whose embedding has at least
+# this cosine similarity; None disables the semantic cache
+SEMANTIC_CACHE_THRESHOLD = None
+# Metrics and tracing, off unless RAG_METRICS=1
+METRICS_ENABLED = os.environ.get("RAG_METRICS", "") == "1"
+TRACE_FILE = os.path.join(RAG_DIR, "traces.jsonl")
+# Query server settings
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8000
+SERVER_EMBED_BATCH_SIZE = 32
+SERVER_EMBED_WAIT_MS = 2  # How long to wait for more queries to batch together
+SERVER_SEARCH_THREADS = 4
+SERVER_LLM_CONCURRENCY = 2
+# Collections searched at once when a query fans out over several
+COLLECTION_SEARCH_THREADS = os.cpu_count() or 1
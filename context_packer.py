@@ -0,0 +1,100 @@
+import re
+import zlib
+from config import (
+    CONTEXT_SHINGLE_WORDS,
+    CONTEXT_DUPLICATE_THRESHOLD,
+    CONTEXT_MIN_TRIM_TOKENS,
+)
+
+CHUNK_SEPARATOR = "\n\n---\n\n"
+SEPARATOR_TOKENS = 3  # Tokens the separator costs between two chunks
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def shingles(text, size=CONTEXT_SHINGLE_WORDS):
+    """Return hashes of the overlapping `size`-word sequences in a text."""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))}
+    return {
+        zlib.crc32(" ".join(words[i : i + size]).encode("utf-8"))
+        for i in range(len(words) - size + 1)
+    }
+
+
+def is_near_duplicate(candidate, chosen, threshold=CONTEXT_DUPLICATE_THRESHOLD):
+    """
+    Check whether a chunk mostly repeats one already chosen.
+
+    Chunks are compared by the share of the smaller one's shingles that the
+    other contains, so both near-identical chunks and a chunk repeated
+    inside a larger one are caught.
+    """
+    for other in chosen:
+        shared = len(candidate & other)
+        if shared and shared / min(len(candidate), len(other)) >= threshold:
+            return True
+    return False
+
+
+def trim_to_tokens(text, tokens, budget):
+    """Cut a text of `tokens` tokens down to about `budget`, at a line or word break."""
+    cut = int(len(text) * budget / max(tokens, 1))
+    end = text.rfind("\n", 0, cut + 1)
+    if end < cut // 2:
+        end = text.rfind(" ", 0, cut + 1)
+    if end <= 0:
+        end = cut
+    return text[:end].rstrip()
+
+
+def pack_context(
+    texts,
+    tokens,
+    relevance,
+    max_tokens,
+    duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD,
+    min_trim_tokens=CONTEXT_MIN_TRIM_TOKENS,
+):
+    """
+    Choose which ranked chunks to put in the prompt within a token budget.
+
+    `texts`, `tokens` and `relevance` describe the chunks best first. The
+    best chunk always goes in, trimmed if it is larger than the whole budget;
+    the rest are taken by relevance per token, so several short relevant
+    chunks win over one long one. Near-duplicates of a chunk already taken
+    are skipped, and the first chunk that does not fit is trimmed into the
+    remaining budget if at least `min_trim_tokens` are left. Returns the
+    chosen (position, text, tokens) tuples in rank order.
+    """
+    if not len(texts):
+        return []
+
+    order = [0] + sorted(
+        range(1, len(texts)),
+        key=lambda i: (-float(relevance[i]) / max(int(tokens[i]), 1), i),
+    )
+    chosen = []
+    seen = []
+    remaining = max_tokens
+    for i in order:
+        size = int(tokens[i])
+        cost = size + (SEPARATOR_TOKENS if chosen else 0)
+        if cost > remaining and chosen and remaining < min_trim_tokens:
+            continue
+
+        fingerprint = shingles(texts[i])
+        if is_near_duplicate(fingerprint, seen, duplicate_threshold):
+            continue
+
+        text = texts[i]
+        if cost > remaining:
+            size = remaining - (SEPARATOR_TOKENS if chosen else 0)
+            text = trim_to_tokens(text, int(tokens[i]), size)
+        chosen.append((i, text, size))
+        seen.append(fingerprint)
+        remaining -= size + (SEPARATOR_TOKENS if len(chosen) > 1 else 0)
+        if remaining <= 0:
+            break
+
+    return sorted(chosen)
@@ -1,40 +1,224 @@
 import os
+import json
+import time
+import shutil
+import multiprocessing
 import numpy as np
-import torch
 import argparse
-from transformers import AutoTokenizer, AutoModel
-from config import CHUNKED_DOCS_PATH, EMBEDDINGS_PATH
+from config import (
+    CHUNKED_DOCS_PATH,
+    EMBEDDINGS_PATH,
+    EMBEDDING_STORE_FILE,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_THREADS,
+    EMBEDDING_WORKERS,
+    EMBEDDING_SHARD_SIZE,
+    ensure_directories,
+)
+from embedder import get_embedder, embedder_info
+from embedding_store import read_store, read_store_info, write_store, merge_rows
+from manifest import content_hash
 
-# Load pre-trained model and tokenizer
-tokenizer = AutoTokenizer.from_pretrained("bert-base-uncased")
-model = AutoModel.from_pretrained("bert-base-uncased")
+# Finished shards of a multi-process run, kept until the merge succeeds
+SHARD_DIR = os.path.join(EMBEDDINGS_PATH, ".shards")
 
 
 def get_embeddings(text):
-    """Generate embeddings for input text."""
-    inputs = tokenizer(
-        text, return_tensors="pt", padding=True, truncation=True, max_length=512
+    """Generate embeddings for input text using the shared embedder."""
+    return get_embedder().embed(text)
+
+
+def list_chunks():
+    """List chunk files in a stable order so embedding rows are deterministic."""
+    return sorted(f for f in os.listdir(CHUNKED_DOCS_PATH) if f.endswith(".txt"))
+
+
+def read_chunks(filenames):
+    """Read the text of the given chunk files."""
+    documents = []
+    for filename in filenames:
+        with open(
+            os.path.join(CHUNKED_DOCS_PATH, filename), "r", encoding="utf-8"
+        ) as f:
+            documents.append(f.read())
+    return documents
+
+
+def _init_worker(num_threads):
+    """Load the model once per worker process."""
+    get_embedder().set_num_threads(num_threads)
+
+
+def shard_embedder():
+    """Describe the configured embedder as stored in shard files."""
+    return json.dumps(embedder_info(), sort_keys=True)
+
+
+def embed_shard(task):
+    """
+    Embed one shard of chunk files and write it atomically to disk.
+
+    The chunk content hashes and the embedder are saved with the vectors so
+    a later run can tell whether the shard is still valid.
+    """
+    shard_path, filenames, hashes, batch_size = task
+    embeddings = get_embedder().embed_batch(
+        read_chunks(filenames), batch_size=batch_size
     )
-    with torch.no_grad():
-        outputs = model(**inputs)
-    return outputs.last_hidden_state.mean(dim=1).numpy()
+    tmp_path = shard_path.replace(".npz", ".tmp.npz")
+    np.savez(
+        tmp_path,
+        names=np.array(filenames),
+        hashes=np.array(hashes),
+        embedder=np.array(shard_embedder()),
+        embeddings=embeddings,
+    )
+    os.replace(tmp_path, shard_path)
+    return shard_path, len(filenames)
+
+
+def shard_is_complete(shard_path, filenames, hashes):
+    """
+    Check whether a shard from an earlier run holds exactly these chunks.
+
+    The chunk names, their content hashes and the embedder must all match,
+    so a shard of edited chunks or of another model is embedded again.
+    """
+    if not os.path.exists(shard_path):
+        return False
+    try:
+        with np.load(shard_path) as shard:
+            return (
+                shard["names"].tolist() == filenames
+                and shard["hashes"].tolist() == hashes
+                and str(shard["embedder"]) == shard_embedder()
+            )
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def embed_sharded(filenames, hashes, batch_size, num_threads, workers, shard_size):
+    """
+    Embed chunk files across several worker processes.
+
+    The sorted file list is cut into fixed-size shards, so shard contents and
+    the merged row order depend only on the corpus. Each finished shard is
+    written to SHARD_DIR; if a run crashes, the next run skips shards that are
+    already complete for the same chunk contents and embedder and only embeds
+    the rest.
+    """
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    shard_paths = []
+    tasks = []
+    for shard_id, start in enumerate(range(0, len(filenames), shard_size)):
+        shard_files = filenames[start : start + shard_size]
+        shard_hashes = hashes[start : start + shard_size]
+        shard_path = os.path.join(SHARD_DIR, f"shard_{shard_id:05d}.npz")
+        shard_paths.append(shard_path)
+        if shard_is_complete(shard_path, shard_files, shard_hashes):
+            print(f"Resuming: shard {shard_id} already embedded")
+            continue
+        tasks.append((shard_path, shard_files, shard_hashes, batch_size))
+
+    if tasks:
+        threads_per_worker = max(num_threads // workers, 1)
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(
+            min(workers, len(tasks)),
+            initializer=_init_worker,
+            initargs=(threads_per_worker,),
+        ) as pool:
+            for shard_path, count in pool.imap_unordered(embed_shard, tasks):
+                print(f"Embedded {count} chunks into {os.path.basename(shard_path)}")
+
+    return shard_paths
+
+
+def read_shards(shard_paths):
+    """Yield shard embeddings in shard order, one shard in memory at a time."""
+    for shard_path in shard_paths:
+        with np.load(shard_path) as shard:
+            yield shard["embeddings"]
 
 
-def process_files():
-    """Process all document chunks and create embeddings."""
-    for filename in os.listdir(CHUNKED_DOCS_PATH):
-        if filename.endswith(".txt"):
-            with open(
-                os.path.join(CHUNKED_DOCS_PATH, filename), "r", encoding="utf-8"
-            ) as f:
-                document = f.read()
+def load_previous_store():
+    """
+    Map (chunk name, content hash) to rows of the existing store, if any.
 
-            embedding = get_embeddings(document)
-            embedding_filename = filename.replace(".txt", ".npy")
-            embedding_path = os.path.join(EMBEDDINGS_PATH, embedding_filename)
-            os.makedirs(os.path.dirname(embedding_path), exist_ok=True)
-            np.save(embedding_path, embedding)
-            print(f"Saved embedding for {filename}")
+    A store made by a different model or backend is not reused, since its
+    vectors cannot be mixed with new ones.
+    """
+    try:
+        names, hashes, embeddings = read_store()
+    except (FileNotFoundError, ValueError):
+        return {}, None
+    info = read_store_info()
+    current = embedder_info()
+    if info is not None and {key: info.get(key) for key in current} != current:
+        print(
+            f"Embeddings were made with {info.get('model')} ({info.get('backend')}); "
+            f"re-embedding everything with {current['model']} ({current['backend']})"
+        )
+        return {}, None
+    return {key: row for row, key in enumerate(zip(names, hashes))}, embeddings
+
+
+def process_files(
+    batch_size=EMBEDDING_BATCH_SIZE,
+    num_threads=EMBEDDING_THREADS,
+    workers=EMBEDDING_WORKERS,
+    shard_size=EMBEDDING_SHARD_SIZE,
+    rebuild=False,
+):
+    """
+    Process document chunks and create embeddings in batches.
+
+    Chunks whose name and content hash match a row of the existing store are
+    copied over instead of re-embedded, unless `rebuild` is set.
+    """
+    filenames = list_chunks()
+    hashes = [content_hash(text) for text in read_chunks(filenames)]
+    previous, old_embeddings = ({}, None) if rebuild else load_previous_store()
+
+    sources = np.array(
+        [previous.get(key, -1) for key in zip(filenames, hashes)], dtype=np.int64
+    )
+    todo = [name for name, src in zip(filenames, sources) if src < 0]
+    todo_hashes = [digest for digest, src in zip(hashes, sources) if src < 0]
+    print(f"{len(filenames) - len(todo)} chunks unchanged, {len(todo)} to embed")
+
+    start = time.perf_counter()
+    if workers > 1 and todo:
+        shard_paths = embed_sharded(
+            todo, todo_hashes, batch_size, num_threads, workers, shard_size
+        )
+        elapsed = time.perf_counter() - start
+        new_blocks = read_shards(shard_paths)
+    elif todo:
+        embedder = get_embedder()
+        embedder.set_num_threads(num_threads)
+        new_blocks = [embedder.embed_batch(read_chunks(todo), batch_size=batch_size)]
+        elapsed = time.perf_counter() - start
+    else:
+        new_blocks = []
+        elapsed = 0.0
+
+    # Rows follow the sorted chunk list; new rows arrive in the same order
+    write_store(
+        filenames,
+        hashes,
+        merge_rows(sources, old_embeddings, new_blocks),
+        info=embedder_info(),
+    )
+    shutil.rmtree(SHARD_DIR, ignore_errors=True)
+    print(f"Saved {len(filenames)} embeddings to {EMBEDDING_STORE_FILE}")
+
+    rate = len(todo) / elapsed if elapsed > 0 else 0.0
+    print(
+        f"Embedded {len(todo)} chunks in {elapsed:.2f}s "
+        f"({rate:.1f} chunks/sec, batch size {batch_size}, "
+        f"{num_threads} threads, {workers} workers)"
+    )
 
 
 def process_query(query_text, output_path):
@@ -55,9 +239,45 @@ def process_query(query_text, output_path):
     parser.add_argument(
         "--output", type=str, help="Output file path for the query embedding"
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=EMBEDDING_BATCH_SIZE,
+        help="Number of chunks per forward pass",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=EMBEDDING_THREADS,
+        help="Number of CPU threads used by torch, split across workers",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=EMBEDDING_WORKERS,
+        help="Number of worker processes, each embedding its own shard",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=EMBEDDING_SHARD_SIZE,
+        help="Number of chunks per shard when --workers is above 1",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Re-embed every chunk instead of only new or changed ones",
+    )
     args = parser.parse_args()
+    ensure_directories()
 
     if args.query and args.output:
         process_query(args.query, args.output)
     else:
-        process_files()
+        process_files(
+            batch_size=args.batch_size,
+            num_threads=args.threads,
+            workers=args.workers,
+            shard_size=args.shard_size,
+            rebuild=args.rebuild,
+        )
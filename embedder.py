@@ -0,0 +1,359 @@
+import os
+import re
+import zlib
+import numpy as np
+from config import (
+    EMBEDDING_MODEL,
+    EMBEDDING_BACKEND,
+    ONNX_MODELS_PATH,
+    STUB_MODEL,
+    STUB_EMBEDDING_DIM,
+    EMBEDDING_MAX_TOKENS,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_THREADS,
+)
+
+# Process-wide embedder, created on first use by get_embedder()
+_embedder = None
+
+
+def mean_pool(hidden_states, attention_mask):
+    """Average token embeddings, ignoring padding positions."""
+    mask = attention_mask.unsqueeze(-1).to(hidden_states.dtype)
+    summed = (hidden_states * mask).sum(dim=1)
+    counts = mask.sum(dim=1).clamp(min=1.0)
+    return summed / counts
+
+
+def mean_pool_numpy(hidden_states, attention_mask):
+    """mean_pool for NumPy arrays."""
+    mask = attention_mask[..., None].astype(hidden_states.dtype)
+    summed = (hidden_states * mask).sum(axis=1)
+    return summed / np.maximum(mask.sum(axis=1), 1.0)
+
+
+class StubTokenizer:
+    """
+    Word tokenizer with the calling convention of a transformers tokenizer.
+
+    Each word or punctuation mark is one token and its id is a hash of the
+    text, so chunking and embedding can run without downloading a model.
+    """
+
+    pattern = re.compile(r"\w+|[^\w\s]")
+    model_max_length = 1 << 30
+
+    def _encode(self, text, return_offsets_mapping):
+        matches = list(self.pattern.finditer(text.lower()))
+        encoded = {"input_ids": [zlib.crc32(m.group().encode()) for m in matches]}
+        if return_offsets_mapping:
+            encoded["offset_mapping"] = [m.span() for m in matches]
+        return encoded
+
+    def __call__(self, text, return_offsets_mapping=False, **kwargs):
+        if isinstance(text, str):
+            return self._encode(text, return_offsets_mapping)
+        encoded = [self._encode(t, return_offsets_mapping) for t in text]
+        keys = ["input_ids"] + (["offset_mapping"] if return_offsets_mapping else [])
+        return {key: [e[key] for e in encoded] for key in keys}
+
+
+def load_tokenizer(model_name=EMBEDDING_MODEL):
+    """Load the tokenizer of an embedding model, or the stub word tokenizer."""
+    if model_name == STUB_MODEL:
+        return StubTokenizer()
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(model_name)
+
+
+class StubEmbedder:
+    """
+    Hashing embedder with the interface of Embedder, for offline benchmarks.
+
+    Token ids are hashed into a fixed number of signed buckets and the counts
+    normalised, so texts sharing words get similar vectors at a tiny fraction
+    of the cost of a forward pass.
+    """
+
+    backend = STUB_MODEL
+
+    def __init__(self, dim=STUB_EMBEDDING_DIM):
+        self.model_name = STUB_MODEL
+        self.tokenizer = StubTokenizer()
+        self.dim = dim
+        self.num_threads = 1
+
+    def set_num_threads(self, num_threads):
+        self.num_threads = num_threads
+
+    def embed_batch(self, texts, batch_size=EMBEDDING_BATCH_SIZE):
+        texts = list(texts)
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, ids in enumerate(self.tokenizer(texts)["input_ids"]):
+            ids = np.array(ids[:EMBEDDING_MAX_TOKENS], dtype=np.int64)
+            signs = np.where(ids & 1, 1.0, -1.0).astype(np.float32)
+            np.add.at(embeddings[row], (ids >> 1) % self.dim, signs)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+    def embed(self, text):
+        texts = [text] if isinstance(text, str) else list(text)
+        return self.embed_batch(texts)
+
+    def embed_query(self, query):
+        return self.embed(query).reshape(1, -1)
+
+
+class Embedder:
+    """
+    Embedding model that is loaded once and kept resident in the process.
+
+    Loading torch and the BERT weights takes seconds, so callers should share
+    a single instance through get_embedder() instead of creating their own.
+    torch and transformers are only imported when the first one is created.
+
+    This is the fp32 PyTorch backend. Subclasses run the same model another
+    way by overriding _load_model and _encode.
+    """
+
+    backend = "torch"
+
+    def __init__(self, model_name=EMBEDDING_MODEL, num_threads=EMBEDDING_THREADS):
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.set_num_threads(num_threads)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self._load_model()
+
+    def _load_model(self):
+        from transformers import AutoModel
+
+        self.model = AutoModel.from_pretrained(self.model_name)
+        self.model.eval()
+        self.dim = self.model.config.hidden_size
+
+    def set_num_threads(self, num_threads):
+        """Set the number of CPU threads torch uses for a forward pass."""
+        import torch
+
+        self.num_threads = num_threads
+        torch.set_num_threads(num_threads)
+
+    def _encode(self, input_ids):
+        """Run one padded forward pass over a list of token id lists."""
+        import torch
+
+        inputs = self.tokenizer.pad(
+            {"input_ids": input_ids}, padding=True, return_tensors="pt"
+        )
+        with torch.inference_mode():
+            outputs = self.model(**inputs)
+        return mean_pool(outputs.last_hidden_state, inputs["attention_mask"]).numpy()
+
+    def embed_batch(self, texts, batch_size=EMBEDDING_BATCH_SIZE):
+        """
+        Embed many texts in batches of similar token length.
+
+        Texts are tokenized once, sorted by length and grouped into batches so
+        each batch pads to roughly its own length rather than the longest text
+        in the corpus. Rows in the result follow the order of `texts`.
+        """
+        texts = list(texts)
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if not texts:
+            return embeddings
+
+        input_ids = self.tokenizer(
+            texts, truncation=True, max_length=EMBEDDING_MAX_TOKENS
+        )["input_ids"]
+        order = sorted(range(len(texts)), key=lambda i: len(input_ids[i]))
+        for start in range(0, len(order), batch_size):
+            batch = order[start : start + batch_size]
+            embeddings[batch] = self._encode([input_ids[i] for i in batch])
+        return embeddings
+
+    def embed(self, text):
+        """Generate embeddings for a string or a list of strings."""
+        texts = [text] if isinstance(text, str) else list(text)
+        return self.embed_batch(texts, batch_size=max(len(texts), 1))
+
+    def embed_query(self, query):
+        """Generate a (1, embedding_dim) embedding for a single query."""
+        return self.embed(query).reshape(1, -1)
+
+
+class QuantizedEmbedder(Embedder):
+    """
+    PyTorch backend with the linear layers dynamically quantized to int8.
+
+    Weights are stored as int8 and activations are quantized on the fly,
+    which speeds up CPU inference at a small cost in embedding accuracy.
+    """
+
+    backend = "int8"
+
+    def _load_model(self):
+        import torch
+
+        super()._load_model()
+        self.model = torch.ao.quantization.quantize_dynamic(
+            self.model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+
+
+def export_onnx(model_name, quantize=False, models_path=ONNX_MODELS_PATH):
+    """
+    Export a Hugging Face model to ONNX, optionally int8-quantized.
+
+    The export needs torch and runs once; the file is kept in models_path
+    and its path returned on later calls.
+    """
+    name = re.sub(r"[^\w.-]+", "_", model_name.strip("/"))
+    path = os.path.join(models_path, f"{name}.onnx")
+    quantized_path = os.path.join(models_path, f"{name}-int8.onnx")
+    target = quantized_path if quantize else path
+    if os.path.exists(target):
+        return target
+    os.makedirs(models_path, exist_ok=True)
+    tmp_path = f"{target}.{os.getpid()}.tmp"  # Worker processes may race
+
+    if not os.path.exists(path):
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+
+        print(f"Exporting {model_name} to ONNX...")
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name)
+        model.eval()
+        sample = tokenizer(["an example sentence"], return_tensors="pt")
+        input_names = [
+            name
+            for name in ("input_ids", "attention_mask", "token_type_ids")
+            if name in sample
+        ]
+
+        class LastHiddenState(torch.nn.Module):
+            # Traces the model with named inputs and a single tensor output
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+
+            def forward(self, *inputs):
+                return self.model(**dict(zip(input_names, inputs))).last_hidden_state
+
+        dynamic = {0: "batch", 1: "sequence"}
+        torch.onnx.export(
+            LastHiddenState(model),
+            tuple(sample[name] for name in input_names),
+            tmp_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                name: dynamic for name in input_names + ["last_hidden_state"]
+            },
+            opset_version=17,
+            dynamo=False,
+        )
+        os.replace(tmp_path, path)
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        quantize_dynamic(path, tmp_path, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, quantized_path)
+    return target
+
+
+class OnnxEmbedder(Embedder):
+    """
+    Backend that runs an ONNX export of the model with ONNX Runtime.
+
+    The model is exported on first use (see export_onnx); after that only
+    the tokenizer and ONNX Runtime are loaded, not torch.
+    """
+
+    backend = "onnx"
+    quantize = False
+
+    def set_num_threads(self, num_threads):
+        self.num_threads = num_threads
+        if getattr(self, "session", None) is not None:
+            self._load_model()  # Thread counts are fixed per session
+
+    def _load_model(self):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError(
+                f"The {self.backend} embedding backend needs ONNX Runtime: "
+                "pip install onnx onnxruntime"
+            )
+
+        path = export_onnx(self.model_name, quantize=self.quantize)
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.num_threads
+        self.session = onnxruntime.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.dim = self.session.get_outputs()[0].shape[-1]
+
+    def _encode(self, input_ids):
+        inputs = self.tokenizer.pad(
+            {"input_ids": input_ids}, padding=True, return_tensors="np"
+        )
+        feed = {}
+        for name in self.input_names:
+            if name in inputs:
+                feed[name] = inputs[name].astype(np.int64)
+            else:
+                feed[name] = np.zeros_like(inputs["input_ids"], dtype=np.int64)
+        hidden_states = self.session.run(None, feed)[0]
+        return mean_pool_numpy(hidden_states, inputs["attention_mask"])
+
+
+class QuantizedOnnxEmbedder(OnnxEmbedder):
+    """ONNX Runtime backend with weights dynamically quantized to int8."""
+
+    backend = "onnx-int8"
+    quantize = True
+
+
+# Embedding backends selectable with EMBEDDING_BACKEND
+EMBEDDING_BACKENDS = {
+    "torch": Embedder,
+    "int8": QuantizedEmbedder,
+    "onnx": OnnxEmbedder,
+    "onnx-int8": QuantizedOnnxEmbedder,
+}
+
+
+def embedder_info(model_name=EMBEDDING_MODEL, backend=EMBEDDING_BACKEND):
+    """Describe the configured embedder without loading it."""
+    if model_name == STUB_MODEL:
+        backend = STUB_MODEL
+    return {"model": model_name, "backend": backend}
+
+
+def create_embedder(
+    model_name=EMBEDDING_MODEL, backend=EMBEDDING_BACKEND, num_threads=EMBEDDING_THREADS
+):
+    """Create an embedder for a model with the given backend."""
+    if model_name == STUB_MODEL:
+        return StubEmbedder()
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(
+            f"Unknown embedding backend {backend!r}. "
+            f"Choose from {sorted(EMBEDDING_BACKENDS)}."
+        )
+    return EMBEDDING_BACKENDS[backend](model_name, num_threads)
+
+
+def get_embedder():
+    """Return the shared embedder, loading the model on the first call."""
+    global _embedder
+    if _embedder is None:
+        _embedder = create_embedder()
+    return _embedder
@@ -0,0 +1,133 @@
+import os
+import json
+import itertools
+import numpy as np
+from config import (
+    EMBEDDING_STORE_FILE,
+    EMBEDDING_STORE_META,
+    EMBEDDING_STORE_INFO,
+    EMBEDDING_STORE_DTYPE,
+)
+
+
+def write_store(
+    names,
+    hashes,
+    blocks,
+    store_file=EMBEDDING_STORE_FILE,
+    meta_file=EMBEDDING_STORE_META,
+    info=None,
+    info_file=EMBEDDING_STORE_INFO,
+    dtype=EMBEDDING_STORE_DTYPE,
+):
+    """
+    Write the embedding store: one matrix plus a metadata table.
+
+    The matrix holds float32 vectors, or float16 ones with `dtype`, which
+    halves the store at a precision loss far below what retrieval notices.
+
+    The metadata table holds each row's chunk name and content hash, which is
+    what incremental runs compare against to decide what to re-embed. `info`
+    describes the embedder that produced the vectors (see
+    embedder.embedder_info) and is saved with their dimension.
+
+    `blocks` is an iterable of 2-D arrays whose rows follow `names`, so shards
+    can be copied straight into the on-disk matrix without first being joined
+    in memory. Both files are written under temporary names and renamed into
+    place, so readers never see a half-written store.
+    """
+    blocks = iter(blocks)
+    first = next(blocks, None)
+    dim = first.shape[1] if first is not None else 0
+
+    os.makedirs(os.path.dirname(store_file), exist_ok=True)
+    tmp_store = store_file + ".tmp"
+    matrix = np.lib.format.open_memmap(
+        tmp_store, mode="w+", dtype=dtype, shape=(len(names), dim)
+    )
+    row = 0
+    for block in itertools.chain([first] if first is not None else [], blocks):
+        matrix[row : row + len(block)] = block
+        row += len(block)
+    if row != len(names):
+        raise ValueError(f"Embedding store expected {len(names)} rows, got {row}")
+    matrix.flush()
+    del matrix
+
+    tmp_meta = meta_file + ".tmp"
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        for row, (name, digest) in enumerate(zip(names, hashes)):
+            f.write(f"{row}\t{name}\t{digest}\n")
+
+    tmp_info = info_file + ".tmp"
+    with open(tmp_info, "w", encoding="utf-8") as f:
+        json.dump(dict(info or {}, dim=dim, dtype=np.dtype(dtype).name), f, indent=2)
+
+    os.replace(tmp_store, store_file)
+    os.replace(tmp_meta, meta_file)
+    os.replace(tmp_info, info_file)
+
+
+def read_store_info(info_file=EMBEDDING_STORE_INFO):
+    """Return the description of the embedder behind the store, or None."""
+    try:
+        with open(info_file, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def read_store(store_file=EMBEDDING_STORE_FILE, meta_file=EMBEDDING_STORE_META):
+    """
+    Open the embedding store, returning (names, hashes, embeddings).
+
+    The matrix is memory-mapped read-only, so opening it costs nothing until
+    rows are touched and it can be passed to FAISS without an extra copy.
+    """
+    if not os.path.exists(store_file) or not os.path.exists(meta_file):
+        raise FileNotFoundError(
+            f"Embedding store not found at {store_file}. Please run create_embeddings.py first."
+        )
+
+    embeddings = np.load(store_file, mmap_mode="r")
+    names = []
+    hashes = []
+    with open(meta_file, encoding="utf-8") as f:
+        for line in f:
+            _, name, digest = line.rstrip("\n").split("\t")
+            names.append(name)
+            hashes.append(digest)
+
+    if len(names) != embeddings.shape[0]:
+        raise ValueError(
+            f"Embedding store is inconsistent: {embeddings.shape[0]} rows but {len(names)} names"
+        )
+    return names, hashes, embeddings
+
+
+def merge_rows(sources, old_embeddings, new_blocks, block_size=4096):
+    """
+    Yield blocks of a new store built from reused and freshly embedded rows.
+
+    `sources` gives, for every output row, the row to copy from
+    `old_embeddings` or -1 if the row comes next from `new_blocks`. New rows
+    are consumed in order, so shards can be streamed without joining them.
+    """
+    new_blocks = iter(new_blocks)
+    pending = None
+    for start in range(0, len(sources), block_size):
+        src = sources[start : start + block_size]
+        reused = src >= 0
+        needed = int((~reused).sum())
+        while needed and (pending is None or len(pending) < needed):
+            block = next(new_blocks)
+            pending = block if pending is None else np.concatenate([pending, block])
+
+        dim = old_embeddings.shape[1] if reused.any() else pending.shape[1]
+        out = np.empty((len(src), dim), dtype=np.float32)
+        if reused.any():
+            out[reused] = old_embeddings[src[reused]]
+        if needed:
+            out[~reused] = pending[:needed]
+            pending = pending[needed:]
+        yield out
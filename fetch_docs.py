@@ -1,21 +1,72 @@
 import os
-import requests
-from bs4 import BeautifulSoup
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin, urlparse
-from config import DEFAULT_DOCS_URL, RAW_DOCS_PATH
+from config import (
+    DEFAULT_DOCS_URL,
+    RAW_DOCS_PATH,
+    FETCH_MANIFEST,
+    FETCH_WORKERS,
+    FETCH_RETRIES,
+    FETCH_BACKOFF,
+    FETCH_TIMEOUT,
+    ensure_directories,
+)
+from manifest import load_manifest, save_manifest
+from normalize_docs import html_parser
+
+
+def create_session(
+    pool_size=FETCH_WORKERS, retries=FETCH_RETRIES, backoff=FETCH_BACKOFF
+):
+    """
+    Create a session that pools connections and retries transient failures.
+
+    Connection errors and 429/5xx responses are retried with exponential
+    backoff, honouring Retry-After when the server sends it. requests is
+    imported here rather than at startup.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET", "HEAD"),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 
-def fetch_url(url):
+def fetch_url(url, session=None):
     """Fetch content from URL."""
-    response = requests.get(url)
+    if session is None:
+        import requests
+
+        session = requests
+    response = session.get(url, timeout=FETCH_TIMEOUT)
     response.raise_for_status()
     return response.text
 
 
 def get_links(html, file_ext=""):
-    """Extract links with specified extension from HTML."""
-    soup = BeautifulSoup(html, "html.parser")
+    """
+    Extract links with specified extension from HTML.
+
+    Only <a> tags are parsed, with lxml when it is installed, so large
+    listing pages are not turned into a full tree by the pure-Python parser.
+    """
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    soup = BeautifulSoup(html, html_parser(), parse_only=SoupStrainer("a", href=True))
     links = []
     for link in soup.find_all("a", href=True):
         if file_ext in link["href"]:
@@ -23,63 +74,155 @@ def get_links(html, file_ext=""):
     return links
 
 
-def download_file(url, save_path):
-    """Download file from URL to specified path."""
-    response = requests.get(url)
-    response.raise_for_status()
-    with open(save_path, "wb") as f:
-        f.write(response.content)
-
+def download_file(url, save_path, session=None, cached=None):
+    """
+    Download file from URL to specified path.
 
-def fetch_docs(url=None):
+    If `cached` holds the ETag or Last-Modified of the copy already on disk,
+    the request is conditional and a 304 leaves the file untouched. The body
+    is streamed to a temporary file that replaces the old copy only once it is
+    complete. Returns (changed, cache entry, bytes written).
+    """
+    headers = {}
+    if cached and os.path.exists(save_path):
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    if session is None:
+        import requests
+
+        session = requests
+    with session.get(
+        url, headers=headers, stream=True, timeout=FETCH_TIMEOUT
+    ) as response:
+        if response.status_code == 304:
+            return False, cached, 0
+        response.raise_for_status()
+
+        written = 0
+        tmp_path = save_path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                for block in response.iter_content(chunk_size=64 * 1024):
+                    f.write(block)
+                    written += len(block)
+            os.replace(tmp_path, save_path)
+        finally:
+            # A download that failed part way leaves nothing behind
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        entry = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+    return True, entry, written
+
+
+def find_doc_links(docs_url, session):
+    """Return the download URLs of the markdown files listed at docs_url."""
+    base_html = fetch_url(docs_url, session)
+    md_links = get_links(base_html, ".md")
+
+    # Handle GitHub URLs specifically
+    if "github.com" in urlparse(docs_url).netloc:
+        # Filter for valid docs links and remove duplicates (GitHub specific)
+        valid_links = []
+        for link in md_links:
+            if "blob/main/docs/" in link or "blob/master/docs/" in link:
+                raw_url = "https://raw.githubusercontent.com" + link.replace(
+                    "/blob", ""
+                )
+                valid_links.append(raw_url)
+        return sorted(set(valid_links))
+
+    # Handle generic URLs
+    base_url = docs_url.rstrip("/")
+    return sorted(set(urljoin(base_url, link) for link in md_links))
+
+
+def fetch_docs(
+    url=None,
+    workers=FETCH_WORKERS,
+    raw_dir=RAW_DOCS_PATH,
+    manifest_path=FETCH_MANIFEST,
+):
     """
     Fetch documentation from specified URL.
 
+    Files are downloaded concurrently by up to `workers` threads sharing one
+    pooled session. The ETag and Last-Modified of every file are kept in a
+    fetch manifest, so a later sync sends conditional requests and only
+    transfers files that changed on the server.
+
     Args:
-        url: Optional URL to fetch docs from. Uses DEFAULT_DOCS_URL if not provided.
+        url: Optional URL to fetch docs from. Defaults to the URL of the last
+            sync, saved in the fetch manifest, and then to DEFAULT_DOCS_URL,
+            so each collection (RAG_COLLECTION) keeps its own source.
+
+    Returns:
+        Counts of downloaded, unchanged and failed files and bytes transferred.
     """
-    docs_url = url or DEFAULT_DOCS_URL
+    os.makedirs(raw_dir, exist_ok=True)
+    manifest = load_manifest(manifest_path)
+    docs_url = url or manifest.get("url") or DEFAULT_DOCS_URL
     print(f"Fetching documentation from: {docs_url}")
-
-    try:
-        # Handle GitHub URLs specifically
-        if "github.com" in docs_url:
-            base_html = fetch_url(docs_url)
-            md_links = get_links(base_html, ".md")
-
-            # Filter for valid docs links and remove duplicates (GitHub specific)
-            valid_links = []
-            for link in md_links:
-                if "blob/main/docs/" in link or "blob/master/docs/" in link:
-                    raw_url = "https://raw.githubusercontent.com" + link.replace(
-                        "/blob", ""
-                    )
-                    valid_links.append(raw_url)
-            valid_links = list(set(valid_links))
-
-        else:
-            # Handle generic URLs
-            base_url = docs_url.rstrip("/")
-            base_html = fetch_url(docs_url)
-            md_links = get_links(base_html, ".md")
-            valid_links = [urljoin(base_url, link) for link in md_links]
-
-        # Download files
+    files = manifest.get("files", {})
+    stats = {"downloaded": 0, "unchanged": 0, "failed": 0, "bytes": 0}
+
+    with create_session(pool_size=workers) as session:
+        try:
+            valid_links = find_doc_links(docs_url, session)
+        except Exception as e:
+            print(f"Error processing URL {docs_url}: {e}")
+            raise
+
+        # Several links can point at the same file name; keep the first
+        targets = {}
         for link in valid_links:
+            filename = os.path.basename(link.split("#")[0])  # Remove anchors
+            if filename.endswith(".md"):
+                targets.setdefault(filename, link)
+
+        def fetch_one(item):
+            filename, link = item
+            cached = files.get(filename)
+            if cached and cached.get("url") != link:
+                cached = None  # The file now comes from somewhere else
             try:
-                filename = os.path.basename(link.split("#")[0])  # Remove anchors
-                if filename.endswith(".md"):
-                    save_path = os.path.join(RAW_DOCS_PATH, filename)
-                    os.makedirs(os.path.dirname(save_path), exist_ok=True)
-                    print(f"Downloading: {filename} from {link}")
-                    download_file(link, save_path)
-                    print(f"Downloaded: {filename}")
+                changed, entry, written = download_file(
+                    link, os.path.join(raw_dir, filename), session, cached
+                )
+                return filename, changed, entry, written, None
             except Exception as e:
-                print(f"Error downloading {link}: {e}")
-
-    except Exception as e:
-        print(f"Error processing URL {docs_url}: {e}")
-        raise
+                return filename, False, cached, 0, e
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for filename, changed, entry, written, error in pool.map(
+                fetch_one, targets.items()
+            ):
+                if error is not None:
+                    print(f"Error downloading {targets[filename]}: {error}")
+                    stats["failed"] += 1
+                    continue
+                files[filename] = entry
+                if changed:
+                    print(f"Downloaded: {filename}")
+                    stats["downloaded"] += 1
+                    stats["bytes"] += written
+                else:
+                    stats["unchanged"] += 1
+
+    manifest["url"] = docs_url
+    manifest["files"] = files
+    save_manifest(manifest_path, manifest)
+    print(
+        f"Fetched {stats['downloaded']} files ({stats['bytes']} bytes), "
+        f"{stats['unchanged']} unchanged, {stats['failed']} failed"
+    )
+    return stats
 
 
 if __name__ == "__main__":
@@ -87,6 +230,13 @@ def fetch_docs(url=None):
         description="Fetch documentation from specified URL"
     )
     parser.add_argument("--url", help="URL to fetch documentation from")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=FETCH_WORKERS,
+        help="Number of files to download at once",
+    )
     args = parser.parse_args()
+    ensure_directories()
 
-    fetch_docs(args.url)
+    fetch_docs(args.url, workers=args.workers)
@@ -0,0 +1,60 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+
+def content_hash(text):
+    """Return the SHA-256 hex digest of a text's UTF-8 bytes."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_hash(path, block_size=1 << 20):
+    """Return the SHA-256 hex digest of a file, reading it in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id(name, digest):
+    """
+    Derive a stable FAISS id for a chunk from its name and content hash.
+
+    Editing a chunk changes its id, so incremental index updates reduce to
+    removing ids that disappeared and adding ids that are new.
+    """
+    key = f"{name}\0{digest}".encode("utf-8")
+    value = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+    return value & 0x7FFFFFFFFFFFFFFF  # FAISS ids are signed 64-bit
+
+
+def load_manifest(path):
+    """Load a JSON manifest, returning an empty one if it does not exist yet."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    """Write a JSON manifest atomically."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def save_array(path, array):
+    """
+    Write a .npy file atomically.
+
+    Readers may have the old file memory-mapped; replacing it rather than
+    overwriting it in place leaves their mapping intact.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
@@ -0,0 +1,213 @@
+import json
+import time
+import bisect
+import threading
+import contextlib
+import contextvars
+from config import METRICS_ENABLED
+
+# Upper bounds in seconds, from sub-millisecond searches to slow generations
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+_enabled = METRICS_ENABLED
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> Histogram
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+_null_span = contextlib.nullcontext()
+
+
+def enable(flag=True):
+    """Turn metrics and tracing on or off for this process."""
+    global _enabled
+    _enabled = flag
+
+
+def is_enabled():
+    return _enabled
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Add to a counter."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Record a value, usually a duration in seconds, in a histogram."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(value)
+
+
+class Trace:
+    """Spans recorded while handling one request."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.attributes = {}
+
+    def to_dict(self):
+        return {
+            "trace": self.name,
+            "started": self.started,
+            "duration_ms": round((time.perf_counter() - self.origin) * 1000.0, 3),
+            "attributes": self.attributes,
+            "spans": self.spans,
+        }
+
+
+@contextlib.contextmanager
+def trace(name, **attributes):
+    """
+    Collect the spans of one request into a Trace.
+
+    Yields the Trace, or None when metrics are disabled. Spans opened in
+    this context, including in worker threads started with a copy of it,
+    are added to the trace.
+    """
+    if not _enabled:
+        yield None
+        return
+    current = Trace(name)
+    current.attributes.update(attributes)
+    token = _current_trace.set(current)
+    try:
+        with span(name):
+            yield current
+    finally:
+        _current_trace.reset(token)
+
+
+@contextlib.contextmanager
+def _timed_span(name):
+    parent = _current_span.get()
+    token = _current_span.set(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        _current_span.reset(token)
+        observe("rag_stage_duration_seconds", end - start, stage=name)
+        current = _current_trace.get()
+        if current is not None:
+            current.spans.append(
+                {
+                    "name": name,
+                    "parent": parent,
+                    "start_ms": round((start - current.origin) * 1000.0, 3),
+                    "duration_ms": round((end - start) * 1000.0, 3),
+                }
+            )
+
+
+def span(name):
+    """
+    Time a stage of the query path.
+
+    The duration goes into the rag_stage_duration_seconds histogram and, if
+    a trace is active, into the trace. When metrics are disabled this returns
+    a shared no-op context manager, so instrumented code pays only for the
+    call.
+    """
+    if not _enabled:
+        return _null_span
+    return _timed_span(name)
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+def render_prometheus():
+    """Render all counters and histograms in the Prometheus text format."""
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(_histograms.items(), key=lambda item: item[0])
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                lines.append(f"# TYPE {name} histogram")
+                seen.add(name)
+            cumulative = 0
+            bounds = [str(bound) for bound in histogram.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, histogram.counts):
+                cumulative += count
+                lines.append(
+                    f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}"
+                )
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_trace(current, path):
+    """Append a finished trace to a JSON-lines file."""
+    if current is None:
+        return
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(current.to_dict()) + "\n")
+
+
+def reset():
+    """Forget all recorded metrics."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
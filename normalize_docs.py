@@ -0,0 +1,303 @@
+import os
+import re
+import time
+import html
+import argparse
+import importlib.util
+import multiprocessing
+from config import (
+    RAW_DOCS_PATH,
+    NORMALIZED_DOCS_PATH,
+    NORMALIZE_MANIFEST,
+    NORMALIZE_WORKERS,
+    ensure_directories,
+)
+from manifest import file_hash, load_manifest, save_manifest
+
+# Bump when the normalization rules change, so every document is redone
+NORMALIZER_VERSION = 2
+HTML_EXTENSIONS = (".html", ".htm")
+
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+CODE_SPAN_PATTERN = re.compile(r"(`+).+?\1")
+COMMENT_PATTERN = re.compile(r"<!--.*?-->")
+IMAGE_PATTERN = re.compile(r"!\[[^\]]*\]\([^)]*\)|!\[[^\]]*\]\[[^\]]*\]")
+INLINE_LINK_PATTERN = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+REFERENCE_LINK_PATTERN = re.compile(r"\[([^\]]+)\]\[[^\]]*\]")
+LINK_DEFINITION_PATTERN = re.compile(r"^\s{0,3}\[[^\]]+\]:\s+\S+.*$")
+AUTOLINK_PATTERN = re.compile(r"<((?:https?|mailto):[^>\s]+)>")
+BREAK_PATTERN = re.compile(r"<br\s*/?>", re.IGNORECASE)
+# Only tags of these elements are stripped from markdown, so placeholders
+# such as <model> or <host>:<port> in the prose are kept
+HTML_TAGS = (
+    "a abbr b big blockquote br center code dd del details div dl dt em "
+    "figcaption figure font h1 h2 h3 h4 h5 h6 hr i iframe img ins kbd li mark "
+    "ol p picture pre s small source span strong sub summary sup table tbody "
+    "td th thead tr u ul video"
+).split()
+TAG_PATTERN = re.compile(
+    r"</?(?:" + "|".join(HTML_TAGS) + r")(?:\s[^<>]*)?/?>", re.IGNORECASE
+)
+BLANK_LINES_PATTERN = re.compile(r"\n{3,}")
+
+
+def html_parser():
+    """Return the fastest BeautifulSoup parser installed: lxml, else html.parser."""
+    return "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+
+
+def clean_inline(text):
+    """Strip images, link syntax and HTML tags from markdown outside code spans."""
+    text = IMAGE_PATTERN.sub("", text)
+    # Twice, so the text of a link wrapping another link is kept too
+    for _ in range(2):
+        text = INLINE_LINK_PATTERN.sub(r"\1", text)
+    text = REFERENCE_LINK_PATTERN.sub(r"\1", text)
+    text = AUTOLINK_PATTERN.sub(r"\1", text)
+    text = BREAK_PATTERN.sub(" ", text)
+    text = TAG_PATTERN.sub("", text)
+    return html.unescape(text)
+
+
+def clean_line(line):
+    """Clean one markdown line, leaving inline code spans untouched."""
+    parts = []
+    position = 0
+    for match in CODE_SPAN_PATTERN.finditer(line):
+        parts.append(clean_inline(line[position : match.start()]))
+        parts.append(match.group(0))
+        position = match.end()
+    parts.append(clean_inline(line[position:]))
+    return "".join(parts).rstrip()
+
+
+def normalize_markdown(text):
+    """
+    Strip markup noise from a markdown document, keeping its structure.
+
+    Badges and other images, HTML comments, tags of the HTML_TAGS elements,
+    link reference definitions and link targets are removed, leaving link
+    text and the plain text of HTML fragments. Other angle-bracket text,
+    such as a <model> placeholder, is kept. Headings, lists, tables and fenced code
+    blocks are kept as they are, since chunk_docs.py splits on them. Lines
+    left empty by the cleaning are dropped along with runs of blank lines.
+    """
+    lines = []
+    fence = None
+    in_comment = False
+    for line in text.splitlines():
+        if fence is not None:
+            lines.append(line.rstrip())
+            if line.strip().startswith(fence):
+                fence = None
+            continue
+        original = line
+        if in_comment:
+            end = line.find("-->")
+            if end < 0:
+                continue
+            line, in_comment = line[end + 3 :], False
+        line = COMMENT_PATTERN.sub("", line)
+        if "<!--" in line:
+            line, in_comment = line[: line.index("<!--")], True
+
+        fence_match = FENCE_PATTERN.match(line)
+        if fence_match:
+            fence = fence_match.group(1)
+            lines.append(line.rstrip())
+        elif not LINK_DEFINITION_PATTERN.match(line):
+            cleaned = clean_line(line)
+            # Drop lines that held nothing but markup
+            if cleaned.strip() or not original.strip():
+                lines.append(cleaned)
+    text = BLANK_LINES_PATTERN.sub("\n\n", "\n".join(lines)).strip()
+    return text + "\n" if text else ""
+
+
+def normalize_html(text, parser=None):
+    """
+    Extract the text and structure of an HTML page as markdown.
+
+    Scripts, styles and page chrome (navigation, header, footer) are
+    dropped. Headings become markdown headings and <pre> blocks fenced code,
+    so chunk_docs.py splits the page as it would a markdown document.
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(text, parser or html_parser())
+    for tag in soup(["script", "style", "nav", "header", "footer", "noscript"]):
+        tag.decompose()
+    body = soup.body or soup
+
+    blocks = []
+    for element in body.find_all(
+        ["h1", "h2", "h3", "h4", "h5", "h6", "p", "li", "pre", "td", "th"]
+    ):
+        # Text of nested blocks is taken from the innermost one
+        if element.name != "pre" and element.find(["p", "li", "pre"]):
+            continue
+        if element.find_parent("pre"):
+            continue
+        if element.name == "pre":
+            blocks.append(f"```\n{element.get_text().rstrip()}\n```")
+            continue
+        content = " ".join(element.get_text().split())
+        if not content:
+            continue
+        if element.name[0] == "h" and element.name[1:].isdigit():
+            blocks.append("#" * int(element.name[1]) + " " + content)
+        elif element.name == "li":
+            blocks.append("- " + content)
+        else:
+            blocks.append(content)
+    return "\n\n".join(blocks) + "\n" if blocks else ""
+
+
+def output_name(filename):
+    """
+    Name of the normalized copy of a raw document.
+
+    HTML pages become markdown named after the page and its extension, so
+    foo.html and foo.md do not overwrite each other.
+    """
+    base, ext = os.path.splitext(filename)
+    if ext.lower() in HTML_EXTENSIONS:
+        return f"{base}_{ext[1:].lower()}.md"
+    return filename
+
+
+def normalize_file(task):
+    """
+    Normalize one raw document and write it to the normalized docs directory.
+
+    Returns (filename, output name, bytes read, bytes written).
+    """
+    filename, parser = task
+    with open(os.path.join(RAW_DOCS_PATH, filename), "r", encoding="utf-8") as f:
+        text = f.read()
+    if filename.lower().endswith(HTML_EXTENSIONS):
+        normalized = normalize_html(text, parser)
+    else:
+        normalized = normalize_markdown(text)
+
+    name = output_name(filename)
+    tmp_path = os.path.join(NORMALIZED_DOCS_PATH, name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(normalized)
+    os.replace(tmp_path, os.path.join(NORMALIZED_DOCS_PATH, name))
+    return filename, name, len(text.encode("utf-8")), len(normalized.encode("utf-8"))
+
+
+def remove_output(name):
+    """Delete a normalized document written for a raw one that is gone."""
+    path = os.path.join(NORMALIZED_DOCS_PATH, name)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def normalize_docs(rebuild=False, workers=NORMALIZE_WORKERS, parser=None):
+    """
+    Normalize the raw documents for chunking.
+
+    Markdown and HTML files in the raw docs directory are cleaned of markup
+    noise (see normalize_markdown and normalize_html) and written to the
+    normalized docs directory, which chunk_docs.py reads. A manifest keeps
+    each raw document's content hash, so unchanged documents are skipped and
+    the normalized copies of deleted ones are removed. Changed documents are
+    normalized in parallel across worker processes; HTML is parsed with lxml
+    when it is installed.
+
+    Returns counts of normalized, unchanged and removed documents, bytes
+    read and written, and documents per second.
+    """
+    os.makedirs(NORMALIZED_DOCS_PATH, exist_ok=True)
+    parser = parser or html_parser()
+    manifest = load_manifest(NORMALIZE_MANIFEST)
+    docs = manifest.get("docs", {})
+    if rebuild or manifest.get("version") != NORMALIZER_VERSION:
+        for entry in docs.values():
+            remove_output(entry["output"])
+        docs = {}
+    stats = {
+        "normalized": 0,
+        "unchanged": 0,
+        "removed": 0,
+        "bytes_in": 0,
+        "bytes_out": 0,
+    }
+    seen = set()
+    tasks = []
+    hashes = {}
+
+    start = time.perf_counter()
+    for filename in sorted(os.listdir(RAW_DOCS_PATH)):
+        if not filename.lower().endswith((".md",) + HTML_EXTENSIONS):
+            continue
+        seen.add(filename)
+        digest = file_hash(os.path.join(RAW_DOCS_PATH, filename))
+        entry = docs.get(filename)
+        if (
+            entry
+            and entry["hash"] == digest
+            and os.path.exists(os.path.join(NORMALIZED_DOCS_PATH, entry["output"]))
+        ):
+            stats["unchanged"] += 1
+            continue
+        hashes[filename] = digest
+        tasks.append((filename, parser))
+
+    if tasks:
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(min(workers, len(tasks))) as pool:
+            for filename, name, read, written in pool.imap_unordered(
+                normalize_file, tasks, chunksize=max(1, len(tasks) // (workers * 4))
+            ):
+                docs[filename] = {"hash": hashes[filename], "output": name}
+                stats["normalized"] += 1
+                stats["bytes_in"] += read
+                stats["bytes_out"] += written
+
+    outputs = {entry["output"] for name, entry in docs.items() if name in seen}
+    for filename in sorted(set(docs) - seen):
+        name = docs.pop(filename)["output"]
+        if name not in outputs:
+            remove_output(name)
+        stats["removed"] += 1
+        print(f"Removed normalized copy of deleted document {filename}")
+    seconds = time.perf_counter() - start
+
+    manifest["version"] = NORMALIZER_VERSION
+    manifest["docs"] = docs
+    save_manifest(NORMALIZE_MANIFEST, manifest)
+    stats["seconds"] = round(seconds, 3)
+    stats["docs_per_sec"] = (
+        round(stats["normalized"] / seconds, 1) if seconds > 0 else None
+    )
+    print(
+        f"Normalized {stats['normalized']} documents "
+        f"({stats['bytes_in']} -> {stats['bytes_out']} bytes) in {seconds:.2f}s, "
+        f"{stats['docs_per_sec']} docs/sec with {parser}; "
+        f"{stats['unchanged']} unchanged, {stats['removed']} removed"
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Strip markup noise from raw documents before chunking"
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Normalize every document instead of only changed ones",
+    )
+    parser.add_argument("--workers", type=int, default=NORMALIZE_WORKERS)
+    parser.add_argument(
+        "--parser",
+        choices=["lxml", "html.parser"],
+        help="BeautifulSoup parser for HTML pages (default: lxml if installed)",
+    )
+    args = parser.parse_args()
+    ensure_directories()
+
+    normalize_docs(rebuild=args.rebuild, workers=args.workers, parser=args.parser)
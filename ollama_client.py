@@ -0,0 +1,140 @@
+import json
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from config import (
+    OLLAMA_HOST,
+    OLLAMA_TIMEOUT,
+    OLLAMA_POOL_SIZE,
+    OLLAMA_KEEP_ALIVE,
+)
+
+# Process-wide client, created on first use by get_client()
+_client = None
+
+
+def normalize_host(host):
+    """Accept OLLAMA_HOST values with or without a scheme, like the Ollama CLI."""
+    if "://" not in host:
+        host = f"http://{host}"
+    return host.rstrip("/")
+
+
+class OllamaClient:
+    """
+    Client for Ollama's local HTTP API.
+
+    Requests go through one requests.Session, so connections to the server are
+    pooled and kept alive between questions instead of spawning `ollama run`
+    for each one.
+    """
+
+    def __init__(
+        self, host=OLLAMA_HOST, timeout=OLLAMA_TIMEOUT, pool_size=OLLAMA_POOL_SIZE
+    ):
+        self.host = normalize_host(host)
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _request(self, method, path, **kwargs):
+        """Send a request, turning connection failures into a clear error."""
+        try:
+            response = self.session.request(
+                method, f"{self.host}{path}", timeout=self.timeout, **kwargs
+            )
+        except requests.ConnectionError as e:
+            raise RuntimeError(
+                f"Could not reach Ollama at {self.host}. Please install Ollama and make sure it is running."
+            ) from e
+        response.raise_for_status()
+        return response
+
+    def list_models(self):
+        """Return the names of locally available models."""
+        response = self._request("GET", "/api/tags")
+        return [model["name"] for model in response.json().get("models", [])]
+
+    def pull(self, model):
+        """Download a model, blocking until it is available."""
+        self._request("POST", "/api/pull", json={"model": model, "stream": False})
+
+    def generate(
+        self,
+        model,
+        prompt,
+        on_token=None,
+        options=None,
+        system=None,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+    ):
+        """
+        Stream a completion for `prompt`, returning (text, metrics).
+
+        `on_token` is called with each piece of text as it arrives. `system`
+        replaces the model's system prompt; it comes first in the model's
+        template, so keeping it constant lets Ollama reuse its evaluation
+        from the previous request. Metrics include time to first token, the
+        prompt tokens Ollama had to evaluate and generation speed in
+        tokens/sec, taken from Ollama's own eval counters when the server
+        reports them.
+        """
+        payload = {"model": model, "prompt": prompt, "stream": True}
+        if system is not None:
+            payload["system"] = system
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        if options:
+            payload["options"] = options
+
+        start = time.perf_counter()
+        first_token = None
+        parts = []
+        final = {}
+        with self._request(
+            "POST", "/api/generate", json=payload, stream=True
+        ) as response:
+            for line in response.iter_lines(chunk_size=None):
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise RuntimeError(f"Model query failed: {chunk['error']}")
+                token = chunk.get("response", "")
+                if token:
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                    parts.append(token)
+                    if on_token:
+                        on_token(token)
+                if chunk.get("done"):
+                    final = chunk  # Keep reading so the connection can be reused
+        end = time.perf_counter()
+
+        eval_count = final.get("eval_count", len(parts))
+        eval_seconds = final.get("eval_duration", 0) / 1e9
+        if not eval_seconds and first_token is not None:
+            eval_seconds = end - first_token
+        metrics = {
+            "time_to_first_token_s": (
+                round(first_token - start, 4) if first_token is not None else None
+            ),
+            "total_s": round(end - start, 4),
+            "prompt_eval_count": final.get("prompt_eval_count"),
+            "prompt_eval_s": round(final.get("prompt_eval_duration", 0) / 1e9, 4),
+            "eval_count": eval_count,
+            "tokens_per_sec": (
+                round(eval_count / eval_seconds, 2) if eval_seconds > 0 else None
+            ),
+        }
+        return "".join(parts), metrics
+
+
+def get_client():
+    """Return the shared Ollama client."""
+    global _client
+    if _client is None:
+        _client = OllamaClient()
+    return _client
@@ -0,0 +1,212 @@
+import os
+import time
+import pickle
+import threading
+import numpy as np
+import metrics
+from collections import OrderedDict
+from config import (
+    QUERY_CACHE_FILE,
+    QUERY_CACHE_MAX_ENTRIES,
+    QUERY_CACHE_TTL_SECONDS,
+    SEMANTIC_CACHE_THRESHOLD,
+    RERANK_MODEL,
+)
+from ann_index import load_index_info
+from embedder import embedder_info
+
+
+def normalize_query(query):
+    """Collapse whitespace and case so trivially different queries share entries."""
+    return " ".join(query.lower().split())
+
+
+def unit_vector(embedding):
+    """Flatten an embedding to float32 and scale it to unit length."""
+    vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class LRUCache:
+    """
+    Size-bounded mapping with least-recently-used eviction and a time to live.
+
+    Entries older than `ttl` seconds are dropped when they are looked up, and
+    the least recently used entry is evicted once `max_entries` is exceeded.
+    Safe to share between threads.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (stored_at, value)
+        self.lock = threading.Lock()
+
+    def _expired(self, stored_at, now):
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry[0], time.time()):
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def values(self):
+        """Return the live (key, value) pairs, least recently used first."""
+        now = time.time()
+        with self.lock:
+            return [
+                (key, value)
+                for key, (stored_at, value) in self.entries.items()
+                if not self._expired(stored_at, now)
+            ]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class QueryCache:
+    """
+    Layered cache for the query path.
+
+    - embeddings: query text -> query embedding
+    - contexts: (query text, retrieval settings) -> retrieved context
+    - answers: (query text, model, retrieval settings) -> (embedding, answer)
+
+    With a `semantic_threshold`, an answer miss falls back to the cached
+    answer whose query embedding is most similar to the new one, if its cosine
+    similarity reaches the threshold. Caches are saved to `path` and tied to
+    the index version written by setup_retriever.py, the reranker and the
+    query embedder: when the index is rebuilt or RERANK_MODEL,
+    EMBEDDING_MODEL or EMBEDDING_BACKEND changes, everything cached before
+    is discarded.
+    """
+
+    def __init__(
+        self,
+        version=None,
+        path=QUERY_CACHE_FILE,
+        max_entries=QUERY_CACHE_MAX_ENTRIES,
+        ttl=QUERY_CACHE_TTL_SECONDS,
+        semantic_threshold=SEMANTIC_CACHE_THRESHOLD,
+    ):
+        if version is None:
+            version = (load_index_info() or {}).get("version")
+        self.version = version
+        self.path = path
+        self.semantic_threshold = semantic_threshold
+        self.embeddings = LRUCache(max_entries, ttl)
+        self.contexts = LRUCache(max_entries, ttl)
+        self.answers = LRUCache(max_entries, ttl)
+        self.hits = {"embedding": 0, "context": 0, "answer": 0, "semantic": 0}
+        self.dirty = False  # Entries were added since the last save
+        self.load()
+
+    def load(self):
+        """Restore saved entries if they were cached against the current index."""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                saved = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            print(f"Ignoring unreadable query cache {self.path}: {e}")
+            return
+        if saved.get("version") != self.version:
+            return  # The index changed since these entries were cached
+        if saved.get("reranker", "") != RERANK_MODEL:
+            return  # Contexts were chosen by a different reranker
+        if saved.get("embedder") != embedder_info():
+            return  # Query embeddings came from a different embedder
+        for name in ("embeddings", "contexts", "answers"):
+            cache = getattr(self, name)
+            cache.entries.update(saved.get(name, {}))
+            while len(cache.entries) > cache.max_entries:
+                cache.entries.popitem(last=False)
+
+    def save(self):
+        """Write the caches atomically so they survive restarts."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.dirty = False
+        saved = {
+            "version": self.version,
+            "reranker": RERANK_MODEL,
+            "embedder": embedder_info(),
+        }
+        for name in ("embeddings", "contexts", "answers"):
+            cache = getattr(self, name)
+            with cache.lock:
+                saved[name] = OrderedDict(cache.entries)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(saved, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    def get_embedding(self, query):
+        embedding = self.embeddings.get(normalize_query(query))
+        if embedding is not None:
+            self.hits["embedding"] += 1
+            metrics.inc("rag_cache_hits_total", layer="embedding")
+        return embedding
+
+    def put_embedding(self, query, embedding):
+        self.embeddings.put(normalize_query(query), np.asarray(embedding))
+        self.dirty = True
+
+    def get_context(self, query, settings):
+        context = self.contexts.get((normalize_query(query), settings))
+        if context is not None:
+            self.hits["context"] += 1
+            metrics.inc("rag_cache_hits_total", layer="context")
+        return context
+
+    def put_context(self, query, settings, context):
+        self.contexts.put((normalize_query(query), settings), context)
+        self.dirty = True
+
+    def get_answer(self, query, model, settings, embedding=None):
+        """Return a cached answer for an identical or, optionally, similar query."""
+        entry = self.answers.get((normalize_query(query), model, settings))
+        if entry is not None:
+            self.hits["answer"] += 1
+            metrics.inc("rag_cache_hits_total", layer="answer")
+            return entry[1]
+        if self.semantic_threshold is None or embedding is None:
+            return None
+
+        candidates = [
+            (key, value)
+            for key, value in self.answers.values()
+            if key[1:] == (model, settings) and value[0] is not None
+        ]
+        if not candidates:
+            return None
+        stored = np.stack([value[0] for _, value in candidates])
+        similarity = stored @ unit_vector(embedding)
+        best = int(np.argmax(similarity))
+        if similarity[best] < self.semantic_threshold:
+            return None
+        key, (_, answer) = candidates[best]
+        self.answers.get(key)  # Mark as recently used
+        self.hits["semantic"] += 1
+        metrics.inc("rag_cache_hits_total", layer="semantic")
+        return answer
+
+    def put_answer(self, query, model, settings, answer, embedding=None):
+        # Store the unit-length embedding so similarity is a dot product
+        stored = unit_vector(embedding) if embedding is not None else None
+        self.answers.put((normalize_query(query), model, settings), (stored, answer))
+        self.dirty = True
@@ -1,228 +1,592 @@
 import os
-import faiss
+import json
+import time
+import argparse
 import numpy as np
-import subprocess
-import sys
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
 from config import *
+from embedder import get_embedder, embedder_info
+from reranker import get_reranker
+from ollama_client import get_client
+from ann_index import (
+    read_index,
+    check_dimension,
+    load_index_info,
+    set_search_params,
+    cosine_from_l2,
+    calibrate_similarity,
+)
+from chunk_catalogue import ChunkCatalogue
+from context_packer import pack_context, CHUNK_SEPARATOR
+from query_cache import QueryCache
+import metrics
+
+# Instructions sent as the system prompt. They are identical for every
+# question, so Ollama can reuse their evaluation from the previous request.
+SYSTEM_PROMPT = (
+    "You are a helpful assistant that answers questions based only on the provided documents.\n"
+    "If the answer is in the documents, provide it accurately.\n"
+    'If the answer is not in the documents, say "I don\'t have that information."'
+)
+
+
+def load_faiss_index(mmap=INDEX_MMAP, path=INDEXES_PATH):
+    """
+    Load the FAISS index and chunk mapping from file.
 
-
-def load_faiss_index():
-    """Load the FAISS index and chunk mapping from file."""
-    if not os.path.exists(INDEX_FILE):
+    With `mmap` (the default, see INDEX_MMAP) both are memory-mapped
+    read-only, so several serving processes share them in the page cache.
+    `path` is the index directory, for loading another collection's shard.
+    """
+    index_file = relocate(INDEX_FILE, path)
+    if not os.path.exists(index_file):
         raise FileNotFoundError(
-            f"FAISS index not found at {INDEX_FILE}. Please run setup_retriever.py first."
+            f"FAISS index not found at {index_file}. Please run setup_retriever.py first."
         )
 
-    # Load the index
-    index = faiss.read_index(INDEX_FILE)
+    # Load the index and apply the configured search-time parameters.
+    # faiss is imported on first use so the rest of the CLI starts without it.
+    index = read_index(index_file, mmap=mmap)
+    set_search_params(index, nprobe=DEFAULT_NPROBE, ef_search=DEFAULT_EF_SEARCH)
 
     # Load the chunk mapping
-    map_file = os.path.join(INDEXES_PATH, "chunk_map.txt")
-    if not os.path.exists(map_file):
+    chunk_map_file = relocate(CHUNK_MAP_FILE, path)
+    if not os.path.exists(chunk_map_file):
         raise FileNotFoundError(
-            f"Chunk mapping not found at {map_file}. Please run setup_retriever.py first."
+            f"Chunk mapping not found at {chunk_map_file}. Please run setup_retriever.py first."
         )
 
-    chunk_map = {}
-    with open(map_file) as f:
-        for line in f:
-            idx, name = line.strip().split("\t")
-            chunk_map[int(idx)] = name
+    # The catalogue holds the id -> chunk mapping, chunk text and keyword lookup
+    chunk_map = ChunkCatalogue(mmap_files=mmap, path=path)
+
+    # Vectors from another model or backend are not comparable with this one's
+    built_with = (load_index_info(relocate(INDEX_INFO_FILE, path)) or {}).get(
+        "embedder"
+    )
+    current = embedder_info()
+    if built_with and {key: built_with.get(key) for key in current} != current:
+        print(
+            f"[WARNING] The index was built with {built_with.get('model')} "
+            f"({built_with.get('backend')}) but queries use {current['model']} "
+            f"({current['backend']}). Re-run create_embeddings.py and setup_retriever.py."
+        )
 
     print("FAISS index and chunk mapping loaded.")
     return index, chunk_map
 
 
 def embed_query(query):
-    """Generate an embedding for the query using the embedding script."""
+    """Generate an embedding for the query with the resident embedder."""
     print("Generating embedding for query...")
-    embedding_file = os.path.join(BASE_DIR, "query_embedding.npy")
+    with metrics.span("embed_query"):
+        query_embedding = get_embedder().embed_query(query)
+    print("Query embedding generated.")
+    return query_embedding
+
+
+def top_n(scores, n):
+    """Return the positions of the n highest scores, best first."""
+    n = min(n, len(scores))
+    if n <= 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, n - 1)[:n]
+    return top[np.argsort(-scores[top], kind="stable")]
 
-    # Use the same Python interpreter that's running this script
-    python_exe = sys.executable
-    subprocess.run(
-        [python_exe, EMBEDDING_SCRIPT, "--query", query, "--output", embedding_file],
-        check=True,
+
+def score_candidates(index, chunk_map, query_embedding, query, k=8, hits=None):
+    """
+    Collect a query's candidates from vector, keyword and BM25 retrieval.
+
+    Candidates from every retriever are merged into one set of catalogue
+    rows, so a chunk found by several retrievers appears once. `hits` takes
+    this query's (distances, labels) from an earlier batched index.search,
+    in place of searching again.
+
+    Returns (rows, vector, keyword, bm25): the catalogue rows and each
+    retriever's score for them, NaN where it did not return the row. The
+    vector score is a calibrated cosine similarity (see
+    ann_index.calibrate_similarity), the keyword score ranks the top k
+    filename matches, and the BM25 score is the raw BM25 score.
+    """
+    search_vector = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+
+    # Vector search, scored by cosine similarity to the query
+    if hits is None:
+        check_dimension(index, search_vector)
+        with metrics.span("faiss_search"):
+            D, I = index.search(search_vector, k=k)
+        hits = D[0], I[0]
+    distances, labels = hits
+    vector_rows = chunk_map.rows_of(labels)
+    found = vector_rows >= 0
+    vector_rows = vector_rows[found]
+    vector_scores = calibrate_similarity(
+        cosine_from_l2(
+            distances[found],
+            np.linalg.norm(search_vector),
+            chunk_map.norms[vector_rows],
+        ),
+        chunk_map.similarity_baseline,
     )
 
-    # Load and return the embedding
-    if not os.path.exists(embedding_file):
-        raise FileNotFoundError(f"Query embedding file not found at {embedding_file}.")
-    query_embedding = np.load(embedding_file)
-    print("Query embedding generated.")
-    return query_embedding
+    # Chunks whose filename shares words with the query
+    with metrics.span("keyword_match"):
+        query_words = set(word.lower() for word in query.split())
+        keyword_rows, matched = chunk_map.keyword_matches(query_words)
+
+    # BM25 over chunk text
+    with metrics.span("bm25_search"):
+        if chunk_map.bm25 is not None:
+            bm25_ids, bm25_scores = chunk_map.bm25.search(query, k)
+            bm25_rows = chunk_map.rows_of(bm25_ids)
+        else:
+            bm25_rows, bm25_scores = np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    rows, inverse = np.unique(
+        np.concatenate([vector_rows, keyword_rows, bm25_rows]),
+        return_inverse=True,
+    )
+    vector_pos, keyword_pos, bm25_pos = np.split(
+        inverse, [len(vector_rows), len(vector_rows) + len(keyword_rows)]
+    )
+    vector = np.full(len(rows), np.nan)
+    vector[vector_pos] = vector_scores
 
+    # Filename matches are ranked by the share of their words in the query,
+    # ties broken by vector score; only the top k are ranked
+    keyword_ratio = matched / np.maximum(chunk_map.keyword_sizes[keyword_rows], 1)
+    keyword_scores = np.nan_to_num(vector[keyword_pos], nan=0.0) + keyword_ratio * 0.2
+    best = top_n(keyword_scores, k)
+    keyword = np.full(len(rows), np.nan)
+    keyword[keyword_pos[best]] = keyword_scores[best]
 
-def retrieve_chunk(
+    bm25 = np.full(len(rows), np.nan)
+    bm25[bm25_pos] = bm25_scores
+    return rows, vector, keyword, bm25
+
+
+def fuse_ranks(*score_lists):
+    """
+    Combine per-retriever scores with reciprocal rank fusion.
+
+    Each array scores the same candidates, NaN where a retriever did not
+    return one. Candidates get 1 / (RRF_K + rank) from every retriever that
+    ranked them, so only the order within each retriever matters.
+    """
+    fused = np.zeros(len(score_lists[0]))
+    for scores in score_lists:
+        positions = np.flatnonzero(~np.isnan(scores))
+        ranked = positions[top_n(scores[positions], len(positions))]
+        fused[ranked] += 1.0 / (RRF_K + np.arange(1, len(ranked) + 1))
+    return fused
+
+
+def candidate_relevance(vector, bm25):
+    """
+    Return the relevance of candidates, comparable across queries and indexes.
+
+    It is the larger of the calibrated cosine and the BM25 score mapped to a
+    fixed scale, which reaches 0.5 at BM25_RELEVANCE_HALF. Neither depends on
+    the other candidates, and filename matches alone count for nothing.
+    """
+    lexical = np.nan_to_num(bm25 / (bm25 + BM25_RELEVANCE_HALF), nan=0.0)
+    return np.maximum(np.nan_to_num(vector, nan=0.0), lexical)
+
+
+def select_relevant(fused, relevance, relevance_threshold):
+    """
+    Order candidates by fused score and drop those below relevance_threshold.
+
+    Keeps at least the best candidate. Returns their positions, best first.
+    """
+    ranked = np.flatnonzero(fused)
+    ranked = ranked[top_n(fused[ranked], len(ranked))]
+    relevant = ranked[relevance[ranked] >= relevance_threshold]
+    return relevant if len(relevant) else ranked[:1]
+
+
+def rank_chunks(
     index,
     chunk_map,
     query_embedding,
     query,
     k=8,
     relevance_threshold=0.15,
-    max_context_chars=20000,
+    hits=None,
 ):
-    """Search FAISS index and retrieve the most relevant chunks based on query."""
-    print(f"Searching FAISS index for relevant chunks...")
+    """
+    Rank chunks for a query by fusing vector, keyword and BM25 retrieval.
 
-    # Ensure query_embedding is a 2D array with shape (1, embedding_dim)
-    if len(query_embedding.shape) == 2 and query_embedding.shape[0] == 1:
-        search_vector = query_embedding
-    else:
-        search_vector = query_embedding.reshape(1, -1)
+    The candidates of score_candidates are ranked by reciprocal rank fusion
+    of the three retrievers (fuse_ranks). Chunks are then dropped by their
+    relevance, which unlike the fused score does not depend on the other
+    candidates (see candidate_relevance), so relevance_threshold means the
+    same for every query.
+
+    Returns arrays of chunk ids, relevance and fused scores, best first.
+    """
+    rows, vector, keyword, bm25 = score_candidates(
+        index, chunk_map, query_embedding, query, k, hits
+    )
+    with metrics.span("fuse"):
+        fused = fuse_ranks(vector, keyword, bm25)
+        relevance = candidate_relevance(vector, bm25)
+        relevant = select_relevant(fused, relevance, relevance_threshold)
+    return chunk_map.ids[rows[relevant]], relevance[relevant], fused[relevant]
 
-    # Search for top k results
-    D, I = index.search(search_vector, k=k)
 
-    # Convert distances to similarity scores
-    distances = D[0]
-    max_dist = np.max(np.abs(distances)) if len(distances) > 0 else 1.0
-    similarity_scores = 1.0 - (np.abs(distances) / max_dist)
-    results = list(zip(I[0], similarity_scores))
+def rerank_chunks(reranker, query, texts, relevance, k=8):
+    """
+    Reorder ranked chunks by cross-encoder score and keep the best few.
+
+    `texts` holds the text of the first RERANK_CANDIDATES ranked chunks and
+    `relevance` the relevance of all of them, best first. The texts are
+    scored against the query and the positions of the best RERANK_KEEP
+    returned, with their scores as relevance. If scoring would take longer
+    than RERANK_BUDGET_MS, the first k positions are returned instead, with
+    their relevance unchanged.
+    """
+    with metrics.span("cross_encoder"):
+        scores = reranker.score(query, texts, budget_s=RERANK_BUDGET_MS / 1000.0)
+    if scores is None:
+        metrics.inc("rag_rerank_fallbacks_total")
+        keep = np.arange(min(k, len(relevance)))
+        return keep, relevance[keep]
+    best = top_n(scores, RERANK_KEEP)
+    return best, scores[best]
 
-    # List all files and build file info
-    chunk_files = os.listdir(CHUNKED_DOCS_PATH)
-    file_info = []
-    query_words = set(word.lower() for word in query.split())
 
-    for file_name in chunk_files:
-        chunk_idx = None
-        file_base = os.path.splitext(file_name)[0]
+def assemble_context(chunk_map, ids, relevance, max_context_tokens=3000):
+    """
+    Join the text of ranked chunks, best first, within max_context_tokens.
 
-        if "_chunk_" in file_base:
-            try:
-                chunk_idx = int(file_base.split("_chunk_")[1])
-            except (IndexError, ValueError):
-                pass
-
-        file_words = set(
-            word.lower()
-            for word in file_base.split("_")
-            if word.lower() not in ["chunk"]
-        )
-        keyword_match_ratio = (
-            len(file_words.intersection(query_words)) / len(file_words)
-            if file_words
-            else 0
-        )
-        exact_match_bonus = (
-            0.3 if any(keyword in file_base.lower() for keyword in query_words) else 0
+    See context_packer.pack_context for how chunks are chosen: duplicates
+    are dropped and the budget goes to the most relevance per token.
+    """
+    with metrics.span("assemble_context"):
+        rows = chunk_map.rows_of(ids)
+        chosen = pack_context(
+            [chunk_map.row_text(int(row)) for row in rows],
+            chunk_map.token_counts[rows],
+            relevance,
+            max_context_tokens,
         )
+    return CHUNK_SEPARATOR.join(text for _, text, _ in chosen)
 
-        match_idx = -1
-        similarity = 0.0
-        for idx, score in results:
-            if chunk_idx == idx:
-                match_idx = idx
-                similarity = score
-                break
-
-        if match_idx == -1 and (keyword_match_ratio > 0 or exact_match_bonus > 0):
-            similarity = 0.5
-
-        relevance = similarity + (keyword_match_ratio * 0.2) + exact_match_bonus
-
-        if relevance > 0:
-            file_info.append(
-                {
-                    "file_name": file_name,
-                    "relevance": relevance,
-                    "faiss_idx": match_idx,
-                    "keyword_match": keyword_match_ratio,
-                }
-            )
 
-    for idx, score in results:
-        if idx in chunk_map:
-            file_name = chunk_map[idx]
-            relevance = score
-            file_info.append(
-                {
-                    "file_name": file_name,
-                    "relevance": relevance,
-                    "faiss_idx": idx,
-                    "keyword_match": 0,
-                }
-            )
+def retrieve_chunk(
+    index,
+    chunk_map,
+    query_embedding,
+    query,
+    k=8,
+    relevance_threshold=0.15,
+    max_context_tokens=3000,
+):
+    """
+    Search FAISS index and retrieve the most relevant chunks based on query.
 
-    file_info.sort(key=lambda x: x["relevance"], reverse=True)
+    With a reranker (RERANK_MODEL), RERANK_CANDIDATES chunks are retrieved
+    and the cross-encoder picks the best of them.
+    """
+    reranker = get_reranker()
+    ids, relevance, _ = rank_chunks(
+        index,
+        chunk_map,
+        query_embedding,
+        query,
+        max(k, RERANK_CANDIDATES) if reranker else k,
+        relevance_threshold,
+    )
+    if reranker:
+        texts = [chunk_map.text(int(idx)) for idx in ids[:RERANK_CANDIDATES]]
+        keep, relevance = rerank_chunks(reranker, query, texts, relevance, k)
+        ids = ids[keep]
+    return assemble_context(chunk_map, ids, relevance, max_context_tokens)
+
+
+def build_prompt(context, question):
+    """Return the per-question part of the prompt; SYSTEM_PROMPT comes before it."""
+    return (
+        f"Documents:\n{context}\n\n"
+        f"User question:\n{question}\n\n"
+        "Answer (be specific and direct):"
+    )
 
-    relevant_files = [f for f in file_info if f["relevance"] >= relevance_threshold]
 
-    if not relevant_files and file_info:
-        relevant_files = [file_info[0]]
+def generate_answer(model, context, question, on_token=None):
+    """
+    Send the query and context to the specified model over the Ollama API.
+
+    The instructions go in the unchanging SYSTEM_PROMPT with a fixed context
+    window, so Ollama keeps them evaluated between questions and only the
+    documents and question are processed for each answer. Tokens are passed
+    to `on_token` as they are generated. Returns the answer text and the
+    generation metrics (time to first token, prompt tokens evaluated,
+    tokens/sec).
+    """
+    if not context.strip():
+        return "No relevant content found to answer the question.", {}
+
+    with metrics.span("generate"):
+        text, stats = get_client().generate(
+            model,
+            build_prompt(context, question),
+            on_token=on_token,
+            options={"num_ctx": OLLAMA_NUM_CTX},
+            system=SYSTEM_PROMPT,
+        )
+    metrics.inc("rag_generated_tokens_total", stats.get("eval_count") or 0)
+    metrics.inc("rag_prompt_eval_tokens_total", stats.get("prompt_eval_count") or 0)
+    if stats.get("time_to_first_token_s") is not None:
+        metrics.observe(
+            "rag_time_to_first_token_seconds", stats["time_to_first_token_s"]
+        )
+    return text.strip(), stats
 
-    chunks_content = []
-    total_chars = 0
 
-    for file_info in relevant_files:
-        if total_chars >= max_context_chars:
-            break
+def query_model(model, context, question):
+    """Send the query and context to the specified model."""
+    return generate_answer(model, context, question)[0]
 
-        file_path = os.path.join(CHUNKED_DOCS_PATH, file_info["file_name"])
 
-        try:
-            with open(file_path, "r", encoding="utf-8") as file:
-                content = file.read()
+def read_batch_queries(path):
+    """
+    Read {"id", "query"} records from a JSONL file; ids default to the line number.
 
-                if total_chars + len(content) > max_context_chars:
-                    if not chunks_content:
-                        content = content[:max_context_chars]
-                    else:
-                        continue
+    Raises ValueError naming the line of the first record that is not a JSON
+    object with a non-empty string query and a string or integer id, so a
+    bad input file is rejected before any query is run.
+    """
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON: {e}") from None
+            if not isinstance(record, dict):
+                raise ValueError(f"{path}:{line_number}: expected a JSON object")
+            query = record.get("query")
+            if not isinstance(query, str) or not query.strip():
+                raise ValueError(
+                    f"{path}:{line_number}: 'query' must be a non-empty string"
+                )
+            record.setdefault("id", line_number)
+            if isinstance(record["id"], bool) or not isinstance(
+                record["id"], (str, int)
+            ):
+                raise ValueError(
+                    f"{path}:{line_number}: 'id' must be a string or an integer"
+                )
+            records.append(record)
+    return records
+
+
+def completed_ids(path):
+    """Return the ids of queries already answered without error in an output file."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Last line of an interrupted run
+            if "error" not in record:
+                done.add(record["id"])
+    return done
 
-                chunks_content.append(content)
-                total_chars += len(content)
+
+def retrieve_batch(
+    index,
+    chunk_map,
+    records,
+    pool,
+    k=DEFAULT_TOP_K,
+    relevance_threshold=DEFAULT_RELEVANCE_THRESHOLD,
+    max_context_tokens=DEFAULT_MAX_CONTEXT_TOKENS,
+):
+    """
+    Retrieve context for a batch of queries.
+
+    The queries are embedded in one batch and searched with a single
+    index.search call on the query matrix; ranking and context assembly then
+    run in `pool`. Returns (result record, context) pairs in input order,
+    with the embedding and search time shared evenly between the queries.
+    A query whose ranking fails gets an {"id", "query", "error"} record and
+    no context, so the rest of the batch still runs.
+    """
+    queries = [record["query"] for record in records]
+    start = time.perf_counter()
+    with metrics.span("embed_query"):
+        embeddings = np.asarray(get_embedder().embed_batch(queries), dtype=np.float32)
+    embedded = time.perf_counter()
+    check_dimension(index, embeddings)
+    reranker = get_reranker()
+    search_k = max(k, RERANK_CANDIDATES) if reranker else k
+    with metrics.span("faiss_search"):
+        D, I = index.search(embeddings, k=search_k)
+    searched = time.perf_counter()
+
+    def context_for(i):
+        try:
+            return retrieve(i) + (None,)
         except Exception as e:
-            continue
+            return None, None, None, str(e)
 
-    combined_content = "\n\n---\n\n".join(chunks_content)
-    return combined_content
+    def retrieve(i):
+        begin = time.perf_counter()
+        ids, relevance, _ = rank_chunks(
+            index,
+            chunk_map,
+            embeddings[i],
+            queries[i],
+            search_k,
+            relevance_threshold,
+            hits=(D[i], I[i]),
+        )
+        if reranker:
+            texts = [chunk_map.text(int(idx)) for idx in ids[:RERANK_CANDIDATES]]
+            keep, relevance = rerank_chunks(reranker, queries[i], texts, relevance, k)
+            ids = ids[keep]
+        context = assemble_context(chunk_map, ids, relevance, max_context_tokens)
+        return ids, context, time.perf_counter() - begin
+
+    results = []
+    for record, (ids, context, seconds, error) in zip(
+        records, pool.map(context_for, range(len(records)))
+    ):
+        if error is not None:
+            results.append(
+                ({"id": record["id"], "query": record["query"], "error": error}, None)
+            )
+            continue
+        result = {
+            "id": record["id"],
+            "query": record["query"],
+            "chunk_ids": [int(idx) for idx in ids],
+            "context_chars": len(context),
+            "timings": {
+                "embed_ms": round((embedded - start) * 1000.0 / len(records), 3),
+                "search_ms": round((searched - embedded) * 1000.0 / len(records), 3),
+                "retrieve_ms": round(seconds * 1000.0, 3),
+            },
+        }
+        results.append((result, context))
+    return results
+
+
+def answer_result(model, result, context):
+    """Generate the answer for a retrieved query and add it to its result record."""
+    start = time.perf_counter()
+    try:
+        answer, stats = generate_answer(model, context, result["query"])
+    except Exception as e:
+        result["error"] = str(e)
+        return result
+    result["answer"] = answer
+    result["model"] = model
+    result["timings"]["generate_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    if stats.get("time_to_first_token_s") is not None:
+        result["timings"]["first_token_ms"] = round(
+            stats["time_to_first_token_s"] * 1000.0, 3
+        )
+        result["tokens_per_sec"] = stats.get("tokens_per_sec")
+    if stats.get("prompt_eval_count") is not None:
+        result["prompt_eval_count"] = stats["prompt_eval_count"]
+        result["timings"]["prompt_eval_ms"] = round(stats["prompt_eval_s"] * 1000, 3)
+    return result
 
 
-def query_model(model, context, question):
-    """Send the query and context to the specified model."""
-    if not context.strip():
-        return "No relevant content found to answer the question."
-
-    prompt = f"""
-    You are a helpful assistant that answers questions based only on the provided documents.
-    If the answer is in the documents, provide it accurately.
-    If the answer is not in the documents, say "I don't have that information."
-    
-    Documents:
-    {context}
-    
-    User question:
-    {question}
-    
-    Answer (be specific and direct):
+def run_batch(
+    index,
+    chunk_map,
+    input_path,
+    output_path,
+    model=None,
+    batch_size=BATCH_QUERY_SIZE,
+    concurrency=BATCH_LLM_CONCURRENCY,
+    search_threads=BATCH_SEARCH_THREADS,
+):
+    """
+    Answer every query in a JSONL file.
+
+    Queries are retrieved `batch_size` at a time and up to `concurrency`
+    answers are generated at once while the next batch is retrieved. Each
+    result is appended to output_path as soon as it is ready, so a run that
+    is interrupted can be restarted with the same arguments: queries already
+    answered are skipped and failed ones are retried. With no model only
+    retrieval is run. Returns counts of answered, failed and skipped queries.
     """
-    result = subprocess.run(
-        ["ollama", "run", model], input=prompt, capture_output=True, encoding="utf-8"
+    records = read_batch_queries(input_path)
+    done = completed_ids(output_path)
+    todo = [record for record in records if record["id"] not in done]
+    counts = {"answered": 0, "failed": 0, "skipped": len(records) - len(todo)}
+    print(f"{counts['skipped']} of {len(records)} queries already answered")
+
+    # Finish a line cut short by an interrupted run before appending
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+    def write(out, result):
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+        counts["failed" if "error" in result else "answered"] += 1
+
+    start = time.perf_counter()
+    pending = set()
+    with open(output_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(
+        max_workers=search_threads
+    ) as searchers, ThreadPoolExecutor(max_workers=concurrency) as generators:
+        for begin in range(0, len(todo), batch_size):
+            batch = todo[begin : begin + batch_size]
+            for result, context in retrieve_batch(index, chunk_map, batch, searchers):
+                if model is None or "error" in result:
+                    write(out, result)
+                else:
+                    pending.add(
+                        generators.submit(answer_result, model, result, context)
+                    )
+
+            # Keep at most one batch of answers queued behind the generators
+            while pending:
+                finished, pending = wait(
+                    pending,
+                    timeout=None if len(pending) > batch_size else 0,
+                    return_when=FIRST_COMPLETED,
+                )
+                if not finished:
+                    break
+                for future in finished:
+                    write(out, future.result())
+            print(f"Processed {min(begin + batch_size, len(todo))}/{len(todo)} queries")
+
+        for future in as_completed(pending):
+            write(out, future.result())
+
+    elapsed = time.perf_counter() - start
+    rate = len(todo) / elapsed if elapsed > 0 else 0.0
+    print(
+        f"Answered {counts['answered']} queries, {counts['failed']} failed, "
+        f"{counts['skipped']} skipped ({rate:.1f} queries/sec)"
     )
-
-    if result.returncode != 0:
-        raise RuntimeError(f"Model query failed: {result.stderr}")
-
-    return result.stdout.strip()
+    return counts
 
 
 import json
-import subprocess
 from config import *
 
 
 def get_available_models():
     """Get list of available Ollama models."""
-    try:
-        result = subprocess.run(["ollama", "list"], capture_output=True, text=True)
-        if result.returncode != 0:
-            raise RuntimeError("Failed to get model list")
-        models = [line.split()[0] for line in result.stdout.strip().split("\n")[1:]]
-        return models
-    except FileNotFoundError:
-        raise RuntimeError("Ollama not found. Please install Ollama first.")
+    return get_client().list_models()
 
 
 def select_model():
@@ -231,7 +595,7 @@ def select_model():
 
     if not models:
         print("No models found. Installing default model...")
-        subprocess.run(["ollama", "pull", DEFAULT_MODEL], check=True)
+        get_client().pull(DEFAULT_MODEL)
         return DEFAULT_MODEL
 
     if len(models) == 1:
@@ -258,37 +622,146 @@ def select_model():
 
 # Update main to use model selection
 if __name__ == "__main__":
-    try:
-        model = select_model()
-        print(f"Using model: {model}")
+    parser = argparse.ArgumentParser(
+        description="Ask a question about the indexed documentation"
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="QUERIES_JSONL",
+        help='Answer every {"id": ..., "query": ...} line of a JSONL file',
+    )
+    parser.add_argument(
+        "--output",
+        help="JSONL file batch results are appended to (default: <batch>.results.jsonl)",
+    )
+    parser.add_argument("--model", help="Model for batch answers")
+    parser.add_argument(
+        "--retrieve-only",
+        action="store_true",
+        help="Only record the retrieved chunks of each batch query",
+    )
+    parser.add_argument("--batch-size", type=int, default=BATCH_QUERY_SIZE)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=BATCH_LLM_CONCURRENCY,
+        help="Number of batch answers generated at once",
+    )
+    parser.add_argument(
+        "--collections",
+        help="Comma-separated collections to search together, or 'all'",
+    )
+    args = parser.parse_args()
+    if args.batch and args.collections:
+        parser.error("--collections cannot be combined with --batch")
 
-        # Step 1: Load the FAISS index and chunk mapping
+    if args.batch:
         index, chunk_map = load_faiss_index()
+        try:
+            run_batch(
+                index,
+                chunk_map,
+                args.batch,
+                args.output or os.path.splitext(args.batch)[0] + ".results.jsonl",
+                model=None if args.retrieve_only else args.model or DEFAULT_MODEL,
+                batch_size=args.batch_size,
+                concurrency=args.concurrency,
+            )
+        except ValueError as e:
+            raise SystemExit(str(e))
+    else:
+        try:
+            model = select_model()
+            print(f"Using model: {model}")
+
+            # Step 1: Load the FAISS index and chunk mapping, or the index
+            # shards of the selected collections
+            searcher = None
+            if args.collections:
+                from collection_search import CollectionSearcher, COLLECTIONS_CACHE_FILE
+
+                names = None if args.collections == "all" else args.collections
+                searcher = CollectionSearcher(names and names.split(","))
+            else:
+                index, chunk_map = load_faiss_index()
+
+            # Step 2: Get the user's query
+            query = input("Enter your query: ")
+
+            # With RAG_METRICS=1, time each stage and append a trace to TRACE_FILE
+            with metrics.trace("query", model=model) as current:
+                # Cached embeddings, contexts and answers from earlier runs against
+                # the same index
+                cache = None
+                if QUERY_CACHE_ENABLED and searcher:
+                    cache = QueryCache(searcher.version, COLLECTIONS_CACHE_FILE)
+                elif QUERY_CACHE_ENABLED:
+                    cache = QueryCache()
+                settings = (
+                    DEFAULT_TOP_K,
+                    DEFAULT_RELEVANCE_THRESHOLD,
+                    DEFAULT_MAX_CONTEXT_TOKENS,
+                )
+
+                # Step 3: Embed the query
+                query_embedding = cache.get_embedding(query) if cache else None
+                if query_embedding is None:
+                    query_embedding = embed_query(query)
+                    if cache:
+                        cache.put_embedding(query, query_embedding)
+
+                # Step 4: Retrieve the most relevant chunks using config defaults
+                chunk_content = cache.get_context(query, settings) if cache else None
+                if chunk_content is None:
+                    if searcher:
+                        print(f"Searching {len(searcher.shards)} collections...")
+                        chunk_content = searcher.retrieve(
+                            query_embedding, query, *settings
+                        )
+                    else:
+                        print("Searching FAISS index for relevant chunks...")
+                        chunk_content = retrieve_chunk(
+                            index, chunk_map, query_embedding, query, *settings
+                        )
+                    if cache:
+                        cache.put_context(query, settings, chunk_content)
+
+                # Step 5: Query the model with the retrieved chunks and user's question,
+                # displaying the response as it streams in
+                print("Model Response:")
+                response = (
+                    cache.get_answer(query, model, settings, query_embedding)
+                    if cache
+                    else None
+                )
+                stats = {}
+                if response is not None:
+                    print(response)
+                    print("[INFO] Answer served from the query cache")
+                else:
+                    response, stats = generate_answer(
+                        model,
+                        chunk_content,
+                        query,
+                        on_token=lambda token: print(token, end="", flush=True),
+                    )  # Use selected model, not DEFAULT_MODEL
+                    if not stats:
+                        print(response, end="")
+                    print()
+                    if cache and stats:
+                        cache.put_answer(
+                            query, model, settings, response, query_embedding
+                        )
+                if cache:
+                    cache.save()
+            metrics.write_trace(current, TRACE_FILE)
+
+            # Step 6: Report generation speed
+            if stats.get("time_to_first_token_s") is not None:
+                print(
+                    f"[INFO] First token after {stats['time_to_first_token_s']:.2f}s, "
+                    f"{stats['tokens_per_sec']} tokens/sec"
+                )
 
-        # Step 2: Get the user's query
-        query = input("Enter your query: ")
-
-        # Step 3: Embed the query
-        query_embedding = embed_query(query)
-
-        # Step 4: Retrieve the most relevant chunks using config defaults
-        chunk_content = retrieve_chunk(
-            index,
-            chunk_map,
-            query_embedding,
-            query,
-            k=DEFAULT_TOP_K,
-            relevance_threshold=DEFAULT_RELEVANCE_THRESHOLD,
-            max_context_chars=DEFAULT_MAX_CONTEXT_CHARS,
-        )
-
-        # Step 5: Query the model with the retrieved chunks and user's question
-        response = query_model(
-            model, chunk_content, query
-        )  # Use selected model, not DEFAULT_MODEL
-
-        # Step 6: Display the model's response
-        print(f"Model Response:\n{response}")
-
-    except Exception as e:
-        print(f"An error occurred: {e}")
+        except Exception as e:
+            print(f"An error occurred: {e}")
@@ -0,0 +1,429 @@
+import json
+import math
+import time
+import asyncio
+import argparse
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    DEFAULT_MODEL,
+    DEFAULT_TOP_K,
+    DEFAULT_RELEVANCE_THRESHOLD,
+    DEFAULT_MAX_CONTEXT_TOKENS,
+    SERVER_HOST,
+    SERVER_PORT,
+    SERVER_EMBED_BATCH_SIZE,
+    SERVER_EMBED_WAIT_MS,
+    SERVER_SEARCH_THREADS,
+    SERVER_LLM_CONCURRENCY,
+    QUERY_CACHE_ENABLED,
+    QUERY_CACHE_SAVE_SECONDS,
+)
+from embedder import get_embedder
+from query_model import load_faiss_index, retrieve_chunk, generate_answer
+from query_cache import QueryCache
+from collection_search import CollectionSearcher, COLLECTIONS_CACHE_FILE
+import metrics
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    500: "Internal Server Error",
+}
+
+
+def request_number(request, field, default, kind=int, minimum=None):
+    """
+    Read a numeric field of a request, coerced to `kind` (int or float).
+
+    Raises ValueError with a message for the client if the value is not a
+    number of that kind or is below `minimum`.
+    """
+    value = request.get(field, default)
+    try:
+        if isinstance(value, bool):
+            raise TypeError
+        number = kind(value)
+        if not math.isfinite(number) or (kind is int and number != float(value)):
+            raise ValueError
+    except (TypeError, ValueError):
+        expected = "an integer" if kind is int else "a number"
+        raise ValueError(f"'{field}' must be {expected}, got {value!r}")
+    if minimum is not None and number < minimum:
+        raise ValueError(f"'{field}' must be at least {minimum}, got {number}")
+    return number
+
+
+class EmbeddingBatcher:
+    """
+    Collect concurrent query embeddings into batches.
+
+    Requests queue their text and await a future. A single loop takes up to
+    `batch_size` queued queries, waiting at most `wait_ms` for more to arrive,
+    and embeds them in one forward pass on a dedicated thread.
+    """
+
+    def __init__(self, embedder, batch_size, wait_ms):
+        self.embedder = embedder
+        self.batch_size = batch_size
+        self.wait = wait_ms / 1000.0
+        self.queue = asyncio.Queue()
+        # One thread: torch already parallelises a forward pass internally
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def embed(self, text):
+        """Return the (1, embedding_dim) embedding for one query."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = await loop.run_in_executor(
+                    self.executor, self.embedder.embed_batch, texts, len(texts)
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for row, (_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result(embeddings[row : row + 1])
+
+
+class QueryServer:
+    """
+    Long-running HTTP/JSON query server.
+
+    The FAISS index, chunk catalogue and embedder are loaded once and stay
+    resident. Query embeddings are batched across concurrent requests,
+    retrieval runs in a thread pool, and calls to the LLM backend are limited
+    by a semaphore so a burst of questions cannot overload Ollama.
+    """
+
+    def __init__(
+        self,
+        model=DEFAULT_MODEL,
+        embed_batch_size=SERVER_EMBED_BATCH_SIZE,
+        embed_wait_ms=SERVER_EMBED_WAIT_MS,
+        search_threads=SERVER_SEARCH_THREADS,
+        llm_concurrency=SERVER_LLM_CONCURRENCY,
+        collections=None,
+    ):
+        self.model = model
+        # With `collections` (a list of names, empty for all of them), queries
+        # fan out over those collections' shards instead of the single index
+        self.searcher = None
+        if collections is None:
+            self.index, self.chunk_map = load_faiss_index()
+            self.cache = QueryCache() if QUERY_CACHE_ENABLED else None
+        else:
+            self.searcher = CollectionSearcher(collections)
+            self.cache = (
+                QueryCache(self.searcher.version, COLLECTIONS_CACHE_FILE)
+                if QUERY_CACHE_ENABLED
+                else None
+            )
+        self.embedder = get_embedder()
+        self.embed_batch_size = embed_batch_size
+        self.embed_wait_ms = embed_wait_ms
+        self.search_pool = ThreadPoolExecutor(max_workers=search_threads)
+        self.llm_pool = ThreadPoolExecutor(max_workers=llm_concurrency)
+        self.llm_concurrency = llm_concurrency
+        self.started = time.time()
+        self.batcher = None
+        self.llm_slots = None
+
+    @staticmethod
+    def run_in(pool, func, *args):
+        """Run func in a thread pool, keeping the request's trace context."""
+        context = contextvars.copy_context()
+        return asyncio.get_running_loop().run_in_executor(
+            pool, context.run, func, *args
+        )
+
+    def parse_request(self, body):
+        """
+        Decode and validate a /retrieve or /query request body.
+
+        Retrieval settings are checked and coerced up front, with their
+        defaults filled in, so a bad value is answered with a 400 rather
+        than failing inside the handler. Raises ValueError with a message
+        for the client.
+        """
+        request = json.loads(body or b"{}")
+        if not isinstance(request, dict):
+            raise ValueError("Request body must be a JSON object with a 'query'")
+        if not isinstance(request.get("query"), str) or not request["query"].strip():
+            raise ValueError("'query' must be a non-empty string")
+        if not isinstance(request.get("model", self.model), str):
+            raise ValueError("'model' must be a string")
+        request["k"] = request_number(request, "k", DEFAULT_TOP_K, minimum=1)
+        request["relevance_threshold"] = request_number(
+            request, "relevance_threshold", DEFAULT_RELEVANCE_THRESHOLD, float
+        )
+        request["max_context_tokens"] = request_number(
+            request, "max_context_tokens", DEFAULT_MAX_CONTEXT_TOKENS, minimum=1
+        )
+
+        collections = request.get("collections") or []
+        if not isinstance(collections, list) or not all(
+            isinstance(name, str) for name in collections
+        ):
+            raise ValueError("'collections' must be a list of collection names")
+        if collections:
+            if not self.searcher:
+                raise ValueError("This server was not started with --collections")
+            unknown = [name for name in collections if name not in self.searcher.shards]
+            if unknown:
+                raise ValueError(f"Unknown collections: {', '.join(unknown)}")
+        return request
+
+    def retrieval_settings(self, request):
+        settings = (
+            request["k"],
+            request["relevance_threshold"],
+            request["max_context_tokens"],
+        )
+        if self.searcher:
+            # Collections to search, all loaded ones if none are given
+            settings += (tuple(request.get("collections") or ()),)
+        return settings
+
+    async def retrieve(self, request):
+        """Embed the query and assemble context for it, using the cache first."""
+        query = request["query"]
+        settings = self.retrieval_settings(request)
+        start = time.perf_counter()
+        query_embedding = self.cache.get_embedding(query) if self.cache else None
+        if query_embedding is None:
+            with metrics.span("embed_query"):
+                query_embedding = await self.batcher.embed(query)
+            if self.cache:
+                self.cache.put_embedding(query, query_embedding)
+        embedded = time.perf_counter()
+        context = self.cache.get_context(query, settings) if self.cache else None
+        if context is None:
+            if self.searcher:
+                search = (self.searcher.retrieve,)
+            else:
+                search = (retrieve_chunk, self.index, self.chunk_map)
+            context = await self.run_in(
+                self.search_pool, *search, query_embedding, query, *settings
+            )
+            if self.cache:
+                self.cache.put_context(query, settings, context)
+        timings = {
+            "embed_ms": round((embedded - start) * 1000, 3),
+            "retrieve_ms": round((time.perf_counter() - embedded) * 1000, 3),
+        }
+        return query_embedding, context, timings
+
+    async def handle_retrieve(self, request):
+        _, context, timings = await self.retrieve(request)
+        return {"context": context, "timings": timings}
+
+    async def handle_query(self, request):
+        query_embedding, context, timings = await self.retrieve(request)
+        query = request["query"]
+        model = request.get("model", self.model)
+        settings = self.retrieval_settings(request)
+        if self.cache:
+            answer = self.cache.get_answer(query, model, settings, query_embedding)
+            if answer is not None:
+                return {"answer": answer, "context": context, "cached": True}
+
+        start = time.perf_counter()
+        with metrics.span("llm_wait"):
+            await self.llm_slots.acquire()
+        try:
+            waited = time.perf_counter()
+            answer, stats = await self.run_in(
+                self.llm_pool, generate_answer, model, context, query
+            )
+        finally:
+            self.llm_slots.release()
+        timings["llm_wait_ms"] = round((waited - start) * 1000, 3)
+        if self.cache and stats:
+            self.cache.put_answer(query, model, settings, answer, query_embedding)
+        return {
+            "answer": answer,
+            "context": context,
+            "metrics": stats,
+            "timings": timings,
+        }
+
+    def handle_health(self):
+        if self.searcher:
+            shards = self.searcher.shards.values()
+        else:
+            shards = [(self.index, self.chunk_map)]
+        return {
+            "status": "ok",
+            "chunks": sum(len(chunk_map) for _, chunk_map in shards),
+            "vectors": sum(int(index.ntotal) for index, _ in shards),
+            "collections": list(self.searcher.shards) if self.searcher else None,
+            "model": self.model,
+            "uptime_s": round(time.time() - self.started, 1),
+            "cache_hits": self.cache.hits if self.cache else None,
+        }
+
+    async def dispatch(self, method, path, body):
+        """Route a request, returning (status, JSON payload or plain text)."""
+        if method == "GET" and path == "/health":
+            return 200, self.handle_health()
+        if method == "GET" and path == "/metrics":
+            return 200, metrics.render_prometheus()
+        handlers = {"/retrieve": self.handle_retrieve, "/query": self.handle_query}
+        if method != "POST" or path not in handlers:
+            return 404, {"error": f"No route for {method} {path}"}
+        try:
+            request = self.parse_request(body)
+        except ValueError as e:
+            metrics.inc("rag_requests_total", route=path, status=400)
+            return 400, {"error": str(e)}
+        try:
+            with metrics.trace(path.strip("/")) as current:
+                response = await handlers[path](request)
+            if current is not None:
+                response["trace"] = current.to_dict()
+            metrics.inc("rag_requests_total", route=path, status=200)
+            return 200, response
+        except Exception as e:
+            metrics.inc("rag_requests_total", route=path, status=500)
+            return 500, {"error": str(e)}
+
+    async def handle_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection until it closes."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, payload = await self.dispatch(method, path, body)
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                if isinstance(payload, str):
+                    content_type = "text/plain; version=0.0.4"
+                    data = payload.encode("utf-8")
+                else:
+                    content_type = "application/json"
+                    data = json.dumps(payload).encode("utf-8")
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                        f"Content-Type: {content_type}\r\n"
+                        f"Content-Length: {len(data)}\r\n"
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                        "\r\n"
+                    ).encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def save_cache_periodically(self, interval=QUERY_CACHE_SAVE_SECONDS):
+        """Write new cache entries to disk every `interval` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            if self.cache.dirty:
+                try:
+                    await asyncio.to_thread(self.cache.save)
+                except OSError as e:
+                    print(f"Could not save the query cache: {e}")
+
+    async def serve(self, host=SERVER_HOST, port=SERVER_PORT):
+        self.batcher = EmbeddingBatcher(
+            self.embedder, self.embed_batch_size, self.embed_wait_ms
+        )
+        self.llm_slots = asyncio.Semaphore(self.llm_concurrency)
+        tasks = [asyncio.create_task(self.batcher.run())]
+        if self.cache:
+            tasks.append(asyncio.create_task(self.save_cache_periodically()))
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Query server listening on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            if self.cache:
+                self.cache.save()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve RAG queries over HTTP")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--embed-batch-size", type=int, default=SERVER_EMBED_BATCH_SIZE)
+    parser.add_argument("--embed-wait-ms", type=float, default=SERVER_EMBED_WAIT_MS)
+    parser.add_argument("--search-threads", type=int, default=SERVER_SEARCH_THREADS)
+    parser.add_argument(
+        "--llm-concurrency",
+        type=int,
+        default=SERVER_LLM_CONCURRENCY,
+        help="Maximum number of generations in flight at once",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="Record stage timings, serve them at /metrics and trace each request",
+    )
+    parser.add_argument(
+        "--collections",
+        help="Comma-separated collections to serve together, or 'all'",
+    )
+    args = parser.parse_args()
+    if args.metrics:
+        metrics.enable()
+    collections = None
+    if args.collections:
+        collections = [] if args.collections == "all" else args.collections.split(",")
+
+    server = QueryServer(
+        model=args.model,
+        embed_batch_size=args.embed_batch_size,
+        embed_wait_ms=args.embed_wait_ms,
+        search_threads=args.search_threads,
+        llm_concurrency=args.llm_concurrency,
+        collections=collections,
+    )
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
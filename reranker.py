@@ -0,0 +1,115 @@
+import time
+import numpy as np
+from config import (
+    RERANK_MODEL,
+    RERANK_BATCH_SIZE,
+    RERANK_MAX_TOKENS,
+    EMBEDDING_THREADS,
+    STUB_MODEL,
+)
+
+# Process-wide reranker, created on first use by get_reranker()
+_reranker = None
+
+
+class StubReranker:
+    """
+    Word-overlap scorer with the interface of CrossEncoderReranker.
+
+    A chunk scores the share of the query's words it contains, so reranking
+    can be exercised offline. `delay` adds that many seconds per chunk, to
+    try the latency budget.
+    """
+
+    def __init__(self, delay=0.0):
+        self.model_name = STUB_MODEL
+        self.delay = delay
+
+    def score(self, query, texts, budget_s=None, batch_size=RERANK_BATCH_SIZE):
+        words = set(query.lower().split())
+        start = time.perf_counter()
+        scores = np.zeros(len(texts), dtype=np.float32)
+        for begin in range(0, len(texts), batch_size):
+            if budget_s is not None and time.perf_counter() - start > budget_s:
+                return None
+            for i in range(begin, min(begin + batch_size, len(texts))):
+                if self.delay:
+                    time.sleep(self.delay)
+                text_words = set(texts[i].lower().split())
+                scores[i] = len(words & text_words) / max(len(words), 1)
+        if budget_s is not None and time.perf_counter() - start > budget_s:
+            return None
+        return scores
+
+
+class CrossEncoderReranker:
+    """
+    Cross-encoder that scores (query, chunk) pairs, loaded once per process.
+
+    Unlike the embedding model, it reads the query and the chunk together,
+    so its scores separate relevant chunks much better than vector distance.
+    It costs a forward pass per chunk, so it only sees the top candidates of
+    the fused ranking. torch and transformers are imported on first use.
+    """
+
+    def __init__(self, model_name=RERANK_MODEL, num_threads=EMBEDDING_THREADS):
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+        torch.set_num_threads(num_threads)
+        self.model_name = model_name
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_name)
+        self.model.eval()
+
+    def _score_batch(self, query, texts):
+        import torch
+
+        inputs = self.tokenizer(
+            [query] * len(texts),
+            texts,
+            padding=True,
+            truncation="only_second",
+            max_length=RERANK_MAX_TOKENS,
+            return_tensors="pt",
+        )
+        with torch.inference_mode():
+            logits = self.model(**inputs).logits
+        # One relevance logit, or the "relevant" class of a two-class head
+        logits = logits[:, 0] if logits.shape[1] == 1 else logits[:, -1]
+        return torch.sigmoid(logits).numpy()
+
+    def score(self, query, texts, budget_s=None, batch_size=RERANK_BATCH_SIZE):
+        """
+        Score each text's relevance to the query between 0 and 1.
+
+        Texts are scored in batches of similar length. With `budget_s`,
+        scoring stops and returns None as soon as the next batch is expected
+        to finish after the budget, so the caller can fall back to the
+        order it already has.
+        """
+        scores = np.zeros(len(texts), dtype=np.float32)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        start = time.perf_counter()
+        batch_seconds = 0.0
+        for begin in range(0, len(order), batch_size):
+            elapsed = time.perf_counter() - start
+            if budget_s is not None and elapsed + batch_seconds > budget_s:
+                return None
+            batch = order[begin : begin + batch_size]
+            scores[batch] = self._score_batch(query, [texts[i] for i in batch])
+            batch_seconds = time.perf_counter() - start - elapsed
+        if budget_s is not None and time.perf_counter() - start > budget_s:
+            return None
+        return scores
+
+
+def get_reranker():
+    """Return the shared reranker, or None when RERANK_MODEL is not set."""
+    global _reranker
+    if _reranker is None and RERANK_MODEL:
+        if RERANK_MODEL == STUB_MODEL:
+            _reranker = StubReranker()
+        else:
+            _reranker = CrossEncoderReranker()
+    return _reranker
@@ -1,47 +1,406 @@
 import os
-import faiss
+import json
+import time
+import argparse
 import numpy as np
-from config import EMBEDDINGS_PATH, CHUNKED_DOCS_PATH, INDEXES_PATH, INDEX_FILE
+from config import (
+    CHUNKED_DOCS_PATH,
+    INDEXES_PATH,
+    INDEX_FILE,
+    CHUNK_MAP_FILE,
+    DEFAULT_INDEX_TYPE,
+    INDEX_TRAIN_SAMPLE,
+    IVF_NLIST,
+    PQ_M,
+    HNSW_M,
+    DEFAULT_NPROBE,
+    DEFAULT_EF_SEARCH,
+    COSINE_BASELINE_SAMPLE,
+    EMBEDDING_STORE_FILE,
+    CATALOGUE_TEXT_FILE,
+    CATALOGUE_ROWS_FILE,
+    CATALOGUE_LOOKUP_FILE,
+    CATALOGUE_NAMES_FILE,
+    CATALOGUE_KEYWORDS_FILE,
+    CATALOGUE_KEYWORD_TEXT_FILE,
+    CATALOGUE_KEYWORD_ROWS_FILE,
+    BM25_TERMS_FILE,
+    BM25_TERM_TEXT_FILE,
+    BM25_STATS_FILE,
+    BM25_POSTINGS_FILE,
+    BM25_IMPACTS_FILE,
+    ensure_directories,
+)
+from embedding_store import read_store, read_store_info
+from manifest import chunk_id
+from chunk_catalogue import build_catalogue, ChunkCatalogue
+from bm25 import build_bm25
+from ann_index import (
+    INDEX_TYPES,
+    REMOVABLE_INDEX_TYPES,
+    build_index,
+    read_index,
+    write_index,
+    cosine_baseline,
+    index_version,
+    set_search_params,
+    load_index_info,
+    save_index_info,
+    vector_bytes,
+)
 
+# Files load_faiss_index memory-maps when INDEX_MMAP is on, and the JSON
+# tables it always parses onto the heap
+MAPPED_FILES = [
+    CATALOGUE_TEXT_FILE,
+    CATALOGUE_ROWS_FILE,
+    CATALOGUE_LOOKUP_FILE,
+    CATALOGUE_NAMES_FILE,
+    CATALOGUE_KEYWORDS_FILE,
+    CATALOGUE_KEYWORD_TEXT_FILE,
+    CATALOGUE_KEYWORD_ROWS_FILE,
+    BM25_TERMS_FILE,
+    BM25_TERM_TEXT_FILE,
+    BM25_POSTINGS_FILE,
+    BM25_IMPACTS_FILE,
+]
+PARSED_FILES = [BM25_STATS_FILE]
 
-def setup_faiss_index():
+
+def load_chunk_ids():
+    """Read the ids of the indexed chunks from the chunk map saved next to the index."""
+    with open(CHUNK_MAP_FILE) as f:
+        return np.array([int(line.split("\t", 1)[0]) for line in f], dtype=np.int64)
+
+
+def same_embedder(built_with, store_info):
+    """Whether an index built from `built_with` vectors can take the store's."""
+    keys = ("model", "backend", "dim")
+    return all(
+        (built_with or {}).get(key) == (store_info or {}).get(key) for key in keys
+    )
+
+
+def load_existing_index(index_type, embedding_dim):
+    """
+    Return the saved index and its chunk ids if they can be updated in place.
+
+    Chunk ids depend only on the chunk name and content, so an index whose
+    vectors came from another embedder would keep them; (None, None) is
+    returned in that case to force a full rebuild.
+    """
+    info = load_index_info()
+    if (
+        info is None
+        or info["index_type"] != index_type
+        or info["dim"] != embedding_dim
+        or not os.path.exists(INDEX_FILE)
+        or not os.path.exists(CHUNK_MAP_FILE)
+    ):
+        return None, None
+    if not same_embedder(info.get("embedder"), read_store_info()):
+        print("The embeddings come from a different embedder; rebuilding the index")
+        return None, None
+    return read_index(INDEX_FILE), load_chunk_ids()
+
+
+def setup_faiss_index(
+    rebuild=False,
+    index_type=DEFAULT_INDEX_TYPE,
+    nlist=IVF_NLIST,
+    pq_m=PQ_M,
+    hnsw_m=HNSW_M,
+    train_sample=INDEX_TRAIN_SAMPLE,
+):
     """
     Set up and populate the FAISS index with document embeddings.
+
+    Embeddings are read from the memory-mapped embedding store and the index
+    dimension is taken from the store. Each chunk gets a stable id derived
+    from its name and content hash. If an index of the same type from an
+    earlier run exists, only vectors for removed or changed chunks are deleted
+    and only new ones are added; otherwise the index is trained on a sample
+    (for IVF types) and built in a single bulk call. Chunk ids and names
+    are kept in arrays and lists rather than a dict, and the catalogue of
+    the new index is returned as the chunk map.
     """
-    embedding_dim = (
-        768  # Adjust based on your embedding dimension (default BERT is 768)
-    )
     os.makedirs(INDEXES_PATH, exist_ok=True)
-    index = faiss.IndexFlatL2(embedding_dim)
-    chunk_map = {}  # Map to store index -> filename mapping
-
-    # First, sort files to ensure consistent indexing
-    files = sorted(os.listdir(EMBEDDINGS_PATH))
-    for idx, file in enumerate(files):
-        if file.endswith(".npy"):
-            # Derive corresponding chunk filename
-            chunk_name = file.replace(".npy", ".txt")
-            chunk_file = os.path.join(CHUNKED_DOCS_PATH, chunk_name)
-
-            if os.path.exists(chunk_file):
-                # Add embedding to FAISS index
-                embedding = np.load(os.path.join(EMBEDDINGS_PATH, file))
-                index.add(embedding)
-                chunk_map[idx] = chunk_name  # Store mapping
-                print(f"Added {chunk_name} at index {idx}")
+
+    names, hashes, embeddings = read_store()
+    embedding_dim = embeddings.shape[1]
+    if not len(names):
+        index_type = "flat"  # Nothing to train approximate indexes on
+
+    # Skip embeddings whose chunk file has since been removed
+    keep = np.array(
+        [os.path.exists(os.path.join(CHUNKED_DOCS_PATH, name)) for name in names],
+        dtype=bool,
+    )
+    if not keep.all():
+        embeddings = embeddings[keep]
+        names = [name for name, kept in zip(names, keep) if kept]
+        hashes = [digest for digest, kept in zip(hashes, keep) if kept]
+
+    ids = np.array(
+        [chunk_id(name, digest) for name, digest in zip(names, hashes)],
+        dtype=np.int64,
+    )
+
+    index, old_ids = (
+        (None, None) if rebuild else load_existing_index(index_type, embedding_dim)
+    )
+    if index is not None:
+        stale = np.setdiff1d(old_ids, ids)
+        if len(stale) and index_type not in REMOVABLE_INDEX_TYPES:
+            print(f"{index_type} indexes cannot remove vectors; rebuilding")
+            index = None
+
+    if index is None:
+        index, spec = build_index(
+            index_type, embeddings, train_sample, nlist, pq_m, hnsw_m
+        )
+        if len(ids):
+            index.add_with_ids(embeddings, ids)
+        print(f"Added {len(ids)} embeddings to a new {spec} index")
+    else:
+        if len(stale):
+            index.remove_ids(stale)
+        new = ~np.isin(ids, old_ids)
+        if new.any():
+            index.add_with_ids(embeddings[new], ids[new])
+        print(f"Removed {len(stale)} and added {int(new.sum())} embeddings")
 
     # Save both the FAISS index and the chunk mapping
-    faiss.write_index(index, INDEX_FILE)
+    write_index(index, INDEX_FILE)
+    store_info = read_store_info()
+    save_index_info(
+        {
+            "index_type": index_type,
+            "dim": int(embedding_dim),
+            "count": len(ids),
+            "version": index_version(ids, index_type, store_info),
+            "cosine_baseline": cosine_baseline(embeddings, COSINE_BASELINE_SAMPLE),
+            "embedder": store_info,
+        }
+    )
 
     # Save mapping next to the index
-    map_file = os.path.join(INDEXES_PATH, "chunk_map.txt")
-    with open(map_file, "w") as f:
-        for idx, name in chunk_map.items():
+    with open(CHUNK_MAP_FILE, "w") as f:
+        for idx, name in zip(ids.tolist(), names):
             f.write(f"{idx}\t{name}\n")
 
+    # Chunk text, keyword lookup, embedding norms and BM25 index for the
+    # query path, all in chunk map order
+    norms = np.sqrt(np.einsum("ij,ij->i", embeddings, embeddings, dtype=np.float32))
+    build_catalogue(ids, names, norms)
+    chunk_map = ChunkCatalogue(load_bm25=False)
+    build_bm25(chunk_map.texts())
+
     print(f"Indexed {len(chunk_map)} document chunks")
     return index, chunk_map
 
 
+def timed_search(index, queries, k):
+    """Search one query at a time, returning labels and per-query latencies."""
+    labels = np.empty((len(queries), k), dtype=np.int64)
+    latencies = []
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, labels[i] = index.search(query.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - start)
+    return labels, np.array(latencies) * 1000.0
+
+
+def recall_report(index, indexed_ids=None, k=10, num_queries=200, sweep=None):
+    """
+    Compare an approximate index against exact search on the same vectors.
+
+    Only the store's vectors whose ids are in `indexed_ids` (by default the
+    chunk map's) are used, so embeddings of chunks left out of the index
+    neither serve as queries nor count as missed results. Queries are
+    sampled from those vectors. For each nprobe / efSearch setting the
+    report gives recall@k (overlap with the exact top-k) and the p50/p99
+    single-query latency, alongside the flat baseline.
+    """
+    import faiss
+
+    names, hashes, embeddings = read_store()
+    ids = np.array(
+        [chunk_id(name, digest) for name, digest in zip(names, hashes)],
+        dtype=np.int64,
+    )
+    indexed = np.isin(
+        ids, load_chunk_ids() if indexed_ids is None else np.asarray(indexed_ids)
+    )
+    if not indexed.all():
+        ids, embeddings = ids[indexed], embeddings[indexed]
+    exact = faiss.IndexIDMap(faiss.IndexFlatL2(embeddings.shape[1]))
+    exact.add_with_ids(embeddings, ids)
+
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(ids), min(num_queries, len(ids)), replace=False)
+    queries = np.ascontiguousarray(embeddings[np.sort(rows)], dtype=np.float32)
+    k = min(k, len(ids))
+
+    truth, flat_ms = timed_search(exact, queries, k)
+    report = {
+        "k": k,
+        "queries": len(queries),
+        "flat": {
+            "p50_ms": round(float(np.percentile(flat_ms, 50)), 3),
+            "p99_ms": round(float(np.percentile(flat_ms, 99)), 3),
+        },
+        "settings": [],
+    }
+
+    info = load_index_info() or {}
+    index_type = info.get("index_type", "flat")
+    if sweep is None:
+        sweep = (
+            [1, 4, 16, 64, 256]
+            if index_type.startswith("ivf")
+            else [16, 32, 64, 128, 256]
+        )
+    tunable = index_type.startswith("ivf") or index_type == "hnsw"
+    for value in sweep if tunable else [None]:
+        if index_type.startswith("ivf"):
+            set_search_params(index, nprobe=value)
+        elif index_type == "hnsw":
+            set_search_params(index, ef_search=value)
+        found, ann_ms = timed_search(index, queries, k)
+        hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+        report["settings"].append(
+            {
+                "index_type": index_type,
+                "param": value,
+                "recall_at_k": round(hits / float(len(queries) * k), 4),
+                "p50_ms": round(float(np.percentile(ann_ms, 50)), 3),
+                "p99_ms": round(float(np.percentile(ann_ms, 99)), 3),
+            }
+        )
+
+    set_search_params(index, nprobe=DEFAULT_NPROBE, ef_search=DEFAULT_EF_SEARCH)
+    return report
+
+
+def file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def storage_report():
+    """
+    Break down the bytes used by the saved index, for capacity planning.
+
+    - vectors: the vector codes inside the FAISS index
+    - index: the rest of the index file (ids, IVF centroids and lists,
+      HNSW links)
+    - text: the chunk text blob of the catalogue
+    - metadata: the rest of the catalogue, the BM25 index and chunk map
+    - embedding_store: the vectors the index is built from, only read by
+      setup_retriever.py
+
+    Each part is also given per chunk and per million chunks. The query
+    process figures are what one load_faiss_index process holds: with
+    INDEX_MMAP, the index and binary metadata are shared through the page
+    cache and only the parsed JSON stats are on its heap (measured with
+    tracemalloc, since Python objects take several times their JSON size).
+    """
+    import tracemalloc
+
+    if not os.path.exists(INDEX_FILE):
+        raise FileNotFoundError(
+            f"FAISS index not found at {INDEX_FILE}. Please run setup_retriever.py first."
+        )
+    index = read_index(INDEX_FILE, mmap=True)
+    count = int(index.ntotal)
+    index_bytes = file_size(INDEX_FILE)
+    codes = vector_bytes(index)
+    codes = index_bytes if codes is None else min(codes, index_bytes)
+    parts = {
+        "vectors": codes,
+        "index": index_bytes - codes,
+        "text": file_size(CATALOGUE_TEXT_FILE),
+        "metadata": sum(file_size(path) for path in MAPPED_FILES + PARSED_FILES)
+        + file_size(CHUNK_MAP_FILE)
+        - file_size(CATALOGUE_TEXT_FILE),
+        "embedding_store": file_size(EMBEDDING_STORE_FILE),
+    }
+
+    tracemalloc.start()
+    tables = []
+    for path in PARSED_FILES:
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                tables.append(json.load(f))
+    parsed = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del tables
+
+    mapped = index_bytes + sum(file_size(path) for path in MAPPED_FILES)
+    info = load_index_info() or {}
+    return {
+        "chunks": count,
+        "dim": int(index.d),
+        "index_type": info.get("index_type"),
+        "store_dtype": (read_store_info() or {}).get("dtype", "float32"),
+        "bytes": parts,
+        "bytes_per_chunk": {
+            name: round(size / max(count, 1), 1) for name, size in parts.items()
+        },
+        "mb_per_million_chunks": {
+            name: round(size / max(count, 1) * 1e6 / 2**20, 1)
+            for name, size in parts.items()
+        },
+        "query_process": {
+            "mmap": {"shared_bytes": mapped, "heap_bytes": parsed},
+            "heap": {"shared_bytes": 0, "heap_bytes": mapped + parsed},
+        },
+    }
+
+
 if __name__ == "__main__":
-    index, chunk_map = setup_faiss_index()
+    parser = argparse.ArgumentParser(description="Build the FAISS retriever index")
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Rebuild the index from scratch instead of updating it in place",
+    )
+    parser.add_argument(
+        "--index-type",
+        choices=INDEX_TYPES,
+        default=DEFAULT_INDEX_TYPE,
+        help="Exact flat search (float32, or scalar-quantized fp16 / int8 vectors) "
+        "or an approximate IVF / IVF-PQ / HNSW index",
+    )
+    parser.add_argument("--nlist", type=int, default=IVF_NLIST)
+    parser.add_argument("--pq-m", type=int, default=PQ_M)
+    parser.add_argument("--hnsw-m", type=int, default=HNSW_M)
+    parser.add_argument("--train-sample", type=int, default=INDEX_TRAIN_SAMPLE)
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        help="Print recall@k and latency against exact search after building",
+    )
+    parser.add_argument("--report-k", type=int, default=10)
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print the bytes used by vectors, index structures and metadata of "
+        "the saved index, without building",
+    )
+    args = parser.parse_args()
+    ensure_directories()
+    if args.stats:
+        print(json.dumps(storage_report(), indent=2))
+    else:
+        index, chunk_map = setup_faiss_index(
+            rebuild=args.rebuild,
+            index_type=args.index_type,
+            nlist=args.nlist,
+            pq_m=args.pq_m,
+            hnsw_m=args.hnsw_m,
+            train_sample=args.train_sample,
+        )
+        if args.report and chunk_map:
+            report = recall_report(index, chunk_map.ids, k=args.report_k)
+            print(json.dumps(report, indent=2))
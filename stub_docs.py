@@ -0,0 +1,149 @@
+import time
+import hashlib
+import argparse
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_pages(count, size=4096):
+    """Generate `count` markdown pages of roughly `size` bytes each."""
+    pages = {}
+    for i in range(count):
+        line = f"Line of page {i} describing how to configure the server.\n"
+        body = f"# Page {i}\n\n" + line * max(1, size // len(line))
+        pages[f"page_{i:05d}.md"] = body.encode("utf-8")
+    return pages
+
+
+class StubDocsHandler(BaseHTTPRequestHandler):
+    """
+    Minimal documentation site for exercising fetch_docs.py.
+
+    Serves an index page linking every markdown page, and the pages with an
+    ETag and Last-Modified. Conditional requests for unchanged pages get a
+    304, and every response is counted so callers can see what a sync
+    actually transferred. For testing failures, a page named in `failures`
+    answers 503 that many times, and one in `truncated` is cut off after
+    half its body.
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # Headers and body go out in separate writes
+    pages = {}
+    modified = {}
+    failures = {}
+    truncated = set()
+    stats = None
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark and test output quiet
+
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.stats["lock"]:
+            self.stats[status] = self.stats.get(status, 0) + 1
+            self.stats["bytes"] += len(body)
+
+    def do_GET(self):
+        if self.path in ("/", "/docs", "/docs/"):
+            links = "".join(f'<a href="{name}">{name}</a>\n' for name in self.pages)
+            self._send(200, f"<html><body>{links}</body></html>".encode("utf-8"))
+            return
+
+        name = self.path.rsplit("/", 1)[-1]
+        body = self.pages.get(name)
+        if body is None:
+            self._send(404)
+            return
+        if self.failures.get(name):
+            self.failures[name] -= 1
+            self._send(503)
+            return
+        if name in self.truncated:
+            # Promise the whole body, send half and drop the connection
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[: len(body) // 2])
+            self.close_connection = True
+            return
+
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        last_modified = formatdate(self.modified[name], usegmt=True)
+        headers = {"ETag": etag, "Last-Modified": last_modified}
+        if self.not_modified(etag, self.modified[name]):
+            self._send(304, headers=headers)
+        else:
+            headers["Content-Type"] = "text/markdown; charset=utf-8"
+            self._send(200, body, headers)
+
+    def not_modified(self, etag, modified):
+        """Check a conditional request; If-None-Match wins over If-Modified-Since."""
+        if self.headers.get("If-None-Match") is not None:
+            return self.headers["If-None-Match"] == etag
+        since = self.headers.get("If-Modified-Since")
+        if since is None:
+            return False
+        try:
+            return int(modified) <= parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+
+def start_stub_server(pages, host="127.0.0.1", port=0):
+    """
+    Serve `pages` ({filename: bytes}) in a background thread.
+
+    Returns (server, docs_url). Assigning new bytes to `server.pages[name]`
+    changes a page; `server.stats` counts responses by status and bytes sent.
+    `server.failures` and `server.truncated` inject failures (see
+    StubDocsHandler), and `server.modified` holds each page's modification
+    time.
+    """
+    now = time.time()
+    stats = {"bytes": 0, "lock": threading.Lock()}
+    modified = {name: now for name in pages}
+    failures = {}
+    truncated = set()
+    handler = type(
+        "Handler",
+        (StubDocsHandler,),
+        {
+            "pages": pages,
+            "modified": modified,
+            "failures": failures,
+            "truncated": truncated,
+            "stats": stats,
+        },
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.pages, server.stats, server.modified = pages, stats, modified
+    server.failures, server.truncated = failures, truncated
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/docs/"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stub documentation site")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--page-size", type=int, default=4096)
+    args = parser.parse_args()
+
+    server, url = start_stub_server(
+        make_pages(args.pages, args.page_size), args.host, args.port
+    )
+    print(f"Stub docs site listing {args.pages} pages at {url}")
+    print(f"Fetch them with: python fetch_docs.py --url {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,152 @@
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_MODELS = ["stub:latest"]
+STUB_ANSWER = "This is a stub answer generated without a language model."
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    """
+    Minimal stand-in for the Ollama HTTP API.
+
+    Serves /api/tags, /api/pull and a streaming /api/generate that returns a
+    canned answer word by word, so the client can be exercised and benchmarked
+    without a model. Responses use HTTP/1.1 keep-alive like the real server.
+    Like Ollama, it remembers the last prompt (system prompt first) and only
+    counts the words after the prefix it shares with the previous one as
+    evaluated, taking `prompt_delay` seconds for each.
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # Stream each token as soon as it is written
+    token_delay = 0.0
+    prompt_delay = 0.0
+    cache = None  # {"words": [...], "lock": Lock}, shared by all requests
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark and test output quiet
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, payload):
+        data = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": name} for name in STUB_MODELS]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        request = self._read_json()
+        if self.path == "/api/pull":
+            self._send_json({"status": "success"})
+        elif self.path == "/api/generate":
+            self._stream_generate(request)
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def _evaluate_prompt(self, request):
+        """Return how many prompt words were not covered by the cached prefix."""
+        words = (request.get("system", "") + "\n" + request.get("prompt", "")).split()
+        with self.cache["lock"]:
+            cached = self.cache["words"]
+            shared = 0
+            for old, new in zip(cached, words):
+                if old != new:
+                    break
+                shared += 1
+            self.cache["words"] = words
+        evaluated = len(words) - shared
+        if self.prompt_delay:
+            time.sleep(self.prompt_delay * evaluated)
+        return evaluated
+
+    def _stream_generate(self, request):
+        start = time.perf_counter()
+        evaluated = self._evaluate_prompt(request)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        words = STUB_ANSWER.split(" ")
+        eval_start = time.perf_counter()
+        for i, word in enumerate(words):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            token = word if i == 0 else " " + word
+            self._write_chunk(
+                {"model": request.get("model"), "response": token, "done": False}
+            )
+        now = time.perf_counter()
+        self._write_chunk(
+            {
+                "model": request.get("model"),
+                "response": "",
+                "done": True,
+                "prompt_eval_count": evaluated,
+                "prompt_eval_duration": int((eval_start - start) * 1e9),
+                "eval_count": len(words),
+                "eval_duration": int((now - eval_start) * 1e9),
+            }
+        )
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def start_stub_server(host="127.0.0.1", port=0, token_delay=0.0, prompt_delay=0.0):
+    """Start the stub server in a background thread; returns (server, base_url)."""
+    handler = type(
+        "Handler",
+        (StubOllamaHandler,),
+        {
+            "token_delay": token_delay,
+            "prompt_delay": prompt_delay,
+            "cache": {"words": [], "lock": threading.Lock()},
+        },
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stub Ollama API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument(
+        "--token-delay", type=float, default=0.0, help="Seconds between tokens"
+    )
+    parser.add_argument(
+        "--prompt-delay",
+        type=float,
+        default=0.0,
+        help="Seconds to evaluate each uncached prompt word",
+    )
+    args = parser.parse_args()
+
+    server, url = start_stub_server(
+        args.host, args.port, args.token_delay, args.prompt_delay
+    )
+    print(f"Stub Ollama API listening on {url} (set OLLAMA_HOST={url} to use it)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
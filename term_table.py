@@ -0,0 +1,97 @@
+import hashlib
+import numpy as np
+from manifest import save_array
+
+
+def pack_strings(strings):
+    """
+    Concatenate strings into one UTF-8 blob.
+
+    Returns the blob as a uint8 array and the n + 1 offsets delimiting each
+    string, so string i is blob[offsets[i] : offsets[i + 1]].
+    """
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def unpack_string(blob, start, end):
+    """Decode one string from a blob written by pack_strings."""
+    return bytes(blob[start:end]).decode("utf-8")
+
+
+def term_hashes(terms):
+    """Hash terms to the 64-bit keys a term table is sorted by."""
+    digests = b"".join(
+        hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest() for term in terms
+    )
+    return np.frombuffer(digests, dtype="<i8").astype(np.int64)
+
+
+def save_term_table(table_file, text_file, terms, starts, counts):
+    """
+    Write a term -> (postings start, postings count) table.
+
+    Terms are sorted by hash and stored as one blob plus offsets, next to
+    their postings ranges, in a single (5, n) array: hashes, term start and
+    end in the blob, postings start and count. Each row is contiguous, so
+    lookups binary-search the memory-mapped hashes without reading the rest.
+    """
+    hashes = term_hashes(terms)
+    order = np.argsort(hashes, kind="stable")
+    blob, offsets = pack_strings([terms[i] for i in order])
+    table = np.stack(
+        [
+            hashes[order],
+            offsets[:-1],
+            offsets[1:],
+            np.asarray(starts, dtype=np.int64)[order],
+            np.asarray(counts, dtype=np.int64)[order],
+        ]
+    )
+    save_array(text_file, blob)
+    save_array(table_file, table)
+
+
+class TermTable:
+    """
+    Read-only term table written by save_term_table.
+
+    With `mmap_files` both arrays are memory-mapped, so looking up a term
+    touches a few pages of the hashes instead of parsing the vocabulary
+    onto the heap.
+    """
+
+    def __init__(self, table_file, text_file, mmap_files=True):
+        mmap_mode = "r" if mmap_files else None
+        (
+            self.hashes,
+            self._term_starts,
+            self._term_ends,
+            self.starts,
+            self.counts,
+        ) = np.load(table_file, mmap_mode=mmap_mode)
+        self._text = np.load(text_file, mmap_mode=mmap_mode)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def term(self, row):
+        """Return the term in a table row."""
+        return unpack_string(self._text, self._term_starts[row], self._term_ends[row])
+
+    def lookup(self, terms):
+        """Return the table rows of those of `terms` that are in the table."""
+        terms = list(terms)
+        hashes = term_hashes(terms)
+        positions = np.searchsorted(self.hashes, hashes)
+        rows = []
+        for term, key, row in zip(terms, hashes, positions):
+            # Compare the text too, in case two terms share a hash
+            while row < len(self.hashes) and self.hashes[row] == key:
+                if self.term(row) == term:
+                    rows.append(row)
+                    break
+                row += 1
+        return np.array(rows, dtype=np.int64)
@@ -0,0 +1,63 @@
+import re
+import nltk.tokenize
+import chunk_docs
+from embedder import StubTokenizer
+from chunk_docs import locate_pieces, split_block
+
+
+def normalising_sent_tokenize(text):
+    """
+    Split sentences at full stops, normalising them as NLTK's tokenizers can.
+
+    Whitespace is collapsed and straight double quotes become `` and ''.
+    """
+    sentences = []
+    for sentence in re.split(r"(?<=\.)\s+", text):
+        sentence = " ".join(sentence.split())
+        if sentence.count('"') == 2:
+            sentence = sentence.replace('"', "``", 1).replace('"', "''", 1)
+        sentences.append(sentence)
+    return sentences
+
+
+def test_pieces_with_normalised_whitespace_keep_their_offsets():
+    text = "First  sentence here.\nSecond\tsentence   here. Third one."
+    located = locate_pieces(
+        text,
+        ["First sentence here.", "Second sentence here.", "Third one."],
+        100,
+    )
+    assert located == [
+        ("First  sentence here.", 100),
+        ("Second\tsentence   here.", 122),
+        ("Third one.", 146),
+    ]
+    for piece, offset in located:
+        assert text[offset - 100 :].startswith(piece)
+
+
+def test_unmatched_pieces_do_not_restart_from_the_top(capsys):
+    text = 'One two three. He said "stop" there. Four five six.'
+    located = locate_pieces(
+        text, ["One two three.", "He said ``stop'' there.", "Four five six."], 0
+    )
+    offsets = [offset for _, offset in located]
+    assert offsets == sorted(offsets)
+    assert located[0] == ("One two three.", 0)
+    assert located[2] == ("Four five six.", text.index("Four"))
+    assert "not found" in capsys.readouterr().out
+
+
+def test_split_block_offsets_point_at_the_document_text(monkeypatch):
+    monkeypatch.setattr(chunk_docs, "_tokenizer", StubTokenizer())
+    monkeypatch.setattr(nltk.tokenize, "sent_tokenize", normalising_sent_tokenize)
+    text = (
+        "Alpha beta  gamma delta.\nEpsilon zeta eta theta. "
+        'Then "quoted words" appear here. Iota kappa lambda mu.'
+    )
+    units = split_block("text", text, 50, max_tokens=6)
+    starts = [start for _, start, _ in units]
+    assert starts == sorted(starts)
+    # Sentences whose whitespace was collapsed map back to the document text
+    assert units[0] == ("Alpha beta  gamma delta.", 50, 5)
+    assert units[-1][:2] == ("Iota kappa lambda mu.", 50 + text.index("Iota"))
@@ -0,0 +1,96 @@
+import os
+import pytest
+import requests
+from fetch_docs import create_session, download_file, fetch_docs
+from stub_docs import make_pages, start_stub_server
+
+
+@pytest.fixture
+def site():
+    server, url = start_stub_server(make_pages(20, size=1024))
+    yield server, url
+    server.shutdown()
+    server.server_close()
+
+
+def page_url(url, name):
+    return url + name
+
+
+def test_second_download_is_not_modified_by_etag(site, tmp_path):
+    server, url = site
+    save_path = str(tmp_path / "page_00000.md")
+    with create_session(backoff=0) as session:
+        changed, entry, written = download_file(
+            page_url(url, "page_00000.md"), save_path, session
+        )
+        assert changed and written == len(server.pages["page_00000.md"])
+        assert entry["etag"]
+
+        changed, cached, written = download_file(
+            page_url(url, "page_00000.md"), save_path, session, entry
+        )
+    assert not changed and written == 0 and cached == entry
+    assert server.stats[304] == 1
+
+
+def test_second_download_is_not_modified_by_last_modified(site, tmp_path):
+    server, url = site
+    save_path = str(tmp_path / "page_00001.md")
+    with create_session(backoff=0) as session:
+        _, entry, _ = download_file(page_url(url, "page_00001.md"), save_path, session)
+        entry = dict(entry, etag=None)  # Only If-Modified-Since is sent
+        changed, _, _ = download_file(
+            page_url(url, "page_00001.md"), save_path, session, entry
+        )
+        assert not changed
+
+        # A newer page is downloaded again
+        server.pages["page_00001.md"] += b"Updated.\n"
+        server.modified["page_00001.md"] += 10
+        changed, _, _ = download_file(
+            page_url(url, "page_00001.md"), save_path, session, entry
+        )
+    assert changed
+    assert open(save_path, "rb").read() == server.pages["page_00001.md"]
+
+
+def test_server_error_is_retried(site, tmp_path):
+    server, url = site
+    server.failures["page_00002.md"] = 2
+    save_path = str(tmp_path / "page_00002.md")
+    with create_session(retries=3, backoff=0) as session:
+        changed, _, _ = download_file(
+            page_url(url, "page_00002.md"), save_path, session
+        )
+    assert changed
+    assert server.stats[503] == 2
+    assert open(save_path, "rb").read() == server.pages["page_00002.md"]
+
+
+def test_failed_download_leaves_no_partial_file(site, tmp_path):
+    server, url = site
+    server.truncated.add("page_00003.md")
+    save_path = str(tmp_path / "page_00003.md")
+    with create_session(retries=0, backoff=0) as session:
+        with pytest.raises(requests.exceptions.RequestException):
+            download_file(page_url(url, "page_00003.md"), save_path, session)
+    assert os.listdir(tmp_path) == []
+
+
+def test_fetch_docs_downloads_every_page_concurrently(site, tmp_path):
+    server, url = site
+    raw_dir = str(tmp_path / "Raw")
+    manifest_path = str(tmp_path / "fetch_manifest.json")
+
+    stats = fetch_docs(url, workers=8, raw_dir=raw_dir, manifest_path=manifest_path)
+    assert stats["downloaded"] == len(server.pages) and stats["failed"] == 0
+    assert sorted(os.listdir(raw_dir)) == sorted(server.pages)
+    for name, body in server.pages.items():
+        assert open(os.path.join(raw_dir, name), "rb").read() == body
+
+    # A second sync only transfers the changed page
+    server.pages["page_00004.md"] += b"Updated.\n"
+    stats = fetch_docs(url, workers=8, raw_dir=raw_dir, manifest_path=manifest_path)
+    assert stats["downloaded"] == 1
+    assert stats["unchanged"] == len(server.pages) - 1
@@ -0,0 +1,62 @@
+import os
+import sys
+import subprocess
+from normalize_docs import normalize_markdown, output_name
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_markup_is_stripped_and_placeholders_kept():
+    text = (
+        "# Run [![CI](https://ci.example/badge.svg)](https://ci.example)\n"
+        "\n"
+        "Start <b>ollama</b> with `ollama run <model>`, then serve on "
+        "<host>:<port>.<br>See the [API docs](api.md).\n"
+        "<!-- hidden -->\n"
+        "\n"
+        "```\n"
+        "<b>kept in code</b>\n"
+        "```\n"
+    )
+    assert normalize_markdown(text) == (
+        "# Run\n"
+        "\n"
+        "Start ollama with `ollama run <model>`, then serve on "
+        "<host>:<port>. See the API docs.\n"
+        "\n"
+        "```\n"
+        "<b>kept in code</b>\n"
+        "```\n"
+    )
+
+
+def test_html_and_markdown_pages_get_distinct_names():
+    assert output_name("foo.md") == "foo.md"
+    assert output_name("foo.html") == "foo_html.md"
+    assert output_name("foo.HTM") == "foo_htm.md"
+
+
+def test_same_named_html_and_markdown_are_both_kept(tmp_path):
+    raw_dir = tmp_path / "Docs" / "Raw"
+    raw_dir.mkdir(parents=True)
+    (raw_dir / "foo.md").write_text("# Markdown page\n\nFrom markdown.\n")
+    (raw_dir / "foo.html").write_text(
+        "<html><body><h1>HTML page</h1><p>From HTML.</p></body></html>"
+    )
+    env = dict(os.environ, RAG_DIR=str(tmp_path))
+    env.pop("RAG_COLLECTION", None)
+    subprocess.run(
+        [sys.executable, "normalize_docs.py", "--workers", "2"],
+        cwd=REPO_DIR,
+        env=env,
+        check=True,
+        capture_output=True,
+    )
+
+    normalized_dir = tmp_path / "Docs" / "Normalized"
+    assert (normalized_dir / "foo.md").read_text() == (
+        "# Markdown page\n\nFrom markdown.\n"
+    )
+    assert (normalized_dir / "foo_html.md").read_text() == (
+        "# HTML page\n\nFrom HTML.\n"
+    )
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import query_cache
+from query_cache import LRUCache, QueryCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(query_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(max_entries=2, ttl=None)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c"), len(cache)) == (1, 3, 2)
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = LRUCache(max_entries=10, ttl=60)
+    cache.put("a", 1)
+    clock[0] += 30
+    cache.put("b", 2)
+    clock[0] += 31
+    assert [key for key, _ in cache.values()] == ["b"]
+    assert cache.get("a") is None and cache.get("b") == 2
+    assert len(cache) == 1  # The expired entry was dropped on lookup
+
+
+def saved_cache(path, version="v1"):
+    cache = QueryCache(version=version, path=str(path))
+    cache.put_embedding("How do I  change the PORT?", np.ones(4))
+    cache.put_context("how do i change the port?", ("k", 8), "context")
+    cache.save()
+    return cache
+
+
+def test_saved_entries_are_restored_for_the_same_index(tmp_path):
+    saved_cache(tmp_path / "cache.pkl")
+    cache = QueryCache(version="v1", path=str(tmp_path / "cache.pkl"))
+    assert cache.get_embedding("how do i change the port?") is not None
+    assert cache.get_context("How do I change the port?", ("k", 8)) == "context"
+
+
+def test_cache_is_discarded_when_the_index_changes(tmp_path):
+    saved_cache(tmp_path / "cache.pkl")
+    cache = QueryCache(version="v2", path=str(tmp_path / "cache.pkl"))
+    assert len(cache.embeddings) == len(cache.contexts) == 0
+
+
+def test_cache_is_discarded_when_the_reranker_changes(tmp_path, monkeypatch):
+    saved_cache(tmp_path / "cache.pkl")
+    monkeypatch.setattr(query_cache, "RERANK_MODEL", "cross-encoder/other")
+    cache = QueryCache(version="v1", path=str(tmp_path / "cache.pkl"))
+    assert len(cache.embeddings) == len(cache.contexts) == 0
+
+
+def test_cache_is_discarded_when_the_embedder_changes(tmp_path, monkeypatch):
+    saved_cache(tmp_path / "cache.pkl")
+    monkeypatch.setattr(
+        query_cache, "embedder_info", lambda: {"model": "other", "backend": "torch"}
+    )
+    cache = QueryCache(version="v1", path=str(tmp_path / "cache.pkl"))
+    assert len(cache.embeddings) == len(cache.contexts) == 0
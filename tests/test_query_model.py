@@ -0,0 +1,167 @@
+import json
+import types
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+import query_model
+from query_model import read_batch_queries, completed_ids, retrieve_batch
+
+
+def write_lines(path, lines):
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(path)
+
+
+def test_batch_ids_default_to_the_line_number(tmp_path):
+    path = write_lines(
+        tmp_path / "queries.jsonl",
+        [json.dumps({"query": "first"}), "", json.dumps({"id": "b", "query": "q"})],
+    )
+    assert [record["id"] for record in read_batch_queries(path)] == [1, "b"]
+
+
+@pytest.mark.parametrize(
+    "line, message",
+    [
+        ("{not json", "invalid JSON"),
+        ("[1, 2]", "expected a JSON object"),
+        (json.dumps({"id": 1}), "'query' must be a non-empty string"),
+        (json.dumps({"query": 5}), "'query' must be a non-empty string"),
+        (json.dumps({"query": "  "}), "'query' must be a non-empty string"),
+        (json.dumps({"id": [1], "query": "q"}), "'id' must be a string"),
+    ],
+)
+def test_bad_batch_records_are_rejected_with_their_line(tmp_path, line, message):
+    path = write_lines(tmp_path / "queries.jsonl", [json.dumps({"query": "q"}), line])
+    with pytest.raises(ValueError, match=f":2: {message}"):
+        read_batch_queries(path)
+
+
+def test_a_failing_query_is_recorded_and_retried(tmp_path, monkeypatch):
+    embedder = types.SimpleNamespace(
+        embed_batch=lambda queries: np.ones((len(queries), 4), dtype=np.float32)
+    )
+    index = types.SimpleNamespace(
+        d=4,
+        search=lambda x, k: (np.zeros((len(x), k)), np.zeros((len(x), k), "int64")),
+    )
+
+    def rank_chunks(index, chunk_map, embedding, query, *args, **kwargs):
+        if query == "boom":
+            raise RuntimeError("ranking failed")
+        return np.array([7]), np.array([1.0]), None
+
+    monkeypatch.setattr(query_model, "get_embedder", lambda: embedder)
+    monkeypatch.setattr(query_model, "get_reranker", lambda: None)
+    monkeypatch.setattr(query_model, "rank_chunks", rank_chunks)
+    monkeypatch.setattr(query_model, "assemble_context", lambda *args: "context")
+
+    records = [{"id": 1, "query": "fine"}, {"id": 2, "query": "boom"}]
+    with ThreadPoolExecutor(2) as pool:
+        results = retrieve_batch(index, None, records, pool)
+    assert results[0][0]["chunk_ids"] == [7] and results[0][1] == "context"
+    assert results[1] == (
+        {"id": 2, "query": "boom", "error": "ranking failed"},
+        None,
+    )
+
+    output = write_lines(
+        tmp_path / "results.jsonl", [json.dumps(result) for result, _ in results]
+    )
+    assert completed_ids(output) == {1}
+
+
+def fake_catalogue(vectors, filename_hits=(), bm25_hits=(), baseline=0.0):
+    """Catalogue of chunks with ids 100, 101, ... and the given embeddings."""
+    ids = np.arange(100, 100 + len(vectors), dtype=np.int64)
+    bm25_ids = np.array([ids[row] for row, _ in bm25_hits], dtype=np.int64)
+    return types.SimpleNamespace(
+        ids=ids,
+        norms=np.linalg.norm(vectors, axis=1).astype(np.float32),
+        similarity_baseline=baseline,
+        keyword_sizes=np.full(len(vectors), 2),
+        rows_of=lambda labels: np.searchsorted(ids, labels),
+        keyword_matches=lambda words: (
+            np.array([row for row, _ in filename_hits], dtype=np.int64),
+            np.array([count for _, count in filename_hits], dtype=np.int64),
+        ),
+        bm25=types.SimpleNamespace(
+            search=lambda query, k: (
+                bm25_ids,
+                np.array([score for _, score in bm25_hits], dtype=np.float32),
+            )
+        ),
+    )
+
+
+def vector_hits(query, vectors, ids):
+    """(distances, labels) as FAISS returns them: squared L2, nearest first."""
+    distances = ((vectors - query) ** 2).sum(axis=1)
+    order = np.argsort(distances)
+    return distances[order], ids[order]
+
+
+def test_candidates_found_by_several_retrievers_appear_once():
+    vectors = np.eye(4, dtype=np.float32)
+    chunk_map = fake_catalogue(
+        vectors, filename_hits=[(1, 1), (2, 2)], bm25_hits=[(1, 12.0), (3, 3.0)]
+    )
+    query = np.array([0.0, 1.0, 0.2, 0.0], dtype=np.float32)
+    hits = vector_hits(query, vectors[:2], chunk_map.ids[:2])
+
+    rows, vector, keyword, bm25 = query_model.score_candidates(
+        None, chunk_map, query, "q", k=4, hits=hits
+    )
+    assert rows.tolist() == [0, 1, 2, 3]
+    assert np.isnan(vector[2:]).all() and not np.isnan(vector[:2]).any()
+    assert np.isnan(keyword[[0, 3]]).all() and not np.isnan(keyword[[1, 2]]).any()
+    assert np.isnan(bm25[[0, 2]]).all() and bm25[[1, 3]].tolist() == [12.0, 3.0]
+
+
+def test_vector_scores_are_calibrated_cosines_from_l2_distances():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(5, 8)).astype(np.float32) * [[1], [2], [3], [4], [5]]
+    query = rng.normal(size=8).astype(np.float32) * 3
+    chunk_map = fake_catalogue(vectors, baseline=0.1)
+    hits = vector_hits(query, vectors, chunk_map.ids)
+
+    rows, vector, _, _ = query_model.score_candidates(
+        None, chunk_map, query, "q", k=5, hits=hits
+    )
+    cosine = vectors[rows] @ query
+    cosine /= np.linalg.norm(vectors[rows], axis=1) * np.linalg.norm(query)
+    assert np.allclose(vector, np.clip((cosine - 0.1) / 0.9, 0.0, 1.0), atol=1e-5)
+
+
+def test_rrf_favours_candidates_ranked_by_several_retrievers():
+    nan = np.nan
+    vector = np.array([0.9, 0.8, nan, 0.1])
+    keyword = np.array([nan, 0.5, 0.7, nan])
+    bm25 = np.array([nan, 4.0, 9.0, nan])
+
+    fused = query_model.fuse_ranks(vector, keyword, bm25)
+    rrf = lambda rank: 1.0 / (query_model.RRF_K + rank)
+    assert np.allclose(fused, [rrf(1), rrf(2) * 3, rrf(1) * 2, rrf(3)])
+    # Raw score scales do not matter, only the order within each retriever
+    assert np.allclose(fused, query_model.fuse_ranks(vector * 100, keyword, bm25))
+    ranked = query_model.select_relevant(fused, np.ones(4), 0.5)
+    assert ranked.tolist() == [1, 2, 0, 3]
+
+
+def test_relevance_is_absolute_and_thresholded():
+    half = query_model.BM25_RELEVANCE_HALF
+    vector = np.array([0.6, np.nan, 0.1, 0.05])
+    bm25 = np.array([np.nan, half, 3 * half, np.nan])
+    relevance = query_model.candidate_relevance(vector, bm25)
+    assert np.allclose(relevance, [0.6, 0.5, 0.75, 0.05])
+    # The same scores give the same relevance whatever the other candidates
+    alone = query_model.candidate_relevance(vector[:1], bm25[:1])
+    assert np.allclose(alone, relevance[:1])
+
+    fused = np.array([0.01, 0.03, 0.02, 0.04])
+    assert query_model.select_relevant(fused, relevance, 0.2).tolist() == [1, 2, 0]
+    # At least the best fused candidate is kept, even below the threshold
+    assert query_model.select_relevant(fused, relevance, 0.9).tolist() == [3]
+    # Candidates no retriever ranked are never selected
+    fused[1] = 0.0
+    assert 1 not in query_model.select_relevant(fused, relevance, 0.0)
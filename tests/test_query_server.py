@@ -0,0 +1,44 @@
+import json
+import types
+import pytest
+from query_server import QueryServer
+from config import DEFAULT_TOP_K, DEFAULT_MAX_CONTEXT_TOKENS
+
+
+def parse(request, searcher=None):
+    server = types.SimpleNamespace(model="stub", searcher=searcher)
+    return QueryServer.parse_request(server, json.dumps(request).encode("utf-8"))
+
+
+def test_defaults_are_filled_in_and_numbers_coerced():
+    request = parse({"query": "How do I change the port?", "k": "3"})
+    assert request["k"] == 3
+    assert request["max_context_tokens"] == DEFAULT_MAX_CONTEXT_TOKENS
+    assert isinstance(request["relevance_threshold"], float)
+    assert parse({"query": "q"})["k"] == DEFAULT_TOP_K
+
+
+@pytest.mark.parametrize(
+    "request_body, message",
+    [
+        ({"query": "q", "k": "abc"}, "'k' must be an integer"),
+        ({"query": "q", "k": 2.5}, "'k' must be an integer"),
+        ({"query": "q", "k": 0}, "'k' must be at least 1"),
+        ({"query": "q", "relevance_threshold": "x"}, "'relevance_threshold'"),
+        ({"query": "q", "max_context_tokens": None}, "'max_context_tokens'"),
+        ({"query": ""}, "'query' must be a non-empty string"),
+        ({"query": "q", "collections": "all"}, "'collections' must be a list"),
+        ({"query": "q", "collections": ["docs"]}, "not started with --collections"),
+        ([1], "JSON object"),
+    ],
+)
+def test_bad_requests_are_rejected_with_a_message(request_body, message):
+    with pytest.raises(ValueError, match=message):
+        parse(request_body)
+
+
+def test_unknown_collections_are_rejected():
+    searcher = types.SimpleNamespace(shards={"docs": None})
+    assert parse({"query": "q", "collections": ["docs"]}, searcher)
+    with pytest.raises(ValueError, match="Unknown collections: other"):
+        parse({"query": "q", "collections": ["docs", "other"]}, searcher)
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from term_table import pack_strings, unpack_string, save_term_table, TermTable
+
+
+def test_strings_round_trip_through_the_blob():
+    names = ["doc_a_chunk_0.txt", "", "naïve_chunk_1.txt"]
+    blob, offsets = pack_strings(names)
+    assert [unpack_string(blob, offsets[i], offsets[i + 1]) for i in range(3)] == names
+
+
+@pytest.mark.parametrize("mmap_files", [True, False])
+def test_terms_are_found_by_hash_and_text(tmp_path, mmap_files):
+    table_file, text_file = str(tmp_path / "terms.npy"), str(tmp_path / "text.npy")
+    terms = ["port", "model", "ollama", "é"]
+    save_term_table(table_file, text_file, terms, [0, 3, 5, 9], [3, 2, 4, 1])
+    table = TermTable(table_file, text_file, mmap_files)
+
+    assert len(table) == 4
+    rows = table.lookup(["ollama", "missing", "port", "é"])
+    assert [table.term(row) for row in rows] == ["ollama", "port", "é"]
+    assert table.starts[rows].tolist() == [5, 0, 9]
+    assert table.counts[rows].tolist() == [4, 3, 1]
+
+
+def test_an_empty_table_finds_nothing(tmp_path):
+    table_file, text_file = str(tmp_path / "terms.npy"), str(tmp_path / "text.npy")
+    save_term_table(table_file, text_file, [], [], [])
+    assert TermTable(table_file, text_file).lookup(["port"]).tolist() == []